@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Measure import time of the fitting modules in fresh interpreters."""
+import os
+import sys
+import subprocess
+import argparse as ap
+import numpy as np
+
+MODULES = ['fitting_scripts.FPModel', 'fitting_scripts.inputOutput',
+           'fitting_scripts.DF_fitting', 'fitting_scripts.plottingScripts']
+# modules that should only be loaded once plots or result files are written
+HEAVY = ['matplotlib.pyplot', 'mpltex', 'pandas', 'xlsxwriter', 'tables',
+         'fitting_scripts.plottingScripts', 'scipy.interpolate', 'scipy.signal', 'scipy.stats']
+# modules are imported from this checkout, wherever the benchmark is started
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SNIPPET = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [m for m in {heavy!r} if m in sys.modules and m != '{module}']
+print(elapsed, ','.join(heavy))
+"""
+
+
+def time_import(module, repeats=5):
+    """Import times in seconds and eagerly loaded heavy modules."""
+    times, heavy = [], ''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, '-c', SNIPPET.format(module=module, heavy=HEAVY)],
+                             check=True, capture_output=True, text=True, cwd=ROOT,
+                             env=env).stdout.split()
+        times.append(float(out[0]))
+        heavy = out[1] if len(out) > 1 else ''
+    return np.array(times), heavy
+
+
+def main():
+    parser = ap.ArgumentParser(description='Import time of the fitting modules.',
+                               formatter_class=ap.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', dest='repeats', type=int, default=5,
+                        help='Fresh interpreters per module.')
+    parser.add_argument('-m', dest='modules', type=str, nargs='+', default=MODULES,
+                        help='Modules to import.')
+    args = parser.parse_args()
+
+    print('%-34s %10s %10s   %s' % ('module', 'median ms', 'min ms', 'heavy modules loaded'))
+    for module in args.modules:
+        times, heavy = time_import(module, repeats=args.repeats)
+        print('%-34s %10.1f %10.1f   %s' % (module, 1e3*np.median(times), 1e3*np.min(times),
+                                           heavy or '-'))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Compare adjoint gradients of the per-bin objective with finite differences
+and check that a gradient costs a few model solves at any number of bins.
+"""
+import sys
+import time
+import argparse as ap
+import numpy as np
+from synthetic import synthetic_data, report, header, df, fp
+
+
+def fd_gradient(objective, theta, h=1e-6):
+    """Central finite difference gradient of the cost."""
+    grad = np.zeros_like(theta)
+    for i in range(theta.size):
+        step = np.zeros_like(theta)
+        step[i] = h
+        grad[i] = (objective(theta + step)[0] - objective(theta - step)[0]) / (2*h)
+    return grad
+
+
+def check_adjoint(alpha, seed=0, tol=1e-4):
+    """Relative deviation of the D and F halves of the adjoint gradient."""
+    xx, cc, tt, dxx_dist, dxx_width = synthetic_data()
+    rng = np.random.default_rng(seed)
+    dim = xx.size
+    # rough D, F profiles, D/D_scale around one as in perbin_optimization
+    theta = np.concatenate((1 + 2*rng.random(dim), rng.normal(0, 0.5, dim)))
+
+    def objective(theta):
+        return df.perbin_objective(theta, cc, tt, dxx_dist, dxx_width, alpha)
+    grad = objective(theta)[1]
+    grad_fd = fd_gradient(objective, theta)
+    ok = True
+    for name, part in (('D', slice(None, dim)), ('F', slice(dim, None))):
+        dev = np.max(np.abs(grad[part] - grad_fd[part])) / np.max(np.abs(grad_fd[part]))
+        ok &= report('adjoint vs finite differences, %s, alpha=%g' % (name, alpha), dev, tol)
+    return ok
+
+
+def best_time(fun, repeats=5):
+    """Shortest wall time of repeated calls, first call is not timed."""
+    fun()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fun()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def check_scaling(bins, max_ratio, seed=0):
+    """Time of cost and gradient relative to one forward solve of the profiles."""
+    # same 200 µm gel for every number of bins
+    xx, cc, tt, dxx_dist, dxx_width = synthetic_data(bins=bins, dx=200/bins)
+    rng = np.random.default_rng(seed)
+    theta = np.concatenate((1 + 2*rng.random(bins), rng.normal(0, 0.5, bins)))
+    D = np.concatenate((np.ones(6)*theta[0], theta[:bins]))*100
+    F = np.concatenate((np.ones(6)*theta[bins], theta[bins:]))
+    times = tt[1:]-tt[0]
+
+    def forward():
+        return fp.calcC_batch(cc[0], times, *fp.WMatrixVar_batch(D, F, 4, dxx_dist))
+
+    def gradient():
+        return df.perbin_objective(theta, cc, tt, dxx_dist, dxx_width, 0.5)
+    ratio = best_time(gradient) / best_time(forward)
+    return report('cost and gradient / forward solve, %i bins' % bins, ratio, max_ratio)
+
+
+def main():
+    parser = ap.ArgumentParser(description='Adjoint gradient check of the per-bin fit.',
+                               formatter_class=ap.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-tol', dest='tol', type=float, default=1e-4,
+                        help='Maximal deviation relative to the largest gradient entry.')
+    parser.add_argument('-max_ratio', dest='max_ratio', type=float, default=5,
+                        help='Maximal time of cost and gradient in forward solves.')
+    parser.add_argument('-bins', dest='bins', type=int, nargs='+', default=[100, 300, 1000],
+                        help='Numbers of bins for the timing check.')
+    args = parser.parse_args()
+    header()
+    ok = all([check_adjoint(alpha, tol=args.tol) for alpha in (0, 0.5)] +
+             [check_scaling(bins, args.max_ratio) for bins in args.bins])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
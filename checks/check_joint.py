@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Compare joint fits of two replicates with variable projection and with all
+scalings as fit parameters, with and without regularization.
+"""
+import sys
+import argparse as ap
+import numpy as np
+from synthetic import synthetic_data, report, header, PARAMETERS, df
+
+
+def joint_cost(x, data, alpha, varpro=False, scale_bnds=(0, 100)):
+    xx, ccs, tts, dxx_dist, dxx_width = data
+    return 0.5*np.sum(df.resFun_joint(x, xx, ccs, tts, dxx_dist, dxx_width, alpha,
+                                      varpro=varpro, scale_bnds=scale_bnds)**2)
+
+
+def check_joint(alpha, data, tol):
+    """Projected cost equals the full cost at the recovered scalings and is its minimum."""
+    xx, ccs, tts, dxx_dist, dxx_width = data
+    n_profiles = sum(len(cc)-1 for cc in ccs)
+    bnds, inits = df.initialize_optimization(1, 2, n_profiles, xx)
+    init = np.append(PARAMETERS*1.2, np.ones(n_profiles))
+    fit = df.joint_optimization(init, bnds, xx, ccs, tts, dxx_dist, dxx_width, alpha,
+                                workers=1, varpro=True)
+    scale_bnds = (bnds[0][6:], bnds[1][6:])
+    cost = joint_cost(fit.x[:6], data, alpha, varpro=True, scale_bnds=scale_bnds)
+    ok = report('varpro vs full cost at its scalings, alpha=%g' % alpha,
+                abs(joint_cost(fit.x, data, alpha) - cost) / cost, tol)
+    # all scalings free, started in the varpro optimum
+    full = df.joint_optimization(fit.x, bnds, xx, ccs, tts, dxx_dist, dxx_width, alpha,
+                                 workers=1)
+    ok &= report('full fit improves varpro optimum, alpha=%g' % alpha,
+                 (cost - full.cost) / cost, tol)
+    return ok
+
+
+def main():
+    parser = ap.ArgumentParser(description='Joint fits with and without projected scalings.',
+                               formatter_class=ap.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-tol', dest='tol', type=float, default=1e-6,
+                        help='Maximal relative deviation of the costs.')
+    args = parser.parse_args()
+    replicates = [synthetic_data(seed=seed) for seed in (1, 2)]
+    xx, cc, tt, dxx_dist, dxx_width = replicates[0]
+    data = (xx, [rep[1] for rep in replicates], [rep[2] for rep in replicates],
+            dxx_dist, dxx_width)
+    header()
+    ok = all([check_joint(alpha, data, args.tol) for alpha in (0, 0.1, 1)])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
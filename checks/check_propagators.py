@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the propagators and batched residuals with the reference calcC.
+
+Every check runs for the synthetic parameters and for a stiff parameter set,
+whose rates span about 16 orders of magnitude.
+"""
+import sys
+import argparse as ap
+import numpy as np
+from synthetic import synthetic_data, report, header, PARAMETERS, fp, df
+
+# D_sol at the lower bound, steep F step, rates from 1e-9 to 3e7
+STIFF = np.array([1.89e-3, 999.9, 16.5, -12.3, 7.65, 0.978])
+
+
+def reference(parameters, xx, cc, tt, dxx_dist):
+    """Profiles from calcC for every time separately, shape (bins, n_times)."""
+    W, F = df.rate_matrix(parameters, xx, dxx_dist)
+    return np.array([fp.calcC(cc[0], t=t-tt[0], W=W) for t in tt[1:]]).T, W
+
+
+def deviation(c, c_ref):
+    return np.max(np.abs(c - c_ref)) / np.max(np.abs(c_ref))
+
+
+def check_propagators(name, parameters, data, tol):
+    xx, cc, tt, dxx_dist, dxx_width = data
+    times = tt[1:]-tt[0]
+    c_ref, W = reference(parameters, xx, cc, tt, dxx_dist)
+    diagonals = fp.tridiag_diagonals(W[np.newaxis])
+    ok = report('%s: calcC_series vs calcC' % name,
+                deviation(np.array(fp.calcC_series(cc[0], times, W=W)).T, c_ref), tol)
+    if name != 'stiff':  # the plain batched eigh is known to fail there
+        ok &= report('%s: calcC_batch vs calcC' % name,
+                     deviation(fp.calcC_batch(cc[0], times, *diagonals)[0], c_ref), tol)
+    c_batch, fallbacks = df.batch_profiles(cc[0], times, diagonals, dxx_width)
+    ok &= report('%s: batch_profiles vs calcC, %i fallbacks' % (name, fallbacks),
+                 deviation(c_batch[0], c_ref), tol)
+    mass = np.dot(cc[0], dxx_width)
+    ok &= report('%s: batch_profiles mass conservation' % name,
+                 np.max(np.abs(dxx_width @ c_batch[0] - mass)) / mass, tol)
+    return ok
+
+
+def check_trbdf2(name, parameters, data, tol):
+    """TR-BDF2 with the step from banded_step, error is estimated, not bounded."""
+    xx, cc, tt, dxx_dist, dxx_width = data
+    c_ref, W = reference(parameters, xx, cc, tt, dxx_dist)
+    diagonals, F = df.banded_diagonals(parameters, xx, dxx_dist)
+    step, estimate = df.banded_step(parameters, xx, cc, tt, dxx_dist, tol)
+    c_trbdf2 = np.array(fp.calcC_trbdf2(cc[0], tt[1:]-tt[0], *diagonals, step=step)).T
+    ok = report('%s: calcC_trbdf2 vs calcC, step %g' % (name, step),
+                deviation(c_trbdf2, c_ref), tol)
+    ok &= report('%s: banded_step error estimate vs true error' % name,
+                 abs(estimate - np.max(np.abs(c_trbdf2 - c_ref))), tol)
+    mass = np.dot(cc[0], dxx_width)
+    ok &= report('%s: calcC_trbdf2 mass conservation' % name,
+                 np.max(np.abs(dxx_width @ c_trbdf2 - mass)) / mass, 1e-10)
+    return ok
+
+
+def check_residuals(name, parameters, data, tol):
+    xx, cc, tt, dxx_dist, dxx_width = data
+    ok = True
+    for alpha in (0, 0.1):
+        x = np.append(parameters, 1 + 0.1*np.sin(np.arange(len(cc)-1)))  # with scalings
+        RR = df.resFun(x, xx, cc, tt, dxx_dist, dxx_width, alpha)
+        RR_batch = df.resFun_batch(np.array([x, x]), xx, cc, tt, dxx_dist, dxx_width, alpha)
+        ok &= report('%s: resFun_batch vs resFun, alpha=%g' % (name, alpha),
+                     np.max(np.abs(RR_batch - RR)) / np.max(np.abs(RR)), tol)
+        cost = 0.5*np.sum(df.resFun_varpro(parameters, xx, cc, tt, dxx_dist, dxx_width,
+                                           alpha)**2)
+        cost_batch = df.cost_batch(parameters, xx, cc, tt, dxx_dist, dxx_width, alpha)[0]
+        ok &= report('%s: cost_batch vs resFun_varpro, alpha=%g' % (name, alpha),
+                     abs(cost_batch - cost) / cost, tol)
+    return ok
+
+
+def main():
+    parser = ap.ArgumentParser(description='Consistency checks of the propagators.',
+                               formatter_class=ap.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-tol', dest='tol', type=float, default=1e-6,
+                        help='Maximal relative deviation from the reference.')
+    parser.add_argument('-engine_tol', dest='engine_tol', type=float, default=1e-4,
+                        help='Tolerance of the TR-BDF2 time step.')
+    args = parser.parse_args()
+    data = synthetic_data()
+    header()
+    ok = True
+    for name, parameters in (('synthetic', PARAMETERS), ('stiff', STIFF)):
+        parameters = np.asarray(parameters, dtype=float)
+        ok &= check_propagators(name, parameters, data, args.tol)
+        ok &= check_trbdf2(name, parameters, data, args.engine_tol)
+        ok &= check_residuals(name, parameters, data, args.tol)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Smoke check of the fit-job service on this machine.
+
+Starts the service with one warm worker on a free port, checks job
+validation, the JSON API, the NDJSON event stream and that a repeated job
+reuses the propagations of the first one.
+"""
+import os
+import sys
+import json
+import tempfile
+import threading
+import http.server
+import urllib.error
+import urllib.request
+import argparse as ap
+import numpy as np
+from synthetic import save_synthetic, passed
+import fitting_scripts.service as sv
+
+INVALID = [({'dt': 10, 'colour': 'red'}, 'unknown job fields'),
+           ({'dt': 10, 'path': 'missing.txt'}, 'data file not found'),
+           ({}, 'dt is required'),
+           ({'dt': 10, 'kind': 'plot'}, "kind must be"),
+           ({'dt': 10, 'kind': 'profiles'}, 'need parameters'),
+           ({'dt': 10, 'bc': 'open'}, "bc must be")]
+
+
+def request(url, payload=None):
+    """Status code and decoded JSON of a GET, or POST if payload is given."""
+    data = None if payload is None else json.dumps(payload).encode()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data)) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as err:
+        return err.code, json.loads(err.read())
+
+
+def events(url, payload):
+    """Post a job and read its event stream, every line must be one JSON object."""
+    code, answer = request(url + '/jobs', payload)
+    with urllib.request.urlopen(url + answer['events']) as response:
+        content_type = response.headers.get('Content-Type')
+        lines = [line.decode() for line in response]
+    return content_type, [json.loads(line) for line in lines if line.strip()]
+
+
+def check_validation(path):
+    ok = True
+    for payload, message in INVALID:
+        payload = dict({'path': path}, **payload)
+        try:
+            sv.job_spec(payload)
+            error = ''
+        except ValueError as err:
+            error = str(err)
+        ok &= passed('job_spec error: %s' % message, message in error)
+    spec = sv.job_spec({'path': path, 'dt': 10})
+    ok &= passed('job_spec fills in defaults', spec['runs'] == sv.DEFAULTS['runs'] and
+                 os.path.isabs(spec['path']))
+    return ok
+
+
+def check_api(url, path):
+    ok = passed('GET /health', request(url + '/health')[0] == 200)
+    code, answer = request(url + '/jobs', {'path': path})
+    ok &= passed('POST /jobs with invalid job', code == 400 and 'dt' in answer['error'],
+                 str(code))
+    ok &= passed('GET /jobs/999 of unknown job', request(url + '/jobs/999')[0] == 404)
+
+    job = {'path': path, 'dt': 10, 'runs': 2, 'seed': 3}
+    content_type, first = events(url, job)
+    names = [event['event'] for event in first]
+    ok &= passed('event stream is NDJSON', content_type == 'application/x-ndjson',
+                 content_type)
+    ok &= passed('events started, run, run, done', names == ['started', 'run', 'run', 'done'],
+                 ','.join(names))
+    result = first[-1]['result']
+    ok &= passed('result holds D, F and profiles', all(key in result for key in
+                                                        ('x', 'D', 'F', 'cc_theo', 'cost')))
+    # same seeds in the same worker, every propagation is found in the cache
+    _, second = events(url, job)
+    runs = [[event for event in stream if event['event'] == 'run'] for stream in (first, second)]
+    costs = [sorted(event['cost'] for event in stream) for stream in runs]
+    hits = [sum(event['cache_hits'] for event in stream) for stream in runs]
+    ok &= passed('repeated job gives the same costs', np.allclose(*costs))
+    ok &= passed('repeated job reuses propagations', hits[1] > hits[0],
+                 'hits %i -> %i' % tuple(hits))
+
+    _, profiles = events(url, {'path': path, 'dt': 10, 'kind': 'profiles',
+                               'parameters': result['x']})
+    ok &= passed('profiles job for the best fit', profiles[-1]['event'] == 'done' and
+                 np.isclose(profiles[-1]['result']['error'], result['error']))
+    return ok
+
+
+def main():
+    parser = ap.ArgumentParser(description='Smoke check of the fit-job service.',
+                               formatter_class=ap.ArgumentDefaultsHelpFormatter)
+    parser.parse_args()
+    service = sv.FitService(workers=1, bins=40)  # one worker, caches are per process
+    sv.Handler.service = service
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), sv.Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%i' % server.server_address[1]
+    print('%-52s %25s' % ('check', 'detail'))
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            path = save_synthetic(os.path.join(folder, 'data.txt'))
+            ok = check_validation(path)
+            ok &= check_api(url, path)
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.shutdown()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Synthetic concentration profiles for the check scripts, no data files needed."""
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fitting_scripts.FPModel as fp  # noqa: E402
+import fitting_scripts.DF_fitting as df  # noqa: E402
+
+# D_sol, D_gel, F_sol, F_gel, t_sig, d_sig of the synthetic data
+PARAMETERS = np.array([300, 50, 0, -1, 20, 5])
+
+
+def step_profile(xx):
+    """Initial profile, particles only in the first 20 µm."""
+    return np.where(xx < 20, 1.0, 0.0)
+
+
+def synthetic_data(parameters=PARAMETERS, bins=40, dx=5., n_t=10, dt=10, noise=0.005, seed=1):
+    """
+    Noisy, randomly scaled profiles for a step initial profile.
+
+    returns xx, cc with t=0 profile on the full grid, tt, dxx_dist, dxx_width
+    """
+    rng = np.random.default_rng(seed)
+    xx = np.arange(bins)*dx
+    tt = np.arange(n_t)*dt
+    cc = fp.build_zero_profile(np.c_[step_profile(xx), np.zeros((bins, n_t-1))])
+    dxx_dist, dxx_width = fp.discretization_Block(xx)
+    cc_theo = df.theoretical_profiles(np.asarray(parameters, dtype=float), xx, cc, tt,
+                                      dxx_dist, dxx_width)
+    cc = [cc[0]] + [c[6:]/(1 + 0.1*np.sin(i)) + rng.normal(0, noise, bins)
+                    for i, c in enumerate(cc_theo)]
+    return xx, cc, tt, dxx_dist, dxx_width
+
+
+def save_synthetic(path, **kwargs):
+    """Write synthetic profiles as data file for DF_fitting, options as synthetic_data."""
+    xx, cc, tt, dxx_dist, dxx_width = synthetic_data(**kwargs)
+    np.savetxt(path, np.c_[xx, step_profile(xx), np.array(cc[1:]).T], delimiter=',')
+    return path
+
+
+def report(name, value, tol):
+    """Print one check, returns True if value is within tol."""
+    ok = bool(value <= tol)
+    print('%-52s %12.3g %12.3g   %s' % (name, value, tol, 'ok' if ok else 'FAILED'))
+    return ok
+
+
+def passed(name, ok, detail=''):
+    """Print one check without numerical deviation, returns ok."""
+    print('%-52s %25s   %s' % (name, detail, 'ok' if ok else 'FAILED'))
+    return bool(ok)
+
+
+def header():
+    print('%-52s %12s %12s' % ('check', 'deviation', 'tolerance'))
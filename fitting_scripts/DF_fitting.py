@@ -1,41 +1,98 @@
 # -*- coding: utf-8 -*-
 """Fitting DF while also rescaling profiles"""
-# use this for matplotlib on the cluster
-# import matplotlib
-# matplotlib.use('Agg')
+# plotting, excel and hdf modules are imported on first use, the Agg
+# backend is chosen automatically on headless nodes (see io.select_backend)
 import sys
 import os
+import logging
+import threading
+import collections
 import numpy as np
 import functools as ft
+import concurrent.futures as cf
 import time
-import xlsxwriter as xl
-import pandas as pd
 import fitting_scripts.inputOutput as io
 import fitting_scripts.FPModel as fp
-import fitting_scripts.plottingScripts as ps
+import fitting_scripts.execution as ex
+import fitting_scripts.artifacts as art
+import fitting_scripts.bundle as bd
 import scipy.optimize as op
+import scipy.linalg as al
 import scipy.special as sp
+import scipy.sparse as sp_sparse
+
+xl = io.lazy_import('xlsxwriter')
+pd = io.lazy_import('pandas')
+ps = io.lazy_import('fitting_scripts.plottingScripts')
+logger = logging.getLogger(__name__)
 startTime = time.time()  # start measuring run time
 
 
-def save_data(xx, dxx_width, cc_scaled_best, cc_scaled_means, cc_theo_best, cc_theo_mean,
-              tt_og, tt_ext, errors, t_best, t_mean, best_params, avg_params, std_params, D_mean,
-              D_best, F_mean, F_best, D_std, F_std, scalings_mean, scalings_std, scalings_best,
-              c_bulk_mean, c_bulk_std, c_bulk_best, nbr_runs, alpha, crit_err, savePath,
-              x_tot=1780):
-    """Make plots and save analyzed data."""
+REPORTS = ('bundle', 'txt', 'xlsx', 'figures')
+
+
+def report_selection(reports):
+    """Expand -reports choices to a set of artifacts, 'numbers' is bundle, txt and xlsx."""
+    selection = set()
+    for report in reports:
+        if report == 'all':
+            selection.update(REPORTS)
+        elif report == 'numbers':
+            selection.update(('bundle', 'txt', 'xlsx'))
+        elif report != 'none':
+            selection.add(report)
+    return selection
+
+
+def render_figure(name, args, kwargs):
+    """Render one figure of plottingScripts, run in worker processes."""
+    getattr(ps, name)(*args, **kwargs)
+    return name
+
+
+def figure_jobs(xx, dxx_width, cc_scaled_best, cc_scaled_means, cc_theo_best, cc_theo_mean,
+                tt_og, tt_ext, errors, error_mean, t_best, t_mean, D_mean, D_best, F_mean,
+                F_best, D_std, F_std, scalings_mean, scalings_std, c_bulk_mean, c_bulk_std,
+                savePath):
+    """Arguments of all figures of save_data, as (name, args, kwargs)."""
+    # build accurate xx-vector
+    xx_pre = np.array([np.sum(dxx_width[i:6]) for i in range(6)])
+    xx_scale = np.concatenate((xx_pre, xx))  # zero is at bin 6
+    # for labeling the x-axis correctly, first 4 bins at different separation
+    xx_dummy = np.concatenate(([0, 6, 12, 18], np.arange(cc_theo_best[:, 0].size-4)+19))
+    xlabels = [np.append(xx_dummy[:3], xx_dummy[6::5]).astype(int),
+               np.append(xx_scale[:3], xx_scale[6::5]).astype(int)]
+    # plotting profiles for averaged and best parameters
+    t_best = t_best/abs(xx[1]-xx[0]) + 19 + 2  # scale transition to new x-vector
+    t_mean = t_mean/abs(xx[1]-xx[0]) + 19 + 2
+    return [('figure_combined',
+             (xx_dummy, xlabels, cc_scaled_best, cc_theo_best, tt_ext, t_best, D_best,
+              F_best-F_best[0], np.zeros(D_best.size), np.zeros(F_best.size), errors[0]),
+             dict(plt_profiles=12, save=True, savePath=savePath, suffix='best')),
+            ('figure_combined',
+             (xx_dummy, xlabels, cc_scaled_means, cc_theo_mean, tt_ext, t_mean, D_mean,
+              F_mean-F_mean[0], D_std, F_std, error_mean),
+             dict(plt_profiles=12, save=True, savePath=savePath, suffix='avg')),
+            # plotting fitted average bulk concentration
+            ('plot_scalings', (scalings_mean, scalings_std, c_bulk_mean, c_bulk_std, tt_og[1:]),
+             dict(save=True, savePath=savePath))]
+
+
+def save_txt(arrays, info, savePath):
+    """Render analyzed profiles, DF and scalings of a result bundle as txt files."""
     # header for txt file in which concentration profiles will be saved
     header_cons = ''
-    for i, t in enumerate(tt_ext):
+    for i, t in enumerate(arrays['tt_ext']):
         header_cons += ('column%i: c-profile for t_%i = %i s\n'
                         % (i+1, i, int(t)))
     # saving numerical profiles
-    np.savetxt(savePath+'cc_theo_best.txt', cc_theo_best, delimiter=',',
+    np.savetxt(savePath+'cc_theo_best.txt', arrays['cc_theo_best'], delimiter=',',
                header='Numerically computed concentration profiles\n'+header_cons)
-    np.savetxt(savePath+'cc_theo_avg.txt', cc_theo_mean, delimiter=',',
+    np.savetxt(savePath+'cc_theo_avg.txt', arrays['cc_theo_avg'], delimiter=',',
                header='Numerically computed concentration profiles\n'+header_cons)
     # saving averaged DF
-    np.savetxt(savePath+'DF_avg.txt', np.c_[D_mean, D_std, F_mean-F_mean[0], F_std],
+    np.savetxt(savePath+'DF_avg.txt', np.c_[arrays['D_avg'], arrays['D_std'], arrays['F_avg'],
+                                            arrays['F_std']],
                delimiter=',',
                header=('Diffusivity and free energy profiles from analysis\n'
                        'cloumn1: average diffusivity [micro_m^2/s]\n'
@@ -43,7 +100,7 @@ def save_data(xx, dxx_width, cc_scaled_best, cc_scaled_means, cc_theo_best, cc_t
                        'cloumn3: average free energy [k_BT]\n'
                        'cloumn4: stdev of free energy [+/- k_BT]'))
     # saving best DF
-    np.savetxt(savePath+'DF_best.txt', np.c_[D_best, F_best-F_best[0]],
+    np.savetxt(savePath+'DF_best.txt', np.c_[arrays['D_best'], arrays['F_best']],
                delimiter=',',
                header=('Diffusivity and free energy profiles with lowest '
                        'error from analysis\n'
@@ -51,48 +108,29 @@ def save_data(xx, dxx_width, cc_scaled_best, cc_scaled_means, cc_theo_best, cc_t
                        'cloumn2: free energy [k_BT]'))
 
     # saving Error of top 1% of runs
+    errors = arrays['errors']
     np.savetxt(savePath+'minError.txt', errors, delimiter=',',
-               header=(('Minimal error averaged over %i/%i runs, ' % (errors.size, nbr_runs)) +
-                       ('%i%% deviation from minimal error included.') % (crit_err*100)))
+               header=(('Minimal error averaged over %i/%i runs, ' % (errors.size, info['runs'])) +
+                       ('%i%% deviation from minimal error included.') % (info['crit_err']*100)))
     # saving fitted average bulk concentrations
-    np.savetxt(savePath+'scalings_avg.txt', np.c_[c_bulk_mean, c_bulk_std, scalings_mean, scalings_std],
+    np.savetxt(savePath+'scalings_avg.txt', np.c_[arrays['c_bulk_avg'], arrays['c_bulk_std'],
+                                                  arrays['scalings_avg'], arrays['scalings_std']],
                delimiter=',',
                header=('Fitted bulk concentration, averaged over all runs.\n'
                        'column1: averaged bulk concentration\n'
                        'column2: bulk concentration standart deviation\n'
                        'column3: averaged scaling coefficients\n'
                        'column2: scaling coefficients standart deviation\n'))
-    np.savetxt(savePath+'scalings_best.txt', np.c_[c_bulk_best, scalings_best], delimiter=',',
+    np.savetxt(savePath+'scalings_best.txt', np.c_[arrays['c_bulk_best'], arrays['scalings_best']],
+               delimiter=',',
                header=('Fitted bulk concentration and scaling coefficients for best run.\n'
                        'column1: bulk concentration\n'
                        'column2: scaling coefficients'))
 
-    # build accurate xx-vector
-    xx_pre = np.array([np.sum(dxx_width[i:6]) for i in range(6)])
-    xx_scale = np.concatenate((xx_pre, xx))  # zero is at bin 6
-    # for labeling the x-axis correctly, first 4 bins at different separation
-    xx_dummy = np.concatenate(([0, 6, 12, 18], np.arange(cc_theo_best[:, 0].size-4)+19))
-    xlabels = [np.append(xx_dummy[:3], xx_dummy[6::5]).astype(int),
-               np.append(xx_scale[:3], xx_scale[6::5]).astype(int)]
-    # plotting profiles for averaged and best parameters
-    t_best = t_best/abs(xx[1]-xx[0]) + 19 + 2  # scale transition to new x-vector
-    t_mean = t_mean/abs(xx[1]-xx[0]) + 19 + 2
-    # compute error for averaged parameters
-    residuals = np.array([c_exp - c_num[6:] for c_exp, c_num in zip(cc_scaled_means[1:],
-                                                                    cc_theo_mean[:, 1:].T)])
-    error_mean = np.sqrt(np.sum(residuals**2) / (cc_scaled_means[1].size *
-                                                 len(cc_scaled_means[1:])))
-    ps.figure_combined(xx_dummy, xlabels, cc_scaled_best, cc_theo_best, tt_ext, t_best,
-                       D_best, F_best-F_best[0], np.zeros(D_best.size), np.zeros(F_best.size),
-                       errors[0], plt_profiles=12, save=True, savePath=savePath, suffix='best')
-    ps.figure_combined(xx_dummy, xlabels, cc_scaled_means, cc_theo_mean, tt_ext, t_mean,
-                       D_mean, F_mean-F_mean[0], D_std, F_std, error_mean, plt_profiles=12, save=True,
-                       savePath=savePath, suffix='avg')
-    # plotting fitted average bulk concentration
-    ps.plot_scalings(scalings_mean, scalings_std, c_bulk_mean, c_bulk_std, tt_og[1:],
-                     save=True, savePath=savePath)
-
-    # saving data to excel spreadsheet
+
+def save_xlsx(arrays, info, savePath):
+    """Render parameter table of a result bundle as excel spreadsheet."""
+    best_params, avg_params, std_params = arrays['x_best'], arrays['x_avg'], arrays['x_std']
     workbook = xl.Workbook(savePath+'results.xlsx')
     worksheet = workbook.add_worksheet()
     bold = workbook.add_format({'bold': True})
@@ -107,20 +145,11 @@ def save_data(xx, dxx_width, cc_scaled_best, cc_scaled_means, cc_theo_best, cc_t
     worksheet.write('A5', 't_sig [µm]', bold)
     worksheet.write('A6', 'd_sig [µm]', bold)
     worksheet.write('A7', 'error', bold)
-    if alpha > 0:  # save regularization results
+    if info['alpha'] > 0:  # save regularization results
         worksheet.write('A8', '||x - x_ref||', bold)
         worksheet.write('A9', '||A*x - y||', bold)
-        # compute difference to solution, use best fit results
-        residuals_best = np.array([c_exp - c_num[6:] for c_exp, c_num in
-                                   zip(cc_scaled_best[1:], cc_theo_best[:, 1:].T)])
-        err_sol = np.sqrt(np.sum(residuals_best**2) / (cc_scaled_best[1].size *  # ||A*x - y||, only scaled to physical units
-                                                       len(cc_scaled_best[1:])))
-        # compute regularization term, use best fit results
-        err_reg = regularization_term(best_params[:2], best_params[2:4],
-                                      best_params[4], best_params[5],
-                                      best_params[6:], alpha=1)  # ||x - x_ref||
-        worksheet.write('D8', '%.5f' % err_reg)  # write to table
-        worksheet.write('D9', '%.5f' % err_sol)
+        worksheet.write('D8', '%.5f' % arrays['error_reg'])  # write to table
+        worksheet.write('D9', '%.5f' % arrays['error_sol'])
 
     # gather original parameters
     means = [avg_params[0], avg_params[1], (avg_params[3]-avg_params[2]),
@@ -134,37 +163,137 @@ def save_data(xx, dxx_width, cc_scaled_best, cc_scaled_means, cc_theo_best, cc_t
     for row, params in enumerate(zip(means, stdevs, bests)):
         for column, values in zip(['B', 'C', 'D'], params):
             worksheet.write('%s%i' % (column, (row+2)), '%.5f' % values)
-    worksheet.write('D7', '%.5f' % np.min(errors))  # write also error
-    worksheet.write('B7', '%.5f' % error_mean)
+    worksheet.write('D7', '%.5f' % np.min(arrays['errors']))  # write also error
+    worksheet.write('B7', '%.5f' % arrays['error_avg'])
 
     # adjusting cell widths
     worksheet.set_column(0, 15, len('Standart Deviation'))
     workbook.close()
 
 
-def average_data(result, xx, cc, crit_err):
+def bundle_arrays(xx, dxx_width, cc_scaled_best, cc_scaled_means, cc_theo_best, cc_theo_mean,
+                  tt_og, tt_ext, errors, error_mean, best_params, avg_params, std_params,
+                  D_mean, D_best, F_mean, F_best, D_std, F_std, scalings_mean, scalings_std,
+                  scalings_best, c_bulk_mean, c_bulk_std, c_bulk_best):
+    """All numerical outputs of the analysis as arrays of the result bundle."""
+    # compute difference to solution, use best fit results, ||A*x - y||
+    residuals_best = np.array([c_exp - c_num[6:] for c_exp, c_num in
+                               zip(cc_scaled_best[1:], cc_theo_best[:, 1:].T)])
+    err_sol = np.sqrt(np.sum(residuals_best**2) / (cc_scaled_best[1].size *
+                                                   len(cc_scaled_best[1:])))
+    # compute regularization term, use best fit results, ||x - x_ref||
+    err_reg = np.linalg.norm(regularization_term(best_params[:2], best_params[2:4],
+                                                 best_params[4], best_params[5],
+                                                 best_params[6:], alpha=1))
+    return {'xx': xx, 'dxx_width': dxx_width, 'tt': np.asarray(tt_og), 'tt_ext': tt_ext,
+            'c0': cc_scaled_best[0], 'cc_scaled_best': np.array(cc_scaled_best[1:]).T,
+            'cc_scaled_avg': np.array(cc_scaled_means[1:]).T, 'cc_theo_best': cc_theo_best,
+            'cc_theo_avg': cc_theo_mean, 'D_best': D_best, 'F_best': F_best-F_best[0],
+            'D_avg': D_mean, 'D_std': D_std, 'F_avg': F_mean-F_mean[0], 'F_std': F_std,
+            'x_best': best_params, 'x_avg': avg_params, 'x_std': std_params,
+            'errors': errors, 'error_avg': np.float64(error_mean), 'error_sol': err_sol,
+            'error_reg': err_reg, 'scalings_best': scalings_best,
+            'scalings_avg': scalings_mean, 'scalings_std': scalings_std,
+            'c_bulk_best': np.asarray(c_bulk_best), 'c_bulk_avg': np.asarray(c_bulk_mean),
+            'c_bulk_std': np.asarray(c_bulk_std)}
+
+
+def render_reports(savePath, reports):
+    """Render txt and xlsx reports from the result bundle in savePath."""
+    reports = report_selection(reports)
+    if not reports & {'txt', 'xlsx'}:
+        return
+    arrays, manifest = bd.read_bundle(savePath)
+    if 'txt' in reports:
+        save_txt(arrays, manifest['parameters'], savePath)
+    if 'xlsx' in reports:
+        save_xlsx(arrays, manifest['parameters'], savePath)
+
+
+def save_data(xx, dxx_width, cc_scaled_best, cc_scaled_means, cc_theo_best, cc_theo_mean,
+              tt_og, tt_ext, errors, t_best, t_mean, best_params, avg_params, std_params, D_mean,
+              D_best, F_mean, F_best, D_std, F_std, scalings_mean, scalings_std, scalings_best,
+              c_bulk_mean, c_bulk_std, c_bulk_best, nbr_runs, alpha, crit_err, savePath,
+              x_tot=1780, reports=REPORTS, workers=None, info=None):
+    """
+    Make plots and save analyzed data.
+
+    All numbers are collected in one result bundle (see bundle.py), txt and
+    xlsx files are renderings of it.
+    reports -   artifacts to write, subset of REPORTS
+    workers -   processes rendering the figures, while bundle, txt and xlsx
+                files are written by the calling process
+    info    -   further analysis parameters for the bundle manifest
+    """
+    reports = report_selection(reports)
+    # compute error for averaged parameters
+    residuals = np.array([c_exp - c_num[6:] for c_exp, c_num in zip(cc_scaled_means[1:],
+                                                                    cc_theo_mean[:, 1:].T)])
+    error_mean = np.sqrt(np.sum(residuals**2) / (cc_scaled_means[1].size *
+                                                 len(cc_scaled_means[1:])))
+
+    pool, futures = None, []
+    if 'figures' in reports:
+        jobs = figure_jobs(xx, dxx_width, cc_scaled_best, cc_scaled_means, cc_theo_best,
+                           cc_theo_mean, tt_og, tt_ext, errors, error_mean, t_best, t_mean,
+                           D_mean, D_best, F_mean, F_best, D_std, F_std, scalings_mean,
+                           scalings_std, c_bulk_mean, c_bulk_std, savePath)
+        pool = ex.process_pool(cc_theo_best.shape[0], n_tasks=len(jobs), workers=workers)
+        futures = [pool.submit(render_figure, *job) for job in jobs]
+
+    arrays = bundle_arrays(xx, dxx_width, cc_scaled_best, cc_scaled_means, cc_theo_best,
+                           cc_theo_mean, tt_og, tt_ext, errors, error_mean, best_params,
+                           avg_params, std_params, D_mean, D_best, F_mean, F_best, D_std, F_std,
+                           scalings_mean, scalings_std, scalings_best, c_bulk_mean, c_bulk_std,
+                           c_bulk_best)
+    info = dict(info or {}, runs=int(nbr_runs), alpha=float(alpha), crit_err=float(crit_err),
+                x_tot=x_tot)
+    if 'bundle' in reports:
+        bd.write_bundle(arrays, info, savePath)
+    if 'txt' in reports:
+        save_txt(arrays, info, savePath)
+    if 'xlsx' in reports:
+        save_xlsx(arrays, info, savePath)
+
+    if pool is not None:
+        for future in futures:
+            future.result()  # re-raises errors from rendering
+        pool.shutdown()
+
+
+def run_table(result):
+    """Costs and parameters of all runs in .hdf storage, the slow part for large stores."""
+    key_list = np.array(list(result.root._v_children.keys()))  # key list to easily iterate over
+    cost = np.array([result[key]['cost'].values[0] for key in key_list])
+    x = np.array([result[key+'/x'].values[:, 0] for key in key_list])
+    return {'keys': key_list, 'cost': cost, 'x': x}
+
+
+def average_data(result, xx, cc, crit_err, table=None):
     """
     Gather and average data from all optimization runs.
 
     crit_err    -   describes the percent of deviation from minimal error
                     for which results will be included in average
+    table       -   costs and parameters as from run_table, read from result if None
     """
+    if table is None:
+        table = run_table(result)
     # used to later compute normalized error
     n_profiles = len(cc)  # number of profiles
     bins = cc[1].size  # number of bins
     combis = n_profiles-1  # number of combinations for different c-profiles
 
     # loading error values, factor two, because of cost function definition
-    key_list = np.array(list(result.root._v_children.keys()))  # key list to easily iterate over
-    error = np.array([np.sqrt(2*result[key]['cost'].values[0] / (bins*combis)) for key in key_list])
+    error = np.sqrt(2*table['cost'] / (bins*combis))
     # now determine results to include for averaging, based on distance to minimal error
     err_lim = np.min(error) + np.min(error)*crit_err  # limit in error to include for averaging
     indices = error < err_lim  # index mask for results to include
 
     # gathering mean for all parameters
-    averages = np.mean([result[key+'/x'].values[:, 0] for key in key_list[indices]], axis=0)
-    stdevs = np.std([result[key+'/x'].values[:, 0] for key in key_list[indices]], axis=0)
-    best_results = result[key_list[np.argmin(error)]+'/x'].values[:, 0]
+    averages = np.mean(table['x'][indices], axis=0)
+    stdevs = np.std(table['x'][indices], axis=0)
+    best_results = table['x'][np.argmin(error)]
 
     # splitting up parameters to compute D, F profiles
     D_mean, F_mean, t_mean, d_mean = averages[:2], averages[2:4], averages[4], averages[5]
@@ -182,12 +311,9 @@ def average_data(result, xx, cc, crit_err):
 
     # computing errors using error propagation for Dsol, Dmuc or Fsol, Fmuc
     # contributions of t, d neglected for now...
-    DSTD_pre = np.array([np.sqrt(((0.5 - sp.erf((x-t_mean)/(np.sqrt(2)*d_mean))/2) *
-                                  D_std[0])**2 + ((0.5 + sp.erf((x-t_mean)/(np.sqrt(2)*d_mean))/2) *
-                                                  D_std[1])**2) for x in xx])
-    FSTD_pre = np.array([np.sqrt(((0.5 - sp.erf((x-t_mean)/(np.sqrt(2)*d_mean))/2) *
-                                  F_std[0])**2 + ((0.5 + sp.erf((x-t_mean)/(np.sqrt(2)*d_mean))/2) *
-                                                  F_std[1])**2) for x in xx])
+    erf = sp.erf((xx-t_mean)/(np.sqrt(2)*d_mean))
+    DSTD_pre = np.sqrt(((0.5 - erf/2)*D_std[0])**2 + ((0.5 + erf/2)*D_std[1])**2)
+    FSTD_pre = np.sqrt(((0.5 - erf/2)*F_std[0])**2 + ((0.5 + erf/2)*F_std[1])**2)
     # now keeping fixed stdev of D, F in first 6 bins
     DSTD, FSTD = fp.computeDF(DSTD_pre, FSTD_pre, shape=segments)
     error_sorted = np.sort(error[indices])  # sort errors for used runs
@@ -196,32 +322,28 @@ def average_data(result, xx, cc, crit_err):
             F_mean, D_mean, t_mean, d_mean, FSTD, DSTD, error_sorted)
 
 
-def cross_checking(W, cc, tt, dxx_width, dxx_dist):
-    """Check numerical model for conservation of concentration."""
-    # Column sum does not vanish anymore for variable binning, but equal
-    # positive and negative terms appear at binning transition --> total sum vanishes
-    if abs(np.sum((np.sum(W, 0)))) > 0.01:
-        print("WMatrix total sum does not vanish!\nMax is:",
-              np.max(np.sum(W, 0)), '\nFor each column:\n', np.sum(W, 0))
-        sys.exit()
+def cross_checking(W, F, dxx_width, rtol=1e-8):
+    """
+    Check numerical model for conservation of concentration.
 
-    # testing conservation of concentration
-    con = np.sum(cc[0]*dxx_width)
-    # compute profiles from c0 and do the same conservation check
-    ccComp = [fp.calcC(cc[0], t=t, W=W) for t in tt]
-
-    if np.any(np.array([abs(np.sum(c*dxx_width)-con)
-                        for c in ccComp]) > 0.01*con):
-        print('Error: Computed concentration '
-              'is not conserved in profiles: \n',
-              np.nonzero(np.array([abs(np.sum(c*dxx_width)-con)
-                                   for c in ccComp]) > 0.01*con))
-        print([np.sum(c*dxx_width) for c in ccComp], '\n')
-        print('concentration:\n', con)
-        print('WMatrix Size:\n', W.shape)
-        print('WMatrix Row Sum:\n', np.sum(W, 0))
-        print('WMatrix 2Sum:\n', np.sum(np.sum(W, 0)))
-        sys.exit()
+    Invariants are checked on the diagonals of W only (see
+    fp.check_invariants), cheap enough for every residual evaluation.
+    Violations are logged, the fit continues.
+    W, F    -   single rate matrix and free energy, or stacked diagonals
+                (main, upper, lower) and F of shape (n_sets, bins)
+    returns True if all invariants hold within rtol
+    """
+    diagonals = fp.tridiag_diagonals(W) if isinstance(W, np.ndarray) else W
+    violations = fp.check_invariants(*diagonals, F, dxx_width)
+    ok = True
+    for name, err in violations.items():
+        failed = ~(np.atleast_1d(err) <= rtol)  # NaN counts as violation
+        if np.any(failed):
+            ok = False
+            logger.warning('WMatrix violates %s invariant in %i of %i matrices, '
+                           'max. rel. deviation %.3g', name, np.sum(failed), failed.size,
+                           np.max(err))
+    return ok
 
 
 def initialize_optimization(runs, params, n_profiles, xx, DMax=1000, FMax=20):
@@ -253,6 +375,47 @@ def initialize_optimization(runs, params, n_profiles, xx, DMax=1000, FMax=20):
     return bnds, inits
 
 
+def continuation_starts(path, runs, bnds, crit_err=0.3, min_spread=1e-2, rng=None):
+    """
+    Start values from the runs of a previous, related data set.
+
+    The first start is the best run of the previous store, the others are
+    perturbed with the spread of the physical parameters of all runs within
+    crit_err of its error, as in average_data. Scalings start at one, the
+    number of profiles may differ between the data sets.
+    path        -   previous .h5 run store, or folder containing results.h5
+    min_spread  -   lower limit of the spread as fraction of the bounds, used
+                    if only few previous runs agree
+    returns starts and x_scale for the trust region, spread of the parameters
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, 'results.h5')
+    if not os.path.exists(path):
+        print('Error: No previous run store at %s for continuation.' % path)
+        sys.exit()
+    with pd.HDFStore(path, mode='r') as previous:
+        table = run_table(previous)
+    if table['cost'].size == 0:
+        print('Error: Previous run store %s holds no runs.' % path)
+        sys.exit()
+    # costs are compared relative to the best run, normalization cancels
+    error = np.sqrt(table['cost'])
+    indices = error < np.min(error)*(1 + crit_err)
+    physical = table['x'][:, :6]
+    best = physical[np.argmin(error)]
+    lower, upper = bnds[0][:6], bnds[1][:6]
+    spread = np.maximum(np.std(physical[indices], axis=0), min_spread*(upper - lower))
+
+    rng = np.random.default_rng() if rng is None else rng
+    starts = best + rng.standard_normal((runs, 6))*spread
+    starts[0] = best
+    starts = np.clip(starts, lower, upper)
+    n_scalings = bnds[0].size - 6
+    inits = [np.concatenate((start, np.ones(n_scalings))) for start in starts]
+    x_scale = np.concatenate((spread, np.ones(n_scalings)))
+    return inits, x_scale
+
+
 def append_result(iteration, results, idx):
     """
     Append current iteration to .hdf storage.
@@ -261,6 +424,9 @@ def append_result(iteration, results, idx):
     results    -  .h5 storage
     idx        -  index of current iteration for storage
     """
+    # sparse jacobians from structured fits are stored densely
+    iteration = {key: (val.toarray() if sp_sparse.issparse(val) else val)
+                 for key, val in iteration.items()}
     # first separate arrays from rest of data for storage
     is_array = {key: (True if type(val) is np.ndarray else False)
                 for key, val in iteration.items()}
@@ -275,27 +441,72 @@ def append_result(iteration, results, idx):
             results.append('r%i/%s' % (idx, key), pd.DataFrame(iteration[key]))
 
 
-def analysis(result, xx, cc, tt, dxx_dist, dxx_width, alpha, crit_err):
-    """Analyze results from optimization runs."""
+def report_files(report, savePath):
+    """Files written for one report of save_data."""
+    files = {'bundle': [bd.BUNDLE, bd.MANIFEST],
+             'txt': ['cc_theo_best.txt', 'cc_theo_avg.txt', 'DF_avg.txt', 'DF_best.txt',
+                     'minError.txt', 'scalings_avg.txt', 'scalings_best.txt'],
+             'xlsx': ['results.xlsx'],
+             'figures': ['results_combined_best.pdf', 'results_combined_avg.pdf',
+                         'scalings.pdf']}
+    return [savePath+file for file in files[report]]
+
+
+def extended_profiles(D, F, cc, tt_ext, dxx_dist, bc='reflective'):
+    """Numerical profiles for D, F up to the long time limit, as artifact."""
+    W = fp.WMatrixVar(D, F, start=4, end=None, deltaXX=dxx_dist, con=True)
+    return {'cc': np.array(propagate(W, cc[0], tt_ext-tt_ext[0], bc=bc)).T}
+
+
+def analysis(result, xx, cc, tt, dxx_dist, dxx_width, alpha, crit_err, savePath=None,
+             bc='reflective', reports=REPORTS, workers=None, fresh=False, campaign=None,
+             dataset=None):
+    """
+    Analyze results from optimization runs, reports selects the written artifacts.
+
+    Intermediate results and reports are cached in savePath/.cache, keyed by
+    the run store version, data, crit_err, alpha and bc. Only stale artifacts
+    are recomputed, fresh=True recomputes everything.
+    campaign    -   campaign table (.h5) the result bundle is appended to
+    dataset     -   name of the data set in the bundle, standart: folder of the fit
+    """
     # create new folder to save results in
-    savePath = os.path.join(os.getcwd(), 'results/')
+    if savePath is None:
+        savePath = os.path.join(os.getcwd(), 'results/')
+    if dataset is None:
+        dataset = os.path.dirname(os.path.abspath(savePath))
     if not os.path.exists(savePath):
         os.makedirs(savePath)
+    cache = art.ArtifactCache(savePath, fresh=fresh)
+    data_key = art.content_hash(xx, tt, dxx_dist, dxx_width, *cc)
+    store_key = art.store_version(result)
+    report_key = art.content_hash(store_key, data_key, crit_err, alpha, bc)
+    selection = report_selection(reports) | ({'bundle'} if campaign is not None else set())
+    reports = [report for report in sorted(selection)
+               if cache.stale(report, report_key, report_files(report, savePath))]
+    if not reports:
+        print('All requested reports in %s are up to date.' % savePath)
+        if campaign is not None:
+            bd.append_campaign(campaign, savePath)
+        return
 
     # gather data from results objects
+    table = cache.get('runs', art.content_hash(store_key), lambda: run_table(result))
     (best_results, averages, stdevs, F_best, D_best, t_best, d_best,
-     F_mean, D_mean, t_mean, d_mean, F_std, D_std, error) = average_data(result, xx, cc, crit_err)
+     F_mean, D_mean, t_mean, d_mean, F_std, D_std, error) = average_data(result, xx, cc, crit_err,
+                                                                         table=table)
     # fitted values for re-scaling concentration profiles
     scalings_mean, scalings_std, scalings_best = averages[6:], stdevs[6:], best_results[6:]
 
-    # computing rate matrix from best and averaged results
-    W_best = fp.WMatrixVar(D_best, F_best, start=4, end=None, deltaXX=dxx_dist, con=True)
-    W_mean = fp.WMatrixVar(D_mean, F_mean, start=4, end=None, deltaXX=dxx_dist, con=True)
-    # computing concentration profiles
+    # computing concentration profiles from best and averaged results
     dt = abs(tt[1]-tt[0])  # get temporal discretization
     tt_ext = np.append(tt[:-1], np.arange(tt[-1], tt[-1]*7, dt))  # extend to long time limit
-    cc_theo_best = np.array([fp.calcC(cc[0], (t-tt[0]), W=W_best) for t in tt_ext]).T
-    cc_theo_mean = np.array([fp.calcC(cc[0], (t-tt[0]), W=W_mean) for t in tt_ext]).T
+    cc_theo_best = cache.get('profiles_best', art.content_hash(D_best, F_best, data_key, bc),
+                             lambda: extended_profiles(D_best, F_best, cc, tt_ext, dxx_dist,
+                                                       bc=bc))['cc']
+    cc_theo_mean = cache.get('profiles_mean', art.content_hash(D_mean, F_mean, data_key, bc),
+                             lambda: extended_profiles(D_mean, F_mean, cc, tt_ext, dxx_dist,
+                                                       bc=bc))['cc']
 
     # compute re-scaled concentration profiles
     cc_best, cc_mean = [cc[0]], [cc[0]]
@@ -311,7 +522,349 @@ def analysis(result, xx, cc, tt, dxx_dist, dxx_width, alpha, crit_err):
     save_data(xx, dxx_width, cc_best, cc_mean, cc_theo_best, cc_theo_mean, tt, tt_ext,
               error, t_best, t_mean, best_results, averages, stdevs, D_mean, D_best,
               F_mean, F_best, D_std, F_std, scalings_mean, scalings_std, scalings_best,
-              c_bulk_mean, c_bulk_std, c_bulk_best, result.root._v_nchildren, alpha, crit_err, savePath)
+              c_bulk_mean, c_bulk_std, c_bulk_best, result.root._v_nchildren, alpha, crit_err, savePath,
+              reports=reports, workers=workers,
+              info={'bc': bc, 'data_hash': data_key, 'store': store_key,
+                    'dataset': dataset})
+    for report in reports:
+        cache.mark(report, report_key)
+    if campaign is not None:
+        bd.append_campaign(campaign, savePath)
+
+
+def best_run(result):
+    """Return key and parameters of the run with lowest cost in .hdf storage."""
+    key_list = np.array(list(result.root._v_children.keys()))
+    costs = np.array([result[key]['cost'].values[0] for key in key_list])
+    key_best = key_list[np.argmin(costs)]
+    return key_best, result[key_best+'/x'].values[:, 0]
+
+
+def sigmoidal_profiles(parameters, xx):
+    """
+    Compute D, F profiles on the full grid for one or many parameter sets.
+
+    parameters  -   array of shape (6+) or (n_sets, 6+), only first six are used
+    returns D, F of shape (bins) or (n_sets, bins), first 6 bins are bulk
+    """
+    p = np.atleast_2d(parameters)
+    # sigmoidalDF broadcasts over positions, evaluate all sets at once
+    x = xx[np.newaxis, :]
+    D = fp.sigmoidalDF([p[:, [0]], p[:, [1]]], p[:, [4]], p[:, [5]], x)
+    F = fp.sigmoidalDF([p[:, [2]], p[:, [3]]], p[:, [4]], p[:, [5]], x)
+    # keep D, F constant in the six bulk bins, same as computeDF with segments
+    D = np.concatenate((np.repeat(D[:, :1], 6, axis=1), D), axis=1)
+    F = np.concatenate((np.repeat(F[:, :1], 6, axis=1), F), axis=1)
+    if np.ndim(parameters) == 1:
+        return D[0], F[0]
+    return D, F
+
+
+def resample_data(cc, tt, cc_theo, parameters, mode='blocks', block=5, rng=None):
+    """
+    Draw one bootstrap replicate of the experimental profiles.
+
+    mode    -   'blocks' resamples residuals of the best fit in contiguous
+                blocks of 'block' bins along z (keeps correlated noise),
+                'profiles' resamples whole time profiles with replacement
+    returns resampled cc, tt and warm start parameters
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    scalings = parameters[6:]
+
+    if mode == 'profiles':
+        # draw time profiles with replacement, c(t=0) is always kept
+        picks = np.sort(rng.integers(1, len(cc), size=len(cc)-1))
+        cc_boot = [cc[0]] + [cc[i] for i in picks]
+        tt_boot = np.append(tt[0], tt[picks])
+        init = np.concatenate((parameters[:6], scalings[picks-1]))
+        return cc_boot, tt_boot, init
+    elif mode == 'blocks':
+        bins = cc[1].size
+        block = min(block, bins)
+        n_blocks = int(np.ceil(bins/block))
+        cc_boot = [cc[0]]
+        for c_exp, c_num, norm in zip(cc[1:], cc_theo, scalings):
+            fit = c_num[6:]
+            res = c_exp*norm - fit  # residuals in scaled units
+            # moving block bootstrap along z
+            starts = rng.integers(0, bins-block+1, size=n_blocks)
+            res_boot = np.concatenate([res[i:i+block] for i in starts])[:bins]
+            # undo scaling, so the replicate looks like measured data
+            cc_boot.append((fit + res_boot)/norm if norm > 0 else c_exp)
+        return cc_boot, tt, np.array(parameters)
+    else:
+        print('Error: Unknown bootstrap mode, choose "blocks" or "profiles".')
+        sys.exit()
+
+
+def bootstrap_replicate(seed, parameters, cc_theo, bnds, xx, cc, tt, dxx_dist, dxx_width,
+                        alpha, mode='blocks', block=5, varpro=False):
+    """Fit one bootstrap replicate, warm-started from best fit parameters."""
+    rng = np.random.default_rng(seed)
+    cc_boot, tt_boot, init = resample_data(cc, tt, cc_theo, parameters, mode=mode,
+                                           block=block, rng=rng)
+    n_profiles = len(cc_boot) - 1
+    bnds_boot = (bnds[0][:6+n_profiles], bnds[1][:6+n_profiles])
+    init = np.clip(init, bnds_boot[0], bnds_boot[1])
+    res = optimization(init, bnds_boot, xx, cc_boot, tt_boot, dxx_dist, dxx_width,
+                       alpha, varpro=varpro)
+    return res.x[:6]
+
+
+def bootstrap(parameters, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha, n_boot,
+              mode='blocks', block=5, workers=None, varpro=False, seed=None):
+    """
+    Run bootstrap replicates in a process pool.
+
+    returns array of shape (n_boot, 6) containing physical parameters
+    """
+    cc_theo = theoretical_profiles(parameters, xx, cc, tt, dxx_dist, dxx_width)
+    # independent random streams for every replicate
+    seeds = np.random.SeedSequence(seed).spawn(n_boot)
+    replicate = ft.partial(bootstrap_replicate, parameters=parameters, cc_theo=cc_theo,
+                           bnds=bnds, xx=xx, cc=cc, tt=tt, dxx_dist=dxx_dist,
+                           dxx_width=dxx_width, alpha=alpha, mode=mode, block=block,
+                           varpro=varpro)
+    samples = []
+    with ex.process_pool(cc[0].size, n_tasks=n_boot, workers=workers) as pool:
+        for i, sample in enumerate(pool.map(replicate, seeds)):
+            samples.append(sample)
+            print('Completed %i bootstrap replicates out of %i...' % (i+1, n_boot))
+    return np.array(samples)
+
+
+def save_bootstrap(samples, xx, mode, level, savePath):
+    """Save confidence bands from bootstrap replicates."""
+    D, F = sigmoidal_profiles(samples, xx)
+    F = F - F[:, :1]  # free energy relative to bulk, as in save_data
+    q = 100*np.array([(1-level)/2, 0.5, (1+level)/2])
+    D_low, D_med, D_up = np.percentile(D, q, axis=0)
+    F_low, F_med, F_up = np.percentile(F, q, axis=0)
+    np.savetxt(savePath+'DF_bootstrap.txt', np.c_[D_med, D_low, D_up, F_med, F_low, F_up],
+               delimiter=',',
+               header=('Diffusivity and free energy profiles from %i bootstrap replicates '
+                       '(%s), %i%% confidence bands\n'
+                       'cloumn1: median diffusivity [micro_m^2/s]\n'
+                       'cloumn2: lower bound of diffusivity [micro_m^2/s]\n'
+                       'cloumn3: upper bound of diffusivity [micro_m^2/s]\n'
+                       'cloumn4: median free energy [k_BT]\n'
+                       'cloumn5: lower bound of free energy [k_BT]\n'
+                       'cloumn6: upper bound of free energy [k_BT]'
+                       % (samples.shape[0], mode, level*100)))
+
+    # same parameter layout as results.xlsx
+    params = np.c_[samples[:, 0], samples[:, 1], samples[:, 3]-samples[:, 2],
+                   samples[:, 4], samples[:, 5]]
+    low, up = np.percentile(params, q[[0, 2]], axis=0)
+    save_parameter_table(savePath+'results_bootstrap.xlsx',
+                         ['Bootstrap Mean', 'Standart Deviation',
+                          'Lower %i%%' % (level*100), 'Upper %i%%' % (level*100)],
+                         [np.mean(params, axis=0), np.std(params, axis=0), low, up])
+
+
+def save_parameter_table(path, titles, columns):
+    """Write sigmoid parameters to excel sheet in the layout of results.xlsx."""
+    workbook = xl.Workbook(path)
+    worksheet = workbook.add_worksheet()
+    bold = workbook.add_format({'bold': True})
+    letters = 'ABCDEFGH'
+    worksheet.write('A1', 'Parameter', bold)
+    for column, title in zip(letters[1:], titles):
+        worksheet.write('%s1' % column, title, bold)
+    names = ['D_sol [µm^2/s]', 'D_gel [µm^2/s]', 'F_gel [kT]', 't_sig [µm]', 'd_sig [µm]']
+    for row, name in enumerate(names):
+        worksheet.write('A%i' % (row+2), name, bold)
+        for column, values in zip(letters[1:], columns):
+            worksheet.write('%s%i' % (column, row+2), '%.5f' % values[row])
+    worksheet.set_column(0, 15, len('Standart Deviation'))
+    workbook.close()
+
+
+def parameter_covariance(jac, fun, n_eliminated=0, rcond=1e-10):
+    """
+    Compute parameter covariance (J^T J)^-1 * sigma^2 from final Jacobian.
+
+    sigma^2 is estimated from the residuals, pseudo-inverse via SVD handles
+    parameters that are not constrained by the data (e.g. stuck at bounds).
+    n_eliminated    -   parameters fitted but not in the Jacobian, e.g. the
+                        scalings with variable projection, they still count
+                        for the degrees of freedom
+    """
+    m, n = jac.shape
+    sigma2 = np.sum(fun**2) / max(m - n - n_eliminated, 1)
+    _, s, VT = np.linalg.svd(jac, full_matrices=False)
+    keep = s > rcond*s[0]
+    V = VT[keep].T
+    return (V / s[keep]**2) @ V.T * sigma2
+
+
+def sigmoid_gradients(df, t, d, xx):
+    """Derivatives of sigmoidalDF with respect to [df1, df2, t, d], shape (bins, 4)."""
+    u = (xx-t)/(np.sqrt(2)*d)
+    erf = sp.erf(u)
+    gauss = (df[1]-df[0]) * np.exp(-u**2) / np.sqrt(np.pi)  # 0.5*(df2-df1)*derf/du
+    return np.c_[0.5*(1-erf), 0.5*(1+erf),
+                 -gauss/(np.sqrt(2)*d), -gauss*(xx-t)/(np.sqrt(2)*d**2)]
+
+
+def covariance_bands(parameters, cov, xx):
+    """
+    Propagate covariance of sigmoid parameters to D(z), F(z) standart deviations.
+
+    F is taken relative to the bulk value, as written by save_data.
+    """
+    G_D = sigmoid_gradients(parameters[:2], parameters[4], parameters[5], xx)
+    G_F = sigmoid_gradients(parameters[2:4], parameters[4], parameters[5], xx)
+    G_F = G_F - G_F[0]  # F - F[0]
+    idx_D, idx_F = [0, 1, 4, 5], [2, 3, 4, 5]
+    D_std = np.sqrt(np.einsum('ij,jk,ik->i', G_D, cov[np.ix_(idx_D, idx_D)], G_D))
+    F_std = np.sqrt(np.abs(np.einsum('ij,jk,ik->i', G_F, cov[np.ix_(idx_F, idx_F)], G_F)))
+    # stdev stays fixed in the six bulk bins
+    D_std = np.concatenate((np.ones(6)*D_std[0], D_std))
+    F_std = np.concatenate((np.ones(6)*F_std[0], F_std))
+    return D_std, F_std
+
+
+def covariance_analysis(result, xx):
+    """Estimate uncertainties from the Jacobian of the best run only."""
+    savePath = os.path.join(os.getcwd(), 'results/')
+    if not os.path.exists(savePath):
+        os.makedirs(savePath)
+    key_best, parameters = best_run(result)
+    jac = result[key_best+'/jac'].values
+    fun = result[key_best+'/fun'].values[:, 0]
+    # with variable projection only the physical parameters are in the Jacobian,
+    # the scalings are eliminated but fitted nevertheless
+    cov = parameter_covariance(jac, fun, n_eliminated=parameters.size-jac.shape[1])[:6, :6]
+    D, F = sigmoidal_profiles(parameters, xx)
+    D_std, F_std = covariance_bands(parameters, cov, xx)
+    print('\nComputed covariance based uncertainties from best run %s.' % key_best)
+
+    np.savetxt(savePath+'DF_cov.txt', np.c_[D, D_std, F-F[0], F_std],
+               delimiter=',',
+               header=('Diffusivity and free energy profiles of best run, uncertainties '
+                       'from covariance (J^T J)^-1 sigma^2\n'
+                       'cloumn1: diffusivity [micro_m^2/s]\n'
+                       'cloumn2: stdev of diffusivity [+/- micro_m^2/s]\n'
+                       'cloumn3: free energy [k_BT]\n'
+                       'cloumn4: stdev of free energy [+/- k_BT]'))
+    # transform to parameters of results.xlsx, F_gel is the difference F2 - F1
+    T = np.zeros((5, 6))
+    T[0, 0], T[1, 1], T[2, 3], T[2, 2], T[3, 4], T[4, 5] = 1, 1, 1, -1, 1, 1
+    values = T @ parameters[:6]
+    stdevs = np.sqrt(np.diag(T @ cov @ T.T))
+    save_parameter_table(savePath+'results_cov.xlsx', ['Best Results', 'Standart Deviation'],
+                         [values, stdevs])
+
+
+def bootstrap_analysis(result, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha, n_boot,
+                       mode='blocks', block=5, workers=None, varpro=False, level=0.95):
+    """Estimate uncertainties by bootstrapping around the best run."""
+    savePath = os.path.join(os.getcwd(), 'results/')
+    if not os.path.exists(savePath):
+        os.makedirs(savePath)
+    key_best, parameters = best_run(result)
+    print('\nBootstrapping %i replicates around best run %s...' % (n_boot, key_best))
+    samples = bootstrap(parameters, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha, n_boot,
+                        mode=mode, block=block, workers=workers, varpro=varpro)
+    save_bootstrap(samples, xx, mode, level, savePath)
+
+
+def uncertainty_analysis(result, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha, opts):
+    """Run optional uncertainty estimates selected on the command line."""
+    if opts.cov:
+        covariance_analysis(result, xx)
+    if opts.boot > 0:
+        bootstrap_analysis(result, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha, opts.boot,
+                           mode=opts.boot_mode, workers=opts.workers, varpro=opts.varpro)
+
+
+def regularization_norms(parameters, cc, cc_theo):
+    """
+    Compute ||A*x - y|| and ||x - x_ref|| as written to results.xlsx.
+
+    ||A*x - y|| is the rms deviation of scaled and numerical profiles,
+    ||x - x_ref|| the norm of the regularization term for alpha = 1.
+    """
+    RR = residuals(parameters, cc, cc_theo, alpha=0)
+    err_sol = np.sqrt(np.sum(RR**2) / RR.size)
+    err_reg = np.linalg.norm(regularization_term(parameters[:2], parameters[2:4],
+                                                 parameters[4], parameters[5],
+                                                 parameters[6:], alpha=1))
+    return err_sol, err_reg
+
+
+def alpha_chain(init, alphas, bnds, xx, cc, tt, dxx_dist, dxx_width, varpro=False):
+    """
+    Solve along the regularization path, warm-starting from previous alpha.
+
+    alphas  -   regularization parameters, solved in the given order
+    returns array with rows [alpha, cost, ||A*x - y||, ||x - x_ref||, x]
+    """
+    path = []
+    x = np.array(init)
+    for alpha in alphas:
+        res = optimization(x, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha, varpro=varpro)
+        x = res.x
+        cc_theo = theoretical_profiles(x, xx, cc, tt, dxx_dist, dxx_width)
+        err_sol, err_reg = regularization_norms(x, cc, cc_theo)
+        path.append(np.concatenate(([alpha, res.cost, err_sol, err_reg], x)))
+    return np.array(path)
+
+
+def lcurve_corner(rho, eta, alphas):
+    """
+    Locate corner of L-curve as point of maximal curvature.
+
+    rho     -   residual norms ||A*x - y||
+    eta     -   solution norms ||x - x_ref||
+    curvature is computed for log(rho), log(eta) parametrized by log(alpha)
+    """
+    if alphas.size < 3:
+        return 0
+    s = np.log(alphas)
+    r, e = np.log(rho), np.log(np.maximum(eta, np.finfo(float).tiny))
+    dr, de = np.gradient(r, s), np.gradient(e, s)
+    ddr, dde = np.gradient(dr, s), np.gradient(de, s)
+    kappa = (dr*dde - ddr*de) / np.maximum((dr**2 + de**2)**1.5, np.finfo(float).tiny)
+    # end points are not reliable for second derivatives
+    return 1 + np.argmax(np.abs(kappa[1:-1]))
+
+
+def alpha_sweep(inits, alphas, bnds, xx, cc, tt, dxx_dist, dxx_width, workers=None,
+                varpro=False):
+    """
+    Compute regularization path for log-spaced alphas, one chain per start value.
+
+    Each chain is solved from the largest alpha down, chains are spread
+    across worker processes. For each alpha the chain with lowest cost is kept.
+    returns best path and index of L-curve corner
+    """
+    alphas = np.sort(alphas)[::-1]  # strongest regularization first
+    chain = ft.partial(alpha_chain, alphas=alphas, bnds=bnds, xx=xx, cc=cc, tt=tt,
+                       dxx_dist=dxx_dist, dxx_width=dxx_width, varpro=varpro)
+    paths = []
+    with ex.process_pool(cc[0].size, n_tasks=len(inits), workers=workers) as pool:
+        for i, path in enumerate(pool.map(chain, inits)):
+            paths.append(path)
+            print('Completed %i alpha chains out of %i...' % (i+1, len(inits)))
+    paths = np.array(paths)  # shape (chains, alphas, columns)
+    best = paths[np.argmin(paths[:, :, 1], axis=0), np.arange(alphas.size)]
+    corner = lcurve_corner(best[:, 2], best[:, 3], best[:, 0])
+    return best, corner
+
+
+def save_lcurve(path, corner, savePath):
+    """Save regularization path and L-curve corner."""
+    np.savetxt(savePath+'lcurve.txt', path, delimiter=',',
+               header=('Regularization path, L-curve corner at alpha = %g\n'
+                       'column1: alpha\n'
+                       'column2: cost\n'
+                       'column3: ||A*x - y||\n'
+                       'column4: ||x - x_ref||\n'
+                       'column5-: fitted parameters' % path[corner, 0]))
 
 
 def regularization_term(d, f, t_sig, d_sig, scalings, alpha=0):
@@ -331,13 +884,29 @@ def regularization_term(d, f, t_sig, d_sig, scalings, alpha=0):
     return regularization
 
 
-def resFun(parameters, xx, cc, tt, dxx_dist, dxx_width, alpha, check=False):
-    """Compute residuals for non-linear optimization."""
+def propagate(W, c0, times, bc='reflective', dtype=None):
+    """
+    Numerical profiles on the full grid for times after t=0.
+
+    bc      -   'reflective' for the closed Block setup, 'open1side' treats the
+                outermost bulk bin as reservoir fixed at its initial concentration
+    dtype   -   precision of exp(W) and the matrix powers, standart: as W
+    """
+    if dtype is not None:
+        W, c0 = W.astype(dtype), np.asarray(c0).astype(dtype)
+    if bc == 'open1side':
+        # truncated system, reservoir couples in via W[1, 0]
+        profiles = fp.calcC_series(c0[1:], times, W=W[1:, 1:], bc=bc, W10=W[1, 0], c0=c0[0])
+        return [np.append(c0[0], c) for c in profiles]
+    return fp.calcC_series(c0, times, W=W, bc=bc)
+
+
+def rate_matrix(parameters, xx, dxx_dist):
+    """Rate matrix W and free energy F on the full grid for the physical parameters."""
     # separate fit parameters accordingly
     d = parameters[:2]
     f = parameters[2:4]
     t_sig, d_sig = parameters[4], parameters[5]
-    scalings = parameters[6:]
 
     # compute sigmoidal D, F profiles
     D = np.array([fp.sigmoidalDF(d, t_sig, d_sig, x) for x in xx])
@@ -345,13 +914,166 @@ def resFun(parameters, xx, cc, tt, dxx_dist, dxx_width, alpha, check=False):
     segments = np.concatenate((np.zeros(6), np.arange(D.size))).astype(int)
     D, F = fp.computeDF(D, F, shape=segments)
     # computing WMatrix, start smaller than 6, because D, F is const. only there
-    W = fp.WMatrixVar(D, F, start=4, end=None, deltaXX=dxx_dist, con=True)
+    return fp.WMatrixVar(D, F, start=4, end=None, deltaXX=dxx_dist, con=True), F
+
+
+def banded_diagonals(parameters, xx, dxx_dist):
+    """Diagonals (main, upper, lower) of W and F on the full grid, W is not formed."""
+    D, F = sigmoidal_profiles(parameters, xx)
+    main, upper, lower = fp.WMatrixVar_batch(D, F, start=4, deltaXX=dxx_dist)
+    return (main[0], upper[0], lower[0]), F
+
+
+def propagate_banded(diagonals, c0, times, step=None, bc='reflective'):
+    """
+    Numerical profiles as propagate, from the diagonals of W in O(n) per step.
+
+    step    -   time step of the TR-BDF2 engine, None gives the exact
+                propagator from the tridiagonal eigendecomposition
+    """
+    main, upper, lower = diagonals
+    Qb = None
+    if bc == 'open1side':
+        # truncated system, reservoir couples in via W[1, 0] = lower[1]
+        main, upper, lower = main[1:], upper[1:], lower[1:]
+        b = np.append(c0[0]*lower[0], np.zeros(main.size-1))
+        Qb = fp.tridiag_solve(fp.tridiag_lu(main, upper, lower), b)
+        c = c0[1:]
+    elif bc == 'reflective':
+        c = c0
+    else:
+        print('Error: Invalid boundary conditions!')
+        sys.exit()
+
+    if step is None:
+        profiles = fp.calcC_exact(c, times, main, upper, lower, Qb=Qb)
+    else:
+        profiles = fp.calcC_trbdf2(c, times, main, upper, lower, step=step, Qb=Qb)
+    if bc == 'open1side':
+        return [np.append(c0[0], c) for c in profiles]
+    return profiles
+
+
+def banded_step(parameters, xx, cc, tt, dxx_dist, tol, bc='reflective', step=None):
+    """
+    Time step of the TR-BDF2 engine meeting tol for the physical parameters.
+
+    Starting from step, standart: greatest common divisor of the times, the
+    step is halved until the error of the profiles is at most tol (absolute,
+    profiles are normalized). The error is estimated from the profiles with
+    half the step, 4/3 of their difference for the second order scheme. The
+    eigendecomposition of calcC_exact is no reference, it is inaccurate for
+    rates spanning many orders of magnitude.
+    returns step and the estimated maximal deviation
+    """
+    diagonals, F = banded_diagonals(parameters, xx, dxx_dist)
+    times = tt[1:]-tt[0]
+    if step is None:
+        step = float(max(np.gcd.reduce(np.round(times).astype(int)), 1))
+    profiles = np.array(propagate_banded(diagonals, cc[0], times, step=step, bc=bc))
+    for _ in range(20):
+        finer = np.array(propagate_banded(diagonals, cc[0], times, step=step/2, bc=bc))
+        deviation = 4/3*np.max(np.abs(profiles - finer))
+        if deviation <= tol:
+            break
+        step, profiles = step/2, finer
+    else:
+        logger.warning('TR-BDF2 misses tolerance %g with time step %g, deviation %.3g',
+                       tol, step, deviation)
+    return step, deviation
+
+
+class ProfileCache(collections.OrderedDict):
+    """
+    Numerical profiles of one data set for theoretical_profiles, least
+    recently used are dropped. Safe to share between threads.
+    """
+
+    def __init__(self, maxsize):
+        super().__init__()
+        self.maxsize = maxsize
+        self.hits = 0
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            self.move_to_end(key)
+            self.hits += 1
+            return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            super().__setitem__(key, value)
+            if len(self) > self.maxsize:
+                self.popitem(last=False)
+
+
+def theoretical_profiles(parameters, xx, cc, tt, dxx_dist, dxx_width, check=True,
+                         bc='reflective', dtype=None, engine='expm', step=None, cache=None):
+    """
+    Compute numerical profiles at times tt[1:] for the physical parameters.
+
+    dtype   -   precision of the propagation, e.g. np.float32 for early
+                iterations, W is always assembled and checked in double
+    engine  -   'expm' propagates with the dense exp(W), 'trbdf2' steps with
+                time step 'step' on the diagonals of W, for very fine grids
+    cache   -   mapping of earlier profiles of the same data set, keyed by the
+                physical parameters and propagation options, e.g. shared by fits
+    """
+    if cache is not None:
+        key = (np.asarray(parameters[:6], dtype=float).tobytes(), bc, str(dtype), engine, step)
+        try:
+            return cache[key]
+        except KeyError:  # not computed yet, or dropped by another thread meanwhile
+            pass
+        cc_theo = theoretical_profiles(parameters, xx, cc, tt, dxx_dist, dxx_width,
+                                       check=check, bc=bc, dtype=dtype, engine=engine,
+                                       step=step)
+        cache[key] = cc_theo
+        return cc_theo
+
+    if engine == 'trbdf2':  # banded time stepping, W is never formed
+        diagonals, F = banded_diagonals(parameters, xx, dxx_dist)
+        if check:
+            cross_checking(diagonals, F, dxx_width)
+        return propagate_banded(diagonals, cc[0], tt[1:]-tt[0], step=step, bc=bc)
+
+    W, F = rate_matrix(parameters, xx, dxx_dist)
 
     if check:  # checking for conservation of concentration
-        cross_checking(W, cc, tt, dxx_width, dxx_dist)
+        cross_checking(W, F, dxx_width)
 
     # compute numerical profiles
-    cc_theo = [fp.calcC(cc[0], t=(t-tt[0]), W=W) for t in tt[1:]]
+    cc_theo = propagate(W, cc[0], tt[1:]-tt[0], bc=bc, dtype=dtype)
+    return cc_theo
+
+
+def optimal_scalings(cc, cc_theo, alpha=0, bnds=(0, 100)):
+    """
+    Solve for the scaling of each profile in closed form.
+
+    Residuals are linear in the scalings, so for fixed D, F, t, d the
+    least squares problem separates into one quadratic per profile,
+    including the Tykhonov term alpha*(scaling-1). Clipping to the bounds
+    gives the exact bounded minimum, since each quadratic is convex.
+    bnds    -   lower and upper bounds, scalars or arrays of size n_profiles
+    """
+    c_exp = np.array(cc[1:])
+    c_num = np.array([c[6:] for c in cc_theo])
+    numerator = np.sum(c_exp*c_num, axis=1) + alpha**2
+    denominator = np.sum(c_exp**2, axis=1) + alpha**2
+    # profiles without signal carry no information, keep them unscaled
+    scalings = np.divide(numerator, denominator, out=np.ones(c_exp.shape[0]),
+                         where=denominator > 0)
+    return np.clip(scalings, bnds[0], bnds[1])
+
+
+def residuals(parameters, cc, cc_theo, alpha):
+    """Assemble residual vector from scaled and numerical profiles."""
+    d = parameters[:2]
+    f = parameters[2:4]
+    t_sig, d_sig = parameters[4], parameters[5]
+    scalings = parameters[6:]
     # re-scale concentration profiles with fit parameters
     cc_norm = [c*norm for c, norm in zip(cc[1:], scalings)]
 
@@ -367,22 +1089,1106 @@ def resFun(parameters, xx, cc, tt, dxx_dist, dxx_width, alpha, check=False):
     return RRn
 
 
-def optimization(init, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha, verbosity=0):
-    """Run one iteration of the non-linear optimization."""
-    # reduce residual function to one argument in order to work with algorithm
-    optimize = ft.partial(resFun, xx=xx, cc=cc, tt=tt, dxx_dist=dxx_dist,
-                          dxx_width=dxx_width, alpha=alpha)
+def resFun(parameters, xx, cc, tt, dxx_dist, dxx_width, alpha, check=True,
+           bc='reflective', dtype=None, engine='expm', step=None, cache=None):
+    """Compute residuals for non-linear optimization."""
+    cc_theo = theoretical_profiles(parameters, xx, cc, tt, dxx_dist, dxx_width,
+                                   check=check, bc=bc, dtype=dtype, engine=engine, step=step,
+                                   cache=cache)
+    return residuals(parameters, cc, cc_theo, alpha)
+
+
+def resFun_varpro(parameters, xx, cc, tt, dxx_dist, dxx_width, alpha,
+                  scale_bnds=(0, 100), check=True, bc='reflective', dtype=None,
+                  engine='expm', step=None, cache=None):
+    """
+    Compute residuals with scalings eliminated by variable projection.
+
+    Only the six physical parameters are passed, the optimal scalings for
+    the current D, F, t, d are inserted before assembling the residuals.
+    """
+    cc_theo = theoretical_profiles(parameters, xx, cc, tt, dxx_dist, dxx_width,
+                                   check=check, bc=bc, dtype=dtype, engine=engine, step=step,
+                                   cache=cache)
+    scalings = optimal_scalings(cc, cc_theo, alpha=alpha, bnds=scale_bnds)
+    return residuals(np.append(parameters[:6], scalings), cc, cc_theo, alpha)
+
+
+def project_scalings(parameters, xx, cc, tt, dxx_dist, dxx_width, alpha,
+                     scale_bnds=(0, 100), bc='reflective', engine='expm', step=None,
+                     cache=None):
+    """Recover full parameter vector with optimal scalings."""
+    cc_theo = theoretical_profiles(parameters, xx, cc, tt, dxx_dist, dxx_width, bc=bc,
+                                   engine=engine, step=step, cache=cache)
+    scalings = optimal_scalings(cc, cc_theo, alpha=alpha, bnds=scale_bnds)
+    return np.append(parameters[:6], scalings)
+
+
+def batch_profiles(c0, times, W_diags, dxx_width, mass_rtol=1e-8):
+    """
+    Numerical profiles for stacked rate matrices, as fp.calcC_batch.
+
+    The batched eigendecomposition loses accuracy for very ill-conditioned W
+    (rates spanning many orders of magnitude), this shows as loss of mass.
+    Profiles of these sets are computed again with the exact exp(W).
+    mass_rtol   -   tolerated relative deviation of sum(c*dxx_width) from c0
+    returns profiles of shape (n_sets, bins, n_times), number of recomputed sets
+    """
+    c_num = fp.calcC_batch(c0, times, *W_diags)
+    mass = np.dot(c0, dxx_width)
+    deviation = np.max(np.abs(np.einsum('b,nbt->nt', dxx_width, c_num) - mass), axis=1)
+    failed = np.flatnonzero(~(deviation <= mass_rtol*abs(mass)))  # NaN counts as failed
+    for i in failed:
+        W = fp.tridiag_dense(*[w[i] for w in W_diags])
+        c_num[i] = np.array(propagate(W, c0, times)).T
+    return c_num, failed.size
+
+
+def resFun_batch(parameters, xx, cc, tt, dxx_dist, dxx_width, alpha, scale_bnds=(0, 100),
+                 chunk=None, check=True):
+    """
+    Compute residuals for a population of parameter vectors at once.
+
+    parameters  -   array of shape (n_candidates, 6) or (n_candidates, 6+n_profiles),
+                    with only six columns scalings are solved by variable projection
+    chunk       -   number of candidates evaluated together, standart keeps
+                    the stacked rate matrices below ~100 MB
+    W assembly and eigendecompositions are batched over the candidates,
+    candidates for which these are inaccurate fall back to exp(W).
+    returns residuals of shape (n_candidates, n_residuals), rows as in resFun
+    """
+    P = np.atleast_2d(parameters)
+    bins = cc[0].size
+    if chunk is None:
+        chunk = max(1, int(1e8 / (8*bins**2)))
+    if P.shape[0] > chunk:
+        return np.concatenate([resFun_batch(P[i:i+chunk], xx, cc, tt, dxx_dist, dxx_width,
+                                            alpha, scale_bnds=scale_bnds, chunk=chunk,
+                                            check=check)
+                               for i in range(0, P.shape[0], chunk)])
+
+    D, F = sigmoidal_profiles(P, xx)
+    W_diags = fp.WMatrixVar_batch(D, F, start=4, deltaXX=dxx_dist)
+    if check:  # conservation invariants for all candidates
+        cross_checking(W_diags, F, dxx_width)
+    c_num, _ = batch_profiles(cc[0], tt[1:]-tt[0], W_diags, dxx_width)
+    c_num = c_num[:, 6:, :]  # (n, bins, profiles)
+    c_exp = np.array(cc[1:]).T
+
+    if P.shape[1] == 6:  # closed form scalings, as optimal_scalings
+        numerator = np.einsum('bp,nbp->np', c_exp, c_num) + alpha**2
+        denominator = np.sum(c_exp**2, axis=0) + alpha**2
+        scalings = np.divide(numerator, denominator, out=np.ones_like(numerator),
+                             where=denominator > 0)
+        scalings = np.clip(scalings, scale_bnds[0], scale_bnds[1])
+    else:
+        scalings = P[:, 6:]
+
+    RR = c_exp[np.newaxis]*scalings[:, np.newaxis, :] - c_num
+    RRn = RR.reshape(P.shape[0], -1)
+    if alpha > 0:  # same ordering as regularization_term
+        regularization = alpha*np.concatenate((P[:, 4:6], np.diff(P[:, 2:4]),
+                                               np.diff(P[:, 0:2]), scalings-1), axis=1)
+        RRn = np.concatenate((RRn, regularization), axis=1)
+    return RRn
+
+
+def cost_batch(parameters, xx, cc, tt, dxx_dist, dxx_width, alpha, scale_bnds=(0, 100)):
+    """Least squares cost 0.5*sum(residuals**2) for a population of parameters."""
+    RR = resFun_batch(parameters, xx, cc, tt, dxx_dist, dxx_width, alpha,
+                      scale_bnds=scale_bnds)
+    return 0.5*np.sum(RR**2, axis=1)
+
+
+def global_optimization(bnds, xx, cc, tt, dxx_dist, dxx_width, alpha, verbosity=0, seed=None,
+                        popsize=15, maxiter=200, jac_executor=None, jac_scheme='2-point'):
+    """
+    Global search with vectorized differential evolution, polished locally.
+
+    The whole population is evaluated by one call of cost_batch, scalings are
+    eliminated by variable projection. The best member is scored again with
+    resFun_varpro, refined with the local least squares fit and returned as
+    its result.
+    """
+    scale_bnds = (bnds[0][6:], bnds[1][6:])
+    cost = ft.partial(cost_batch, xx=xx, cc=cc, tt=tt, dxx_dist=dxx_dist,
+                      dxx_width=dxx_width, alpha=alpha, scale_bnds=scale_bnds)
+    search = op.differential_evolution(lambda x: cost(x.T), list(zip(bnds[0][:6], bnds[1][:6])),
+                                       vectorized=True, updating='deferred', polish=False,
+                                       seed=seed, popsize=popsize, maxiter=maxiter,
+                                       disp=verbosity > 0)
+    print('Global search finished after %i generations, cost = %.5f'
+          % (search.nit, search.fun))
+    rescored = 0.5*np.sum(resFun_varpro(search.x, xx, cc, tt, dxx_dist, dxx_width, alpha,
+                                        scale_bnds=scale_bnds)**2)
+    if not np.isclose(rescored, search.fun, rtol=1e-6, atol=0):
+        logger.warning('Batched cost %.6g of the global optimum disagrees with resFun '
+                       'cost %.6g', search.fun, rescored)
+    init = np.append(search.x, np.ones(len(cc)-1))
+    return optimization(init, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha, verbosity,
+                        varpro=True, jac_executor=jac_executor, jac_scheme=jac_scheme)
+
+
+def legendre_indices(dim, degree):
+    """Multi-indices of all Legendre products up to total degree."""
+    indices = [()]
+    for _ in range(dim):
+        indices = [idx + (k,) for idx in indices for k in range(degree+1)
+                   if sum(idx) + k <= degree]
+    return np.array(indices)
+
+
+def legendre_basis(u, indices):
+    """Polynomial chaos design matrix for points u in [-1, 1]^dim."""
+    u = np.atleast_2d(u)
+    degree = np.max(indices)
+    A = np.ones((u.shape[0], indices.shape[0]))
+    for j in range(u.shape[1]):  # product of one dimensional Legendre polynomials
+        A *= np.polynomial.legendre.legvander(u[:, j], degree)[:, indices[:, j]]
+    return A
+
+
+def fit_surrogate(u, values, degree=None, ridge=1e-6):
+    """
+    Legendre polynomial chaos expansion of values at points u, ridge regularized.
+
+    degree  -   total degree, standart: highest with at most a third as many
+                terms as samples
+    returns coefficients and multi-indices
+    """
+    dim = u.shape[1]
+    if degree is None:
+        degree = 1
+        while legendre_indices(dim, degree+1).shape[0] <= u.shape[0]/3:
+            degree += 1
+    indices = legendre_indices(dim, degree)
+    A = legendre_basis(u, indices)
+    coef = np.linalg.solve(A.T @ A + ridge*np.eye(A.shape[1]), A.T @ values)
+    return coef, indices
+
+
+def surrogate_minima(u, values, box, n_minima):
+    """Fit surrogate to samples inside box = (lower, upper) and minimize it there."""
+    inside = np.all((u >= box[0]) & (u <= box[1]), axis=1)
+    coef, indices = fit_surrogate(u[inside], values[inside])
+
+    def surrogate(v):
+        return legendre_basis(v, indices) @ coef
+
+    residual = surrogate(u[inside]) - values[inside]
+    r2 = 1 - np.sum(residual**2) / np.sum((values[inside]-np.mean(values[inside]))**2)
+    # minimize from best samples, merge minima closer than 0.05 in u
+    minima = []
+    for u0 in u[inside][np.argsort(values[inside])[:n_minima]]:
+        res = op.minimize(lambda v: surrogate(v)[0], u0, method='L-BFGS-B',
+                          bounds=list(zip(box[0], box[1])))
+        if all(np.max(np.abs(res.x - m)) > 0.05 for m in minima):
+            minima.append(res.x)
+    return np.array(minima), np.max(np.sum(indices, axis=1)), r2
+
+
+def screen_starts(n_samples, n_starts, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha,
+                  seed=None, rounds=3, shrink=0.4):
+    """
+    Start values from minima of a surrogate of the cost, instead of random starts.
+
+    The log cost over five coordinates of the physical parameters (F enters
+    only by its jump) is sampled by cost_batch on Latin hypercubes and fitted by a Legendre polynomial chaos expansion.
+    Surrogate minima are verified with the true cost in one batch. Every
+    round zooms into the box around the best point found so far, shrunk by
+    the factor shrink, and fits a new local surrogate there.
+    returns up to n_starts distinct start vectors with the lowest true cost,
+    scalings set to one
+    """
+    lower, upper = bnds[0][:6], bnds[1][:6]
+    scale_bnds = (bnds[0][6:], bnds[1][6:])
+    cost = ft.partial(cost_batch, xx=xx, cc=cc, tt=tt, dxx_dist=dxx_dist,
+                      dxx_width=dxx_width, alpha=alpha, scale_bnds=scale_bnds)
+    # screened coordinates: log D_sol, log D_gel, F_gel-F_sol, t, log d, only the
+    # difference of F matters, D and d change the cost over decades
+    lo = np.log10(np.maximum(lower, upper*1e-3))
+    hi = np.log10(upper)
+
+    def to_x(u):  # unit cube [-1, 1]^5 to parameters within bounds
+        w = (np.atleast_2d(u)+1)/2
+        x = np.empty((w.shape[0], 6))
+        x[:, :2] = 10**(lo[:2] + w[:, :2]*(hi[:2]-lo[:2]))
+        dF = (2*w[:, 2]-1)*min(upper[2]-lower[3], upper[3]-lower[2])/2
+        x[:, 2], x[:, 3] = -dF/2, dF/2
+        x[:, 4] = lower[4] + w[:, 3]*(upper[4]-lower[4])
+        x[:, 5] = 10**(lo[5] + w[:, 4]*(hi[5]-lo[5]))
+        return x
+
+    from scipy.stats import qmc  # slow import, only needed for screening
+    rng = np.random.default_rng(seed)
+    u, values = np.zeros((0, 5)), np.zeros(0)
+    box, half = (-0.99*np.ones(5), 0.99*np.ones(5)), 0.99
+    for i in range(rounds):
+        sample = box[0] + (box[1]-box[0])*qmc.LatinHypercube(d=5, seed=rng).random(
+            n_samples // rounds)
+        sample_values = np.log(cost(to_x(sample)))
+        valid = np.isfinite(sample_values)  # e.g. vanishing D at the bounds
+        u = np.concatenate((u, sample[valid]))
+        values = np.concatenate((values, sample_values[valid]))
+        # surrogate of the box from all samples inside
+        minima, degree, r2 = surrogate_minima(u, values, box, max(4*n_starts, 20))
+        minima_values = np.log(cost(to_x(minima)))  # verify surrogate minima
+        valid = np.isfinite(minima_values)
+        u = np.concatenate((u, minima[valid]))
+        values = np.concatenate((values, minima_values[valid]))
+        print('Screening round %i: %i samples, surrogate degree %i (R^2 = %.2f), '
+              '%i minima, best cost %.5g' % (i+1, u.shape[0], degree, r2, minima.shape[0],
+                                             np.exp(np.min(values))))
+        half *= shrink  # zoom into box around best point
+        center = u[np.argmin(values)]
+        box = (np.maximum(center-half, -0.99), np.minimum(center+half, 0.99))
+
+    starts = []
+    for i in np.argsort(values):  # distinct points with lowest true cost
+        if all(np.max(np.abs(u[i] - u[j])) > 0.05 for j in starts):
+            starts.append(i)
+        if len(starts) == n_starts:
+            break
+    return [np.append(to_x(u[i])[0], np.ones(len(cc)-1)) for i in starts]
+
+
+def parallel_jacobian(x, fun, bnds, executor, scheme='2-point', rel_step=None, f0=None):
+    """
+    Finite difference Jacobian with all perturbed evaluations run concurrently.
+
+    fun         -   residual function of one argument, must be picklable for
+                    process pools (e.g. functools.partial of resFun)
+    executor    -   thread or process pool executing the evaluations, None
+                    evaluates them one after another
+    scheme      -   '2-point' (forward) or '3-point' (central) differences
+    rel_step    -   relative step size, standart depends on scheme
+    f0          -   fun(x) if already known
+    Steps are flipped or made one-sided where they would leave the bounds.
+    """
+    x = np.asarray(x, dtype=float)
+    lb, ub = np.broadcast_to(bnds[0], x.shape), np.broadcast_to(bnds[1], x.shape)
+    eps = np.finfo(float).eps
+    if rel_step is None:
+        rel_step = eps**0.5 if scheme == '2-point' else eps**(1/3)
+    sign = np.where(x >= 0, 1, -1)
+    h = rel_step * sign * np.maximum(1, np.abs(x))
+    # flip steps that would leave feasible region
+    h = np.where((x + h > ub) | (x + h < lb), -h, h)
+
+    if scheme == '2-point':
+        central = np.zeros(x.size, dtype=bool)
+    elif scheme == '3-point':
+        central = (x - np.abs(h) >= lb) & (x + np.abs(h) <= ub)
+        h = np.where(central, np.abs(h), h)
+    else:
+        print('Error: Unknown finite difference scheme, choose "2-point" or "3-point".')
+        sys.exit()
+
+    # assemble all evaluation points, f(x) is needed for one-sided steps
+    points = [x] if f0 is None else []
+    for i in range(x.size):
+        x_up = x.copy()
+        x_up[i] += h[i]
+        points.append(x_up)
+        if central[i]:
+            x_down = x.copy()
+            x_down[i] -= h[i]
+            points.append(x_down)
+    values = list(map(fun, points) if executor is None else executor.map(fun, points))
+    if f0 is not None:
+        values.insert(0, f0)
+
+    f0, J, k = values[0], np.empty((values[0].size, x.size)), 1
+    for i in range(x.size):
+        if central[i]:
+            J[:, i] = (values[k] - values[k+1]) / (2*h[i])
+            k += 2
+        else:
+            J[:, i] = (values[k] - f0) / h[i]
+            k += 1
+    return J
+
+
+def jacobian_executor(workers, bins, pool='thread'):
+    """
+    Create executor for parallel Jacobians, threads or processes.
+
+    BLAS threads are limited so that workers and threads share the cores.
+    """
+    if pool == 'thread':
+        ex.limit_blas_threads(ex.split_cores(bins, workers=workers)[1])
+        return cf.ThreadPoolExecutor(max_workers=workers)
+    elif pool == 'process':
+        return ex.process_pool(bins, workers=workers)
+    else:
+        print('Error: Unknown pool for Jacobian, choose "thread" or "process".')
+        sys.exit()
+
+
+def mixed_precision(residual, bnds, switch_tol, executor=None, scheme='2-point'):
+    """
+    Residual function and Jacobian for fits in mixed precision.
+
+    Finite difference Jacobians, most of the residual evaluations, propagate
+    in single precision while the fit is far from converged. Residuals for
+    steps and costs are always double, so the optimizer verifies every step
+    and the result in double precision. Once the relative cost change between
+    iterations drops below switch_tol, Jacobians are computed in double too.
+    Rounding errors of exp(W) add up over the time steps, so the difference
+    steps are the square root of the single precision error at the start.
+    residual    -   residual function of one argument, taking a dtype keyword
+    returns residual function and Jacobian for scipy's least_squares
+    """
+    single = ft.partial(residual, dtype=np.float32)
+    state = {'x': None, 'f': None, 'cost': None, 'rel_step': None, 'single': True}
+
+    def fun(x):
+        state['x'], state['f'] = np.copy(x), residual(x)
+        return state['f']
+
+    def jac(x):
+        # called after each accepted step, residuals at x are those of the last call
+        known = np.array_equal(x, state['x'])
+        if state['single'] and known:
+            cost = 0.5*np.sum(state['f']**2)
+            if state['cost'] is not None and state['cost'] - cost < switch_tol*state['cost']:
+                state['single'] = False
+            state['cost'] = cost
+        if not state['single']:
+            return parallel_jacobian(x, residual, bnds, executor, scheme=scheme,
+                                     f0=state['f'] if known else None)
+        if state['rel_step'] is None:
+            noise = np.max(np.abs(single(x) - residual(x)))
+            state['rel_step'] = max(np.sqrt(noise), np.sqrt(np.finfo(np.float32).eps))
+        return parallel_jacobian(x, single, bnds, executor, scheme=scheme,
+                                 rel_step=state['rel_step'])
+    return fun, jac
+
+
+def optimization(init, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha, verbosity=0,
+                 varpro=False, jac_executor=None, jac_scheme='2-point', bc='reflective',
+                 precision='double', switch_tol=1e-2, engine='expm', engine_tol=1e-4,
+                 x_scale=None, cache=None):
+    """
+    Run one iteration of the non-linear optimization.
+
+    varpro          -   eliminate linear scalings by variable projection, only the
+                        six physical parameters are passed to the optimizer
+    jac_executor    -   if given, finite difference Jacobians are evaluated
+                        concurrently on this pool with scheme 'jac_scheme'
+    bc              -   boundary conditions, 'reflective' or 'open1side'
+    precision       -   'double', or 'mixed' for single precision Jacobians until
+                        the relative cost change drops below switch_tol
+    engine          -   'expm' or 'trbdf2' for banded time stepping, whose time step
+                        keeps the estimated error of the profiles within engine_tol,
+                        checked at the start value and at the result
+    x_scale         -   characteristic scale of all parameters, also sets the initial
+                        trust region, standart: 1
+    cache           -   mapping reusing numerical profiles, see theoretical_profiles
+    """
+    if varpro:
+        scale_bnds = (bnds[0][6:], bnds[1][6:])
+        bnds_opt = (bnds[0][:6], bnds[1][:6])
+    else:
+        bnds_opt = bnds
+    if x_scale is not None:
+        x_scale = np.asarray(x_scale)[:len(bnds_opt[0])]
+    else:
+        x_scale = 1.0
+
+    def fit(x0, step):
+        if varpro:
+            residual = ft.partial(resFun_varpro, xx=xx, cc=cc, tt=tt, dxx_dist=dxx_dist,
+                                  dxx_width=dxx_width, alpha=alpha, scale_bnds=scale_bnds,
+                                  bc=bc, engine=engine, step=step, cache=cache)
+        else:
+            # reduce residual function to one argument in order to work with algorithm
+            residual = ft.partial(resFun, xx=xx, cc=cc, tt=tt, dxx_dist=dxx_dist,
+                                  dxx_width=dxx_width, alpha=alpha, bc=bc, engine=engine,
+                                  step=step, cache=cache)
+
+        if precision == 'mixed':
+            optimize, jac = mixed_precision(residual, bnds_opt, switch_tol,
+                                            executor=jac_executor, scheme=jac_scheme)
+        elif precision == 'double':
+            optimize = residual
+            if jac_executor is not None:
+                jac = ft.partial(parallel_jacobian, fun=optimize, bnds=bnds_opt,
+                                 executor=jac_executor, scheme=jac_scheme)
+            else:
+                jac = '2-point'
+        else:
+            print('Error: Unknown precision, choose "double" or "mixed".')
+            sys.exit()
+
+        # running freely with standart termination conditions
+        return op.least_squares(optimize, x0, jac=jac, bounds=bnds_opt, x_scale=x_scale,
+                                verbose=verbosity)
+
+    x0, step = init[:len(bnds_opt[0])], None
+    if engine == 'trbdf2':
+        step, _ = banded_step(x0, xx, cc, tt, dxx_dist, engine_tol, bc=bc)
+    elif engine != 'expm':
+        print('Error: Unknown engine, choose "expm" or "trbdf2".')
+        sys.exit()
+    result = fit(x0, step)
+    while engine == 'trbdf2':  # refit with finer steps if the result misses engine_tol
+        finer, _ = banded_step(result.x, xx, cc, tt, dxx_dist, engine_tol, bc=bc, step=step)
+        if finer == step:
+            break
+        step, nfev = finer, result.nfev
+        result = fit(result.x, step)
+        result.nfev += nfev
+
+    if varpro:  # recover scalings so results can be stored and analyzed as usual
+        result.x = project_scalings(result.x, xx, cc, tt, dxx_dist, dxx_width, alpha,
+                                    scale_bnds=scale_bnds, bc=bc, engine=engine, step=step,
+                                    cache=cache)
+    return result
+
+
+def profile_sensitivities(parameters, xx, cc, tt, dxx_dist, dxx_width, rel_step=1e-4):
+    """
+    Sensitivity of every numerical profile to the six physical parameters.
+
+    Central differences of the profiles at tt[1:] are projected onto the
+    complement of the scaled experimental profile, because that direction is
+    absorbed by the scaling of the profile.
+    returns array of shape (profiles, bins, 6)
+    """
+    steps = rel_step*np.maximum(np.abs(parameters[:6]), 1)
+    J = []
+    for i, h in enumerate(steps):
+        p_up, p_down = np.array(parameters, dtype=float), np.array(parameters, dtype=float)
+        p_up[i] += h
+        p_down[i] -= h
+        c_up = theoretical_profiles(p_up, xx, cc, tt, dxx_dist, dxx_width)
+        c_down = theoretical_profiles(p_down, xx, cc, tt, dxx_dist, dxx_width)
+        J.append([(u[6:] - d[6:])/(2*h) for u, d in zip(c_up, c_down)])
+    J = np.moveaxis(np.array(J), 0, -1)
+    # remove component along measured profile, it is fitted by the scaling
+    c_exp = np.array(cc[1:])
+    norms = np.sum(c_exp**2, axis=1)
+    u = np.divide(c_exp, np.sqrt(norms)[:, np.newaxis], out=np.zeros_like(c_exp),
+                  where=norms[:, np.newaxis] > 0)
+    return J - u[:, :, np.newaxis]*np.einsum('pb,pbk->pk', u, J)[:, np.newaxis, :]
+
+
+# only differences of F are identifiable, F_sol + F_gel is a flat direction,
+# Fisher information is computed with F_sol fixed, i.e. for the F step
+FISHER_COLUMNS = [0, 1, 3, 4, 5]
+FISHER_NAMES = ['D_sol', 'D_gel', 'F_gel-F_sol', 't_sig', 'd_sig']
+
+
+def greedy_timepoints(fisher, budget, ridge=1e-12):
+    """
+    Greedily choose profiles maximizing det of summed Fisher information.
+
+    fisher  -   information matrices for every profile, shape (profiles, n, n)
+    """
+    selected = []
+    scale = np.trace(np.sum(fisher, axis=0)) / fisher.shape[1]
+    F_sel = np.eye(fisher.shape[1])*ridge*max(scale, 1)
+    candidates = list(range(fisher.shape[0]))
+    for _ in range(min(budget, len(candidates))):
+        gains = [np.linalg.slogdet(F_sel + fisher[i])[1] for i in candidates]
+        best = candidates.pop(int(np.argmax(gains)))
+        selected.append(best)
+        F_sel = F_sel + fisher[best]
+    return np.sort(selected)
+
+
+def select_timepoints(budget, init, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha,
+                      n_pilot=12):
+    """
+    Select the most informative time profiles before fitting.
+
+    A pilot fit on log-spaced profiles provides parameters for a quick
+    sensitivity analysis, profiles are then ranked by their Fisher
+    information on the identifiable physical parameters (FISHER_NAMES) and
+    'budget' profiles are kept.
+    returns indices of kept profiles in cc and expected precision loss
+    """
+    n_profiles = len(cc)-1
+    # pilot fit with variable projection on a log-spaced subset
+    pilot = np.unique(np.logspace(0, np.log10(n_profiles), num=n_pilot).astype(int))
+    cc_pilot = [cc[0]] + [cc[i] for i in pilot]
+    tt_pilot = np.append(tt[0], tt[pilot])
+    bnds_pilot = (bnds[0][:6+pilot.size], bnds[1][:6+pilot.size])
+    init_pilot = np.append(init[:6], np.ones(pilot.size))
+    res = optimization(init_pilot, bnds_pilot, xx, cc_pilot, tt_pilot, dxx_dist, dxx_width,
+                       alpha, varpro=True)
+    print('Pilot fit on %i profiles done, cost = %.5f' % (pilot.size, res.cost))
+
+    # Fisher information of each profile, noise level from pilot residuals
+    J = profile_sensitivities(res.x, xx, cc, tt, dxx_dist, dxx_width)[..., FISHER_COLUMNS]
+    sigma2 = 2*res.cost / max(res.fun.size - res.x.size, 1)
+    fisher = np.einsum('pbi,pbj->pij', J, J) / sigma2
+    selected = greedy_timepoints(fisher, budget)
+
+    # expected loss in precision compared to using all profiles
+    std_all = np.sqrt(np.diag(np.linalg.pinv(np.sum(fisher, axis=0))))
+    std_sel = np.sqrt(np.diag(np.linalg.pinv(np.sum(fisher[selected], axis=0))))
+    return selected + 1, std_sel/std_all
+
+
+def subsample_timepoints(budget, init, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha,
+                         path='timepoints.txt', reuse=False):
+    """Reduce profiles to budget, stored selection is reused for analysis."""
+    if reuse and os.path.exists(path):
+        tt_sel = np.atleast_1d(np.loadtxt(path, delimiter=','))
+        indices = np.array([np.argmin(np.abs(tt - t)) for t in tt_sel])
+        print('Using %i previously selected profiles.' % indices.size)
+    else:
+        indices, loss = select_timepoints(budget, init, bnds, xx, cc, tt, dxx_dist,
+                                          dxx_width, alpha)
+        names = FISHER_NAMES
+        print('Kept %i of %i profiles, expected increase of parameter uncertainties:'
+              % (indices.size, len(cc)-1))
+        print('\n'.join('  %s: x %.3f' % (n, l) for n, l in zip(names, loss)))
+        np.savetxt(path, tt[indices], delimiter=',',
+                   header=('Time points [s] selected by Fisher information\n'
+                           'Expected factor of stdev increase for %s: %s'
+                           % (', '.join(names), ', '.join('%.3f' % l for l in loss))))
+    cc = [cc[0]] + [cc[i] for i in indices]
+    tt = np.append(tt[0], tt[indices])
+    return cc, tt
+
+
+def stream_profiles(data, dt):
+    """Distance vector, profiles including t=0 profile and times of streamed data."""
+    cc, tt = io.selectProfiles(data, dt, 'all')
+    return data[:, 0], fp.build_zero_profile(cc), tt
+
+
+def incremental_profiles(parameters, xx, cc, tt, dxx_dist, dxx_width, cache,
+                         bc='reflective'):
+    """
+    Numerical profiles at tt[1:], extending the profiles of earlier batches.
+
+    cache holds parameters, propagator and profiles of the last accepted
+    solution (see commit_profiles). For these parameters only new time
+    points are propagated, starting from the last cached profile, for all
+    other parameters the profiles are computed from scratch.
+    """
+    if cache.get('x') is None or not np.array_equal(cache['x'], parameters[:6]):
+        return theoretical_profiles(parameters, xx, cc, tt, dxx_dist, dxx_width, bc=bc)
+    profiles, times = cache['profiles'], cache['times']
+    if len(profiles) >= len(tt)-1:
+        return profiles[:len(tt)-1]
+    new = (tt[1:] - tt[0])[len(profiles):]
+    if new.size > 0:  # step from last known profile
+        if bc == 'reflective':
+            profiles = profiles + fp.calcC_series(profiles[-1], new-times[-1], T=cache['T'])
+        else:
+            profiles = profiles + propagate(cache['W'], profiles[-1], new-times[-1], bc=bc)
+    return profiles
+
+
+def commit_profiles(parameters, xx, cc, tt, dxx_dist, dxx_width, cache, bc='reflective'):
+    """Store propagator and profiles of an accepted solution in cache."""
+    if cache.get('x') is None or not np.array_equal(cache['x'], parameters[:6]):
+        W, F = rate_matrix(parameters, xx, dxx_dist)
+        cache.update(x=np.array(parameters[:6]), W=W, profiles=[], times=np.zeros(1),
+                     T=al.expm(W) if bc == 'reflective' else None)
+        cache['profiles'] = propagate(W, cc[0], tt[1:]-tt[0], bc=bc)
+    else:
+        cache['profiles'] = incremental_profiles(parameters, xx, cc, tt, dxx_dist, dxx_width,
+                                                 cache, bc=bc)
+    cache['times'] = tt[1:] - tt[0]
+    return cache['profiles']
+
+
+def resFun_stream(parameters, xx, cc, tt, dxx_dist, dxx_width, alpha, cache,
+                  scale_bnds=(0, 100), bc='reflective'):
+    """Residuals as resFun, or resFun_varpro for six parameters, using cached profiles."""
+    cc_theo = incremental_profiles(parameters, xx, cc, tt, dxx_dist, dxx_width, cache, bc=bc)
+    if len(parameters) == 6:
+        scalings = optimal_scalings(cc, cc_theo, alpha=alpha, bnds=scale_bnds)
+        parameters = np.append(parameters, scalings)
+    return residuals(parameters, cc, cc_theo, alpha)
 
-    # running freely with standart termination conditions
-    result = op.least_squares(optimize, init, bounds=bnds, verbose=verbosity)
 
+def stream_batch(x, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha, cache, verbosity=0,
+                 varpro=False, bc='reflective'):
+    """
+    Re-fit after new profiles arrived, warm-started from the previous solution x.
+
+    Scalings of new profiles start at one, with varpro they are projected out.
+    """
+    scale_bnds = (bnds[0][6:], bnds[1][6:])
+    if varpro:
+        x0, bnds_opt = x[:6], (bnds[0][:6], bnds[1][:6])
+    else:
+        x0, bnds_opt = np.concatenate((x, np.ones(len(cc)-1+6-x.size))), bnds
+    optimize = ft.partial(resFun_stream, xx=xx, cc=cc, tt=tt, dxx_dist=dxx_dist,
+                          dxx_width=dxx_width, alpha=alpha, cache=cache,
+                          scale_bnds=scale_bnds, bc=bc)
+    result = op.least_squares(optimize, x0, bounds=bnds_opt, verbose=verbosity)
+    cc_theo = commit_profiles(result.x, xx, cc, tt, dxx_dist, dxx_width, cache, bc=bc)
+    if varpro:  # recover scalings so results can be stored as usual
+        result.x = np.append(result.x, optimal_scalings(cc, cc_theo, alpha=alpha,
+                                                        bnds=scale_bnds))
     return result
 
 
+def stream_fit(runs, alpha, opts, verbosity=0):
+    """
+    Fit while profiles are recorded, until no new profiles arrive for a while.
+
+    The first batch is fitted from 'runs' random starts, every later batch is
+    warm-started from the previous solution, plus opts.stream_starts random
+    starts in case the first batches led into a local minimum. Each solution
+    is stored in results_stream.h5, the parameter history in results/stream.txt.
+    """
+    path, frames, cache = opts.path[0], {}, {}
+    savePath = os.path.join(os.getcwd(), 'results/')
+    if not os.path.exists(savePath):
+        os.makedirs(savePath)
+    x, n_seen, batch, converged = None, 0, 0, False
+    history, last_new = [], time.time()
+    print('Watching %s for new profiles, stop with Ctrl-C...' % path)
+    try:
+        while time.time() - last_new < opts.stream_idle:
+            data = io.readStream(path, frames)
+            n_profiles = 0 if data is None else data.shape[1]-2  # without t=0
+            if n_profiles <= n_seen or n_profiles < opts.stream_min:
+                time.sleep(opts.poll)
+                continue
+            last_new, n_seen, batch = time.time(), n_profiles, batch+1
+            xx, cc, tt = stream_profiles(data, opts.dt)
+            if batch == 1:
+                dxx_dist, dxx_width = fp.discretization_Block(xx)
+                limit_threads(opts, cc[0].size)  # grid size is known from the first batch
+            bnds, inits = initialize_optimization(runs, 2, n_profiles, xx)
+
+            start = time.time()
+            if x is None:  # multistart on first batch
+                fits = [optimization(init, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha,
+                                     verbosity, varpro=opts.varpro, bc=opts.bc)
+                        for init in inits]
+                res = min(fits, key=lambda fit: fit.cost)
+                commit_profiles(res.x, xx, cc, tt, dxx_dist, dxx_width, cache, bc=opts.bc)
+                change = np.inf
+            else:
+                res = stream_batch(x, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha, cache,
+                                   verbosity, varpro=opts.varpro, bc=opts.bc)
+                # fresh starts guard against a basin picked from the first few profiles
+                fresh = [optimization(init, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha,
+                                      verbosity, varpro=opts.varpro, bc=opts.bc)
+                         for init in inits[:opts.stream_starts]]
+                if fresh and min(fit.cost for fit in fresh) < res.cost:
+                    res = min(fresh, key=lambda fit: fit.cost)
+                    commit_profiles(res.x, xx, cc, tt, dxx_dist, dxx_width, cache, bc=opts.bc)
+                change = np.max(np.abs(res.x[:6]-x[:6]) / (np.abs(x[:6])+1))
+            x = res.x
+            with pd.HDFStore('results_stream.h5', complevel=9) as results:
+                append_result(res, results, batch)
+            history.append([batch, n_profiles, tt[-1], res.cost, change,
+                            time.time()-start] + list(x[:6]))
+            print('Batch %i: %i profiles up to t = %i s, cost %.5g, rel. change %.2e '
+                  '(%.1f s)' % (batch, n_profiles, tt[-1], res.cost, change, history[-1][5]))
+            if change < opts.stream_tol and not converged:
+                converged = True
+                print('Parameters converged, acquisition can be stopped.\n'
+                      'D = %.2f, %.2f, F = %.3f, %.3f, t = %.2f, d = %.2f' % tuple(x[:6]))
+    except KeyboardInterrupt:
+        print('\nStopped watching %s.' % path)
+
+    if history:
+        np.savetxt(savePath+'stream.txt', np.array(history), delimiter=',',
+                   header=('Parameters after each batch of streamed profiles\n'
+                           'columns: batch, profiles, t_last [s], cost, rel. change, '
+                           'fit time [s], D_sol, D_gel, F_sol, F_gel, t_sig, d_sig'))
+    return max(batch, 1)
+
+
+def perbin_objective(theta, cc, tt, dxx_dist, dxx_width, alpha, D_scale=100,
+                     scale_bnds=(0, 100), check=True):
+    """
+    Cost and adjoint gradient for free D and F in every measured bin.
+
+    theta   -   [D/D_scale for each bin, F for each bin], D is rescaled so
+                that both halves have similar magnitude for the optimizer
+    Scalings are eliminated in closed form, so by the envelope theorem they
+    do not contribute to the gradient. Smoothness prior is
+    0.5*alpha^2*(||diff(D)||^2 + ||diff(F)||^2), as in regularization_term.
+    check   -   check conservation invariants of W, see cross_checking
+    """
+    dim = theta.size // 2
+    D_bins, F_bins = theta[:dim]*D_scale, theta[dim:]
+    # first 6 bulk bins share the value of the first measured bin
+    D = np.concatenate((np.ones(6)*D_bins[0], D_bins))
+    F = np.concatenate((np.ones(6)*F_bins[0], F_bins))
+
+    W_diags = fp.WMatrixVar_batch(D, F, start=4, deltaXX=dxx_dist)
+    if check:  # conservation invariants
+        cross_checking(W_diags, F[np.newaxis], dxx_width)
+    lam, V, s = fp.eigW_batch(*[w[0] for w in W_diags])
+    times = tt[1:]-tt[0]
+    c_num = (s[:, np.newaxis] * (V @ ((V.T @ (cc[0]/s))[:, np.newaxis] *
+                                      np.exp(lam[:, np.newaxis]*times)))).T
+    cc_theo = list(c_num)
+    scalings = optimal_scalings(cc, cc_theo, alpha=alpha, bnds=scale_bnds)
+    RR = np.array(cc[1:])*scalings[:, np.newaxis] - c_num[:, 6:]
+
+    cost = 0.5*np.sum(RR**2) + 0.5*alpha**2*(np.sum(np.diff(D_bins)**2) +
+                                            np.sum(np.diff(F_bins)**2) +
+                                            np.sum((scalings-1)**2))
+    # adjoint: residuals act as sources for the backward propagation
+    adj = np.zeros_like(c_num)
+    adj[:, 6:] = -RR
+    grad_W = fp.calcC_adjoint(cc[0], times, lam, V, s, adj)
+    grad_D, grad_F = fp.WMatrixVar_grad(D, F, 4, dxx_dist, grad_W)
+    # bulk bins map onto first measured bin
+    grad_D = np.append(np.sum(grad_D[:7]), grad_D[7:])
+    grad_F = np.append(np.sum(grad_F[:7]), grad_F[7:])
+    # smoothness prior
+    if alpha > 0:
+        for grad, values in [(grad_D, D_bins), (grad_F, F_bins)]:
+            dv = np.diff(values)
+            grad[:-1] -= alpha**2*dv
+            grad[1:] += alpha**2*dv
+    return cost, np.concatenate((grad_D*D_scale, grad_F))
+
+
+def initialize_perbin(runs, dim, DMax=1000, FMax=20, DMin=1e-3):
+    """
+    Set up bounds and start values for per-bin fit, same ranges as io.startUp.
+
+    D is kept slightly above zero, the propagator needs positive rates.
+    Every start uses one random D for all bins and flat F.
+    """
+    bnds = list(zip(np.concatenate((np.ones(dim)*DMin, -np.ones(dim)*FMax)),
+                    np.concatenate((np.ones(dim)*DMax, np.ones(dim)*FMax))))
+    inits = [np.concatenate((np.ones(dim)*d, np.zeros(dim)))
+             for d in np.random.rand(runs)*DMax]
+    return bnds, inits
+
+
+def perbin_optimization(init, bnds, cc, tt, dxx_dist, dxx_width, alpha, verbosity=0,
+                        D_scale=100, maxiter=5000, check=True):
+    """
+    Fit free D, F in every bin with L-BFGS-B and adjoint gradients.
+
+    One gradient costs about two model evaluations independent of the
+    number of bins. Returned result contains D, F in physical units in x.
+    """
+    objective = ft.partial(perbin_objective, cc=cc, tt=tt, dxx_dist=dxx_dist,
+                           dxx_width=dxx_width, alpha=alpha, D_scale=D_scale, check=check)
+    dim = len(init) // 2
+    scale = np.append(np.ones(dim)*D_scale, np.ones(dim))
+    result = op.minimize(objective, init/scale, jac=True, method='L-BFGS-B',
+                         bounds=[(lo/sc, up/sc) for (lo, up), sc in zip(bnds, scale)],
+                         options={'maxiter': maxiter, 'disp': verbosity > 0})
+    result.x = result.x*scale
+    result.cost = result.fun
+    return result
+
+
+def perbin_fit(runs, xx, cc, tt, dxx_dist, dxx_width, alpha, verbosity=0):
+    """Run per-bin fits and save D, F profiles of the best run."""
+    dim = xx.size
+    bnds, inits = initialize_perbin(runs, dim)
+    completed_runs = 1
+    for init in inits:
+        try:
+            res = perbin_optimization(np.array(init), bnds, cc, tt, dxx_dist, dxx_width,
+                                      alpha, verbosity)
+        except KeyboardInterrupt:
+            print('\n\nScript has been terminated.\nData will now be analyzed...')
+            break
+        with pd.HDFStore('results_perbin.h5', complevel=9) as results:
+            append_result({'x': res.x, 'cost': res.cost, 'nit': res.nit,
+                           'success': res.success}, results, completed_runs)
+        print('\nCompleted %i per-bin runs out of %i, cost = %.5f\n'
+              % (completed_runs, len(inits), res.cost))
+        completed_runs += 1
+    with pd.HDFStore('results_perbin.h5', mode='r') as results:
+        perbin_analysis(results, xx, cc, tt, dxx_dist, alpha)
+    return completed_runs
+
+
+def perbin_analysis(result, xx, cc, tt, dxx_dist, alpha):
+    """Save D, F profiles and numerical profiles of best per-bin run."""
+    savePath = os.path.join(os.getcwd(), 'results/')
+    if not os.path.exists(savePath):
+        os.makedirs(savePath)
+    key_best, theta = best_run(result)
+    dim = theta.size // 2
+    D = np.concatenate((np.ones(6)*theta[0], theta[:dim]))
+    F = np.concatenate((np.ones(6)*theta[dim], theta[dim:]))
+    W = fp.tridiag_dense(*[w[0] for w in fp.WMatrixVar_batch(D, F, 4, dxx_dist)])
+    cc_theo = [fp.calcC(cc[0], t=(t-tt[0]), W=W) for t in tt[1:]]
+    scalings = optimal_scalings(cc, cc_theo, alpha=alpha)
+    error = np.sqrt(2*result[key_best]['cost'].values[0] / (cc[1].size*(len(cc)-1)))
+    print('\nBest per-bin run %s with error %.5f' % (key_best, error))
+
+    np.savetxt(savePath+'DF_perbin.txt', np.c_[D, F-F[0]], delimiter=',',
+               header=('Diffusivity and free energy profiles fitted in every bin, '
+                       'error = %.5f, alpha = %g\n'
+                       'cloumn1: diffusivity [micro_m^2/s]\n'
+                       'cloumn2: free energy [k_BT]' % (error, alpha)))
+    header_cons = ''.join('column%i: c-profile for t_%i = %i s\n' % (i+1, i+1, int(t))
+                          for i, t in enumerate(tt[1:]))
+    np.savetxt(savePath+'cc_theo_perbin.txt', np.array(cc_theo).T, delimiter=',',
+               header='Numerically computed concentration profiles\n'+header_cons)
+    np.savetxt(savePath+'scalings_perbin.txt', scalings, delimiter=',',
+               header='Fitted scaling coefficients for best per-bin run.')
+
+
+def joint_offsets(ccs):
+    """Offsets of per-replicate scalings in the joint parameter vector."""
+    return 6 + np.cumsum([0] + [len(cc)-1 for cc in ccs])
+
+
+def joint_block(k, parameters, xx, ccs, tts, dxx_dist, dxx_width, varpro=False, alpha=0,
+                scale_bnds=(0, 100)):
+    """
+    Compute residual block and scalings of replicate k in joint fit.
+
+    With varpro the scalings of the replicate are solved in closed form,
+    including their regularization, and parameters contains only the
+    physical parameters.
+    scale_bnds  -   bounds of all scalings of the joint fit, scalars or arrays
+    """
+    cc_theo = theoretical_profiles(parameters, xx, ccs[k], tts[k], dxx_dist, dxx_width)
+    offsets = joint_offsets(ccs) - 6
+    if varpro:
+        bnds = [np.broadcast_to(b, offsets[-1])[offsets[k]:offsets[k+1]] for b in scale_bnds]
+        scalings = optimal_scalings(ccs[k], cc_theo, alpha=alpha, bnds=bnds)
+    else:
+        scalings = parameters[6+offsets[k]:6+offsets[k+1]]
+    block = residuals(np.append(parameters[:6], scalings), ccs[k], cc_theo, alpha=0)
+    return block, scalings
+
+
+def resFun_joint(parameters, xx, ccs, tts, dxx_dist, dxx_width, alpha, executor=None,
+                 varpro=False, scale_bnds=(0, 100)):
+    """
+    Compute residuals of all replicates sharing D, F, t and d.
+
+    parameters  -   [6 physical parameters, scalings replicate 1, scalings 2, ...],
+                    with varpro only the physical parameters
+    executor    -   evaluates the per-replicate blocks concurrently if given
+    scale_bnds  -   bounds of all scalings, used with varpro
+    Regularization is added once for the shared parameters and all scalings.
+    """
+    block = ft.partial(joint_block, parameters=parameters, xx=xx, ccs=ccs, tts=tts,
+                       dxx_dist=dxx_dist, dxx_width=dxx_width, varpro=varpro, alpha=alpha,
+                       scale_bnds=scale_bnds)
+    indices = range(len(ccs))
+    blocks = list(executor.map(block, indices) if executor is not None else map(block, indices))
+    RRn = np.concatenate([b for b, scalings in blocks])
+    if alpha > 0:
+        scalings = np.concatenate([scalings for b, scalings in blocks])
+        RRn = np.append(RRn, regularization_term(parameters[:2], parameters[2:4],
+                                                 parameters[4], parameters[5],
+                                                 scalings, alpha=alpha))
+    return RRn
+
+
+def joint_sparsity(ccs, alpha):
+    """
+    Sparsity structure of the joint Jacobian.
+
+    Rows of replicate k depend on the physical parameters and only on the
+    scaling of the respective profile, residuals are ordered bin by bin.
+    """
+    offsets = joint_offsets(ccs)
+    n_rows = sum(cc[1].size*(len(cc)-1) for cc in ccs)
+    n_reg = (4 + offsets[-1] - 6) if alpha > 0 else 0
+    pattern = sp_sparse.lil_matrix((n_rows + n_reg, offsets[-1]), dtype=int)
+    pattern[:, :6] = 1
+    row = 0
+    for k, cc in enumerate(ccs):
+        n_prof, bins = len(cc)-1, cc[1].size
+        for j in range(n_prof):
+            pattern[row + np.arange(bins)*n_prof + j, offsets[k] + j] = 1
+        row += n_prof*bins
+    if alpha > 0:  # scalings_reg only depend on respective scaling
+        pattern[n_rows+4:, 6:] = sp_sparse.eye(offsets[-1]-6, dtype=int)
+        pattern[n_rows+4:, :6] = 0
+    return pattern
+
+
+def grouped_jacobian(x, fun, bnds, sparsity, f0=None):
+    """
+    Forward difference Jacobian, columns without common rows are perturbed together.
+
+    sparsity    -   pattern of non-zero entries (rows, columns), e.g. joint_sparsity
+    Steps are chosen as in parallel_jacobian. The Jacobian is returned dense,
+    so the exact trust region solver is used instead of lsmr.
+    """
+    x = np.asarray(x, dtype=float)
+    pattern = (sparsity.toarray() if sp_sparse.issparse(sparsity) else
+               np.asarray(sparsity)).astype(bool)
+    lb, ub = np.broadcast_to(bnds[0], x.shape), np.broadcast_to(bnds[1], x.shape)
+    h = np.finfo(float).eps**0.5 * np.where(x >= 0, 1, -1) * np.maximum(1, np.abs(x))
+    h = np.where((x + h > ub) | (x + h < lb), -h, h)
+
+    # greedy grouping of structurally independent columns
+    groups, covered = [], []
+    for j in range(x.size):
+        for group, rows in zip(groups, covered):
+            if not np.any(rows & pattern[:, j]):
+                group.append(j)
+                rows |= pattern[:, j]
+                break
+        else:
+            groups.append([j])
+            covered.append(pattern[:, j].copy())
+
+    f0 = fun(x) if f0 is None else f0
+    J = np.zeros((f0.size, x.size))
+    for group in groups:
+        x_up = x.copy()
+        x_up[group] += h[group]
+        diff = fun(x_up) - f0
+        for j in group:
+            rows = pattern[:, j]
+            J[rows, j] = diff[rows] / h[j]
+    return J
+
+
+def joint_optimization(init, bnds, xx, ccs, tts, dxx_dist, dxx_width, alpha, verbosity=0,
+                       workers=None, varpro=False):
+    """
+    Run one joint optimization of all replicates.
+
+    Replicate blocks are evaluated in a thread pool. Without varpro the
+    block structure of the Jacobian is used to difference all scalings with
+    a single evaluation, the solver itself works on the dense Jacobian.
+    """
+    executor, limits = ex.thread_pool(ccs[0][0].size, n_tasks=len(ccs), workers=workers)
+    scale_bnds = (bnds[0][6:], bnds[1][6:])
+    with executor, limits:
+        optimize = ft.partial(resFun_joint, xx=xx, ccs=ccs, tts=tts, dxx_dist=dxx_dist,
+                              dxx_width=dxx_width, alpha=alpha, executor=executor,
+                              varpro=varpro, scale_bnds=scale_bnds)
+        if varpro:
+            result = op.least_squares(optimize, init[:6], bounds=(bnds[0][:6], bnds[1][:6]),
+                                      verbose=verbosity)
+            # recover scalings of all replicates
+            blocks = [joint_block(k, result.x, xx, ccs, tts, dxx_dist, dxx_width, varpro=True,
+                                  alpha=alpha, scale_bnds=scale_bnds) for k in range(len(ccs))]
+            result.x = np.concatenate([result.x] + [scalings for b, scalings in blocks])
+        else:
+            sparsity, last = joint_sparsity(ccs, alpha), {}
+
+            def residual(x):  # last evaluation is the base point of the next Jacobian
+                last['x'], last['f'] = np.copy(x), optimize(x)
+                return last['f']
+
+            def jac(x):
+                f0 = last['f'] if 'x' in last and np.array_equal(last['x'], x) else None
+                return grouped_jacobian(x, optimize, bnds, sparsity, f0=f0)
+            result = op.least_squares(residual, init, jac=jac, bounds=bnds, verbose=verbosity)
+    return result
+
+
+def split_joint_result(result, xx, ccs, tts, dxx_dist, dxx_width):
+    """Split joint result into one result per replicate for storage and analysis."""
+    offsets = joint_offsets(ccs)
+    split = []
+    for k in range(len(ccs)):
+        x = np.append(result.x[:6], result.x[offsets[k]:offsets[k+1]])
+        fun, scalings = joint_block(k, result.x, xx, ccs, tts, dxx_dist, dxx_width)
+        split.append({'x': x, 'fun': fun, 'cost': 0.5*np.sum(fun**2),
+                      'nfev': result.nfev, 'status': result.status,
+                      'success': result.success})
+    return split
+
+
+def joint_fit(runs, xx, ccs, tts, dxx_dist, dxx_width, alpha, verbosity=0, workers=None,
+              varpro=False, **options):
+    """
+    Fit replicates jointly and analyze each replicate with the shared D, F.
+
+    options -   analysis options passed on to joint_analysis
+    """
+    n_profiles = sum(len(cc)-1 for cc in ccs)
+    bnds, inits = initialize_optimization(runs, 2, n_profiles, xx)
+    completed_runs = 1
+    for init in inits:
+        try:
+            res = joint_optimization(init, bnds, xx, ccs, tts, dxx_dist, dxx_width, alpha,
+                                     verbosity, workers=workers, varpro=varpro)
+        except KeyboardInterrupt:
+            print('\n\nScript has been terminated.\nData will now be analyzed...')
+            break
+        with pd.HDFStore('results.h5', complevel=9) as results:
+            append_result(res, results, completed_runs)
+        # per replicate views are analyzed like single data sets
+        for k, res_k in enumerate(split_joint_result(res, xx, ccs, tts, dxx_dist, dxx_width)):
+            with pd.HDFStore('results_rep%i.h5' % (k+1), complevel=9) as results:
+                append_result(res_k, results, completed_runs)
+        print('\nCompleted %i joint runs out of %i...\n' % (completed_runs, len(inits)))
+        completed_runs += 1
+    joint_analysis(xx, ccs, tts, dxx_dist, dxx_width, alpha, workers=workers, **options)
+    return completed_runs
+
+
+def joint_analysis(xx, ccs, tts, dxx_dist, dxx_width, alpha, crit_err=0.3, bc='reflective',
+                   reports=REPORTS, workers=None, fresh=False, campaign=None, paths=None):
+    """
+    Analyze each replicate of a joint fit in a separate results folder.
+
+    Options as in analysis, paths of the replicate data name the data sets
+    in the campaign table, standart: their results folders.
+    """
+    for k, (cc, tt) in enumerate(zip(ccs, tts)):
+        savePath = os.path.join(os.getcwd(), 'results', 'replicate_%i/' % (k+1))
+        dataset = os.path.abspath(paths[k]) if paths is not None else savePath
+        with pd.HDFStore('results_rep%i.h5' % (k+1), mode='r') as result:
+            analysis(result, xx, cc, tt, dxx_dist, dxx_width, alpha, crit_err,
+                     savePath=savePath, bc=bc, reports=reports, workers=workers,
+                     fresh=fresh, campaign=campaign, dataset=dataset)
+
+
+def limit_threads(opts, bins):
+    """BLAS threads of this process, so that several fits can run side by side."""
+    ex.limit_blas_threads(opts.threads if opts.threads is not None else
+                          ex.split_cores(bins)[1])
+
+
 def main():
     """Set up optimization and run it."""
     # reading input and setting up analysis
-    verbosity, runs, ana, xx, cc, tt, alpha = io.startUp_slim()
+    verbosity, runs, ana, xx, cc, tt, alpha, opts = io.startUp_slim()
+    if xx is not None:  # same execution policy for every mode, with 6 bulk bins
+        limit_threads(opts, xx.size+6)
+    if opts.bc != 'reflective' and (len(opts.path) > 1 or opts.perbin or opts.global_search or
+                                    opts.alpha_sweep is not None or opts.boot > 0 or
+                                    opts.budget is not None or opts.screen is not None):
+        print('Error: Open boundaries are only supported for the standard multistart fit!')
+        sys.exit()
+    if opts.stream:  # fit while profiles are recorded
+        return stream_fit(runs, alpha, opts, verbosity)
+    if len(opts.path) > 1:  # replicates, fit jointly with shared D, F
+        dxx_dist, dxx_width = fp.discretization_Block(xx)
+        ccs = [fp.build_zero_profile(c) for c in cc]
+        # same analysis options as for single data sets
+        options = {'crit_err': opts.crit_err, 'bc': opts.bc, 'reports': opts.reports,
+                   'fresh': opts.fresh, 'campaign': opts.campaign, 'paths': opts.path}
+        if ana:
+            print('\nDoing analysis of joint fit only.')
+            joint_analysis(xx, ccs, tt, dxx_dist, dxx_width, alpha, workers=opts.workers,
+                           **options)
+            sys.exit()
+        print('Fitting %i replicates jointly.' % len(ccs))
+        return joint_fit(runs, xx, ccs, tt, dxx_dist, dxx_width, alpha, verbosity,
+                         workers=opts.workers, varpro=opts.varpro, **options)
+
+    if opts.perbin:  # free D, F in every bin
+        dxx_dist, dxx_width = fp.discretization_Block(xx)
+        cc = fp.build_zero_profile(cc)
+        if ana:
+            with pd.HDFStore('results_perbin.h5', mode='r') as results:
+                perbin_analysis(results, xx, cc, tt, dxx_dist, alpha)
+            sys.exit()
+        print('Fitting D and F in all %i bins.' % xx.size)
+        return perbin_fit(runs, xx, cc, tt, dxx_dist, dxx_width, alpha, verbosity)
     n_profiles = cc[0, :].size-1  # number of profiles without c(t=0)
 
     dxx_dist, dxx_width = fp.discretization_Block(xx)  # get variable discretization
@@ -390,29 +2196,84 @@ def main():
     # set up optimization
     params = 2  # only fit here Dsol, Fsol and Dmuc, Fmuc
     bnds, inits = initialize_optimization(runs, params, n_profiles, xx)
+    if opts.budget is not None and opts.budget < n_profiles:
+        print('\nSelecting %i most informative profiles...' % opts.budget)
+        cc, tt = subsample_timepoints(opts.budget, inits[0], bnds, xx, cc, tt, dxx_dist,
+                                      dxx_width, alpha, reuse=ana)
+        n_profiles = len(cc)-1
+        bnds, inits = initialize_optimization(runs, params, n_profiles, xx)
 
     if ana:  # make only analysis
         print('\nDoing analysis only.')
         res = pd.HDFStore('results.h5', mode='r')
         print('Overall %i runs have been performed.' % res.root._v_nchildren)
-        analysis(res, xx, cc, tt, dxx_dist, dxx_width, alpha, crit_err=0.3)
+        analysis(res, xx, cc, tt, dxx_dist, dxx_width, alpha, crit_err=opts.crit_err, bc=opts.bc,
+                 reports=opts.reports, workers=opts.workers, fresh=opts.fresh,
+                 campaign=opts.campaign)
+        uncertainty_analysis(res, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha, opts)
         print('\nPlots have been made and data was extraced and saved.')
         sys.exit()
 
+    x_scale = None
+    if opts.cont is not None:  # warm starts from the runs of a related data set
+        inits, x_scale = continuation_starts(opts.cont, len(inits), bnds,
+                                             crit_err=opts.crit_err)
+        print('\nContinuing from %s with %i warm starts.' % (opts.cont, len(inits)))
+    elif opts.screen is not None and not opts.global_search:  # starts from surrogate minima
+        print('\nScreening parameter space with %i batched evaluations...' % opts.screen)
+        inits = screen_starts(opts.screen, len(inits), bnds, xx, cc, tt, dxx_dist, dxx_width,
+                              alpha)
+
+    if opts.alpha_sweep is not None:  # compute regularization path only
+        alpha_min, alpha_max, n_alpha = opts.alpha_sweep
+        alphas = np.logspace(np.log10(alpha_min), np.log10(alpha_max), int(n_alpha))
+        print('\nComputing regularization path for %i alphas with %i chains.'
+              % (alphas.size, len(inits)))
+        path, corner = alpha_sweep(inits, alphas, bnds, xx, cc, tt, dxx_dist, dxx_width,
+                                   workers=opts.workers, varpro=opts.varpro)
+        savePath = os.path.join(os.getcwd(), 'results/')
+        if not os.path.exists(savePath):
+            os.makedirs(savePath)
+        save_lcurve(path, corner, savePath)
+        print('\nL-curve corner at alpha = %g, ||A*x - y|| = %.5f, ||x - x_ref|| = %.5f'
+              % tuple(path[corner, [0, 2, 3]]))
+        return len(inits)
+
+    # evaluate finite difference Jacobians concurrently if requested
+    jac_executor = None
+    if opts.jac_workers is not None:
+        jac_executor = jacobian_executor(opts.jac_workers, cc[0].size, pool=opts.jac_pool)
+
     completed_runs = 1
     for i, init in enumerate(inits):  # looping through all different start values
+        try:
+            if opts.global_search:  # population based search instead of random start
+                res = global_optimization(bnds, xx, cc, tt, dxx_dist, dxx_width, alpha,
+                                          verbosity, seed=i, jac_executor=jac_executor,
+                                          jac_scheme=opts.jac_scheme)
+            else:
+                res = optimization(init, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha,
+                                   verbosity, varpro=opts.varpro, jac_executor=jac_executor,
+                                   jac_scheme=opts.jac_scheme, bc=opts.bc,
+                                   precision=opts.precision, switch_tol=opts.switch_tol,
+                                   engine=opts.engine, engine_tol=opts.engine_tol,
+                                   x_scale=x_scale)
+        except KeyboardInterrupt:
+            print('\n\nScript has been terminated.\nData will now be analyzed...')
+            break
+        # storage is only opened for appending, worker processes must not inherit it
         with pd.HDFStore('results.h5', complevel=9) as results:
-            try:
-                res = optimization(init, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha, verbosity)
-                append_result(res, results, completed_runs)  # append to .hdf storage file
-                print('\nCompleted %i runs out of %i...\n' % (completed_runs, len(inits)))
-                completed_runs += 1
-            except KeyboardInterrupt:
-                print('\n\nScript has been terminated.\nData will now be analyzed...')
-                break
+            append_result(res, results, completed_runs)  # append to .hdf storage file
+        print('\nCompleted %i runs out of %i...\n' % (completed_runs, len(inits)))
+        completed_runs += 1
+    if jac_executor is not None:
+        jac_executor.shutdown()
 
     results = pd.HDFStore('results.h5', mode='r')  # read storage again, now no write
-    analysis(results, xx, cc, tt, dxx_dist, dxx_width, alpha, crit_err=0.3)
+    analysis(results, xx, cc, tt, dxx_dist, dxx_width, alpha, crit_err=opts.crit_err, bc=opts.bc,
+             reports=opts.reports, workers=opts.workers, fresh=opts.fresh,
+             campaign=opts.campaign)
+    uncertainty_analysis(results, bnds, xx, cc, tt, dxx_dist, dxx_width, alpha, opts)
 
     return completed_runs  # returns number of runs in order to compute average time per run
 
@@ -355,17 +355,363 @@ def calcC(cc, t, W=None, T=None, bc='reflective', W10=None, c0=None, Qb=None,
                     print('Error: Either W or Q Matrix must be given for'
                           ' computation!')
                     sys.exit()
-                Q = la.inv(W)  # inverse of W
             if b is None:
                 if (W10 is None) or (c0 is None):
                     print('Error: W10 and c0 must be specified for'
                           'open boundaries!')
                     sys.exit()
                 b = np.append(c0*W10, np.zeros(dim-1))
-            Qb = np.dot(Q, b)
+            # solve instead of forming the inverse of W
+            Qb = np.dot(Q, b) if Q is not None else la.solve(W, b)
 
     if bc == 'reflective':
         return np.dot(la.matrix_power(T, t), cc)
     elif bc == 'open1side':
-        return np.dot(la.matrix_power(T, t), cc) + np.dot(
-            la.matrix_power(T, t) - np.eye(dim), Qb)
+        # T^t*cc + (T^t - 1)*Qb, without building T^t - 1
+        return np.dot(la.matrix_power(T, t), cc + Qb) - Qb
+
+
+def flush_subnormal(T):
+    '''
+    Set entries of a single precision matrix below sqrt(tiny) to zero.
+
+    Products of the remaining entries cannot become subnormal, which would
+    slow down the BLAS kernels by up to an order of magnitude. The dropped
+    entries are far below the rounding error of single precision.
+    '''
+    if T.dtype == np.float64:
+        return T
+    return np.where(np.abs(T) < np.sqrt(np.finfo(T.dtype).tiny), 0, T).astype(T.dtype)
+
+
+def matrix_power(T, t):
+    '''
+    T^t by repeated squaring, as numpy.linalg.matrix_power, but flushing
+    tiny entries after every product in single precision.
+    '''
+    if T.dtype == np.float64:
+        return la.matrix_power(T, t)
+    result, square = None, flush_subnormal(T)
+    while t > 0:
+        if t & 1:
+            result = square if result is None else flush_subnormal(np.dot(result, square))
+        t >>= 1
+        if t > 0:
+            square = flush_subnormal(np.dot(square, square))
+    return np.eye(T.shape[0], dtype=T.dtype) if result is None else result
+
+
+def calcC_series(cc, tt, W=None, T=None, bc='reflective', W10=None, c0=None):
+    '''
+    Calculates concentration profiles for all times tt from one W or T matrix.
+
+    exp(W) is computed once and profiles are stepped from one time to the
+    next, for open boundaries the steady state offset Qb = W^-1 b is
+    obtained from one LU factorization and reused for all times.
+    Only integer times are allowed, as in calcC.
+    returns list of profiles in the order of tt
+    '''
+    if T is None:
+        if W is None:
+            print('Error: Either W or T Matrix must be given for computation!')
+            sys.exit()
+        T = al.expm(W)  # exponential of W
+    dim = T[0, :].size
+
+    if bc == 'reflective':
+        Qb = np.zeros(dim)
+    elif bc == 'open1side':
+        if (W is None) or (W10 is None) or (c0 is None):
+            print('Error: W, W10 and c0 must be specified for open boundaries!')
+            sys.exit()
+        b = np.append(c0*W10, np.zeros(dim-1))
+        Qb = al.lu_solve(al.lu_factor(W), b)  # one factorized solve
+    else:
+        print('Error: Invalid boundary conditions!')
+        sys.exit()
+
+    # c(t) + Qb = T^t (c(0) + Qb), step through sorted times
+    order = np.argsort(tt, kind='stable')
+    powers = {}  # T^dt for each occuring time difference
+    y, t_prev = cc + Qb, 0
+    profiles = [None]*len(tt)
+    for i in order:
+        step = int(tt[i] - t_prev)
+        if step > 0:
+            if step not in powers:
+                powers[step] = matrix_power(T, step)
+            y = np.dot(powers[step], y)
+        profiles[i] = y - Qb
+        t_prev = tt[i]
+    return profiles
+
+
+def WMatrixVar_batch(d, f, start, deltaXX):
+    '''
+    Vectorized WMatrixVar (end=None) for many D, F profiles at once.
+    d, f - arrays of shape (n_sets, bins)
+    returns main, upper and lower diagonal, each of shape (n_sets, bins),
+    upper[:, i] = W[i, i+1] and lower[:, i] = W[i, i-1], so that
+    W = diag(main) + diag(upper[:-1], 1) + diag(lower[1:], -1) as in WMatrixVar
+    '''
+    d, f = np.atleast_2d(d), np.atleast_2d(f)
+    n = d.shape[1]
+    dx = np.asarray(deltaXX, dtype=float)
+
+    # segment1 with variable binning in areas of const. D, F
+    i = np.arange(start)
+    up1 = 2*d[:, i]/(dx[i+1]*(dx[i+1]+dx[i]))
+    down1 = 2*d[:, i]/(dx[i]*(dx[i+1]+dx[i]))
+    main1 = -2*d[:, i]/(dx[i+1]*dx[i])
+    main1[:, 0] = -down1[:, 1]
+
+    # segment2 with constant deltaX, d and f extended by last value
+    de = np.concatenate((d, d[:, -1:]), axis=1)
+    fe = np.concatenate((f, f[:, -1:]), axis=1)
+    i = np.arange(start, n)
+    up2 = (de[:, i]+de[:, i+1])/(2*dx[i]**2) * np.exp(-(fe[:, i]-fe[:, i+1])/2)
+    down2 = (de[:, i]+de[:, i-1])/(2*dx[i]**2) * np.exp(-(fe[:, i]-fe[:, i-1])/2)
+    main2 = (-(de[:, i-1]+de[:, i])/(2*dx[i]**2) * np.exp(-(fe[:, i-1]-fe[:, i])/2) -
+             (de[:, i+1]+de[:, i])/(2*dx[i]**2) * np.exp(-(fe[:, i+1]-fe[:, i])/2))
+    main2[:, -1] = -up2[:, -2]  # reflective BC
+
+    return (np.concatenate((main1, main2), axis=1), np.concatenate((up1, up2), axis=1),
+            np.concatenate((down1, down2), axis=1))
+
+
+def tridiag_dense(main, upper, lower):
+    '''Build (batched) dense W matrices from diagonals of WMatrixVar_batch.'''
+    n = main.shape[-1]
+    W = np.zeros(main.shape[:-1] + (n, n), dtype=main.dtype)
+    idx = np.arange(n)
+    W[..., idx, idx] = main
+    W[..., idx[:-1], idx[1:]] = upper[..., :-1]
+    W[..., idx[1:], idx[:-1]] = lower[..., 1:]
+    return W
+
+
+def tridiag_matvec(main, upper, lower, y):
+    '''W y for W given by its diagonals in the layout of WMatrixVar_batch.'''
+    Wy = main*y
+    Wy[:-1] += upper[:-1]*y[1:]
+    Wy[1:] += lower[1:]*y[:-1]
+    return Wy
+
+
+def tridiag_lu(main, upper, lower):
+    '''
+    Banded LU factorization (LAPACK gttrf) of a tridiagonal matrix given by
+    its diagonals in the layout of WMatrixVar_batch, O(n).
+    returns factors for tridiag_solve
+    '''
+    dl, d, du, du2, ipiv, info = al.lapack.dgttrf(lower[1:], main, upper[:-1])
+    if info != 0:
+        print('Error: Tridiagonal matrix is singular, LU factorization failed!')
+        sys.exit()
+    return dl, d, du, du2, ipiv
+
+
+def tridiag_solve(lu, b):
+    '''Solve with factors of tridiag_lu, O(n).'''
+    x, info = al.lapack.dgttrs(*lu, b)
+    return x
+
+
+def calcC_trbdf2(cc, tt, main, upper, lower, step=1, Qb=None):
+    '''
+    Concentration profiles at times tt by TR-BDF2 time stepping.
+
+    L-stable implicit one step scheme, trapezoidal rule up to t+gamma*step,
+    then BDF2 to t+step. With gamma = 2-sqrt(2) both stages solve with
+    I - gamma*step/2*W, which is factorized once and reused for all steps,
+    so every step is O(n). Time differences must be multiples of step.
+    W is given by its diagonals in the layout of WMatrixVar_batch.
+    Qb  -   steady state offset W^-1 b for open boundaries, see calcC_series
+    returns list of profiles in the order of tt
+    '''
+    gamma = 2 - np.sqrt(2)
+    a = gamma*step/2
+    lu = tridiag_lu(1 - a*main, -a*upper, -a*lower)
+    w_gamma = 1/(gamma*(2-gamma))  # BDF2 weights of stage and previous step
+    w_prev = (1-gamma)**2/(gamma*(2-gamma))
+
+    # c(t) + Qb follows the homogeneous equation, as in calcC_series
+    Qb = np.zeros(main.size) if Qb is None else Qb
+    order = np.argsort(tt, kind='stable')
+    y, t_prev = cc + Qb, 0
+    profiles = [None]*len(tt)
+    for i in order:
+        n_steps = (tt[i] - t_prev)/step
+        if abs(n_steps - round(n_steps)) > 1e-9*max(1, n_steps):
+            print('Error: Time differences must be multiples of the time step!')
+            sys.exit()
+        for _ in range(int(round(n_steps))):
+            y_gamma = tridiag_solve(lu, y + a*tridiag_matvec(main, upper, lower, y))
+            y = tridiag_solve(lu, w_gamma*y_gamma - w_prev*y)
+        profiles[i] = y - Qb
+        t_prev = tt[i]
+    return profiles
+
+
+def calcC_exact(cc, tt, main, upper, lower, Qb=None):
+    '''
+    exp(W t) from the eigendecomposition of the symmetrized tridiagonal W
+    (see eigW_batch), O(n^2). Loses accuracy, and mass, if the rates span
+    many orders of magnitude, the dense calcC is the reference then.
+    '''
+    off, s = symmetrize(main, upper, lower)
+    lam, V = al.eigh_tridiagonal(main, off)
+    Qb = np.zeros(main.size) if Qb is None else Qb
+    coeff = V.T @ ((cc + Qb)/s)
+    return [s*(V @ (coeff*np.exp(lam*t))) - Qb for t in tt]
+
+
+def tridiag_diagonals(W):
+    '''Diagonals of a dense rate matrix in the layout of WMatrixVar_batch.'''
+    main = np.diagonal(W, axis1=-2, axis2=-1)
+    upper = np.diagonal(W, 1, axis1=-2, axis2=-1)
+    lower = np.diagonal(W, -1, axis1=-2, axis2=-1)
+    pad = np.zeros(main.shape[:-1] + (1,), dtype=W.dtype)
+    return main, np.concatenate((upper, pad), axis=-1), np.concatenate((pad, lower), axis=-1)
+
+
+def check_invariants(main, upper, lower, f, dxx_width):
+    '''
+    Relative violation of the invariants of a (batched) tridiagonal W, O(n).
+
+    mass    -   weighted column sums dxx_width^T W vanish, i.e. the amount
+                sum(c*dxx_width) is conserved for every t
+    null    -   exp(-F) is the null vector of W (zero eigenvalue, equilibrium)
+    balance -   detailed balance of the amount fluxes between neighbours,
+                dxx_width[i+1]*W[i+1,i]*p[i] = dxx_width[i]*W[i,i+1]*p[i+1]
+    Diagonals as returned by WMatrixVar_batch, f of shape (..., bins).
+    returns dict with the maximal relative violation for each invariant
+    '''
+    w = np.asarray(dxx_width, dtype=float)
+    f = np.asarray(f, dtype=float)
+    p = np.exp(-(f - np.min(f, axis=-1, keepdims=True)))  # avoid overflow
+    scale = np.abs(main)
+    tiny = np.finfo(float).tiny
+
+    # column j holds W[j-1, j], W[j, j] and W[j+1, j]
+    flow_in = w[:-1]*upper[..., :-1]  # from bin j+1 into bin j
+    flow_out = w[1:]*lower[..., 1:]  # from bin j into bin j+1
+    col = w*main
+    col[..., 1:] += flow_in
+    col[..., :-1] += flow_out
+    mass = np.abs(col) / np.maximum(w*scale, tiny)
+
+    row = main*p
+    row[..., 1:] += lower[..., 1:]*p[..., :-1]
+    row[..., :-1] += upper[..., :-1]*p[..., 1:]
+    null = np.abs(row) / np.maximum(scale*p, tiny)
+
+    forward = flow_out*p[..., :-1]
+    backward = flow_in*p[..., 1:]
+    balance = np.abs(forward - backward) / np.maximum(np.abs(forward) + np.abs(backward), tiny)
+
+    return {'mass': np.max(mass, axis=-1), 'null': np.max(null, axis=-1),
+            'balance': np.max(balance, axis=-1)}
+
+
+def symmetrize(main, upper, lower):
+    '''
+    Off-diagonal of S = diag(s)^-1 W diag(s) and similarity transform s,
+    for one or stacked tridiagonal rate matrices in detailed balance.
+    '''
+    tiny = np.finfo(main.dtype).tiny
+    up, down = np.maximum(upper[..., :-1], tiny), np.maximum(lower[..., 1:], tiny)
+    # s_i+1/s_i = sqrt(W[i+1, i]/W[i, i+1]), computed in logs to avoid overflow
+    log_s = np.concatenate((np.zeros(main.shape[:-1] + (1,), dtype=main.dtype),
+                            np.cumsum(0.5*(np.log(down) - np.log(up)), axis=-1)), axis=-1)
+    s = np.exp(log_s - np.max(log_s, axis=-1, keepdims=True))
+    return np.sqrt(up*down), s
+
+
+def eigW_batch(main, upper, lower):
+    '''
+    Stacked eigendecompositions of tridiagonal rate matrices.
+
+    W is similar to a symmetric matrix S = diag(s)^-1 W diag(s) (detailed
+    balance), so the symmetric solver eigh can be used for all sets at once.
+    returns eigenvalues, eigenvectors of S and the similarity transform s
+    '''
+    off, s = symmetrize(main, upper, lower)
+    n = main.shape[-1]
+    S = np.zeros(main.shape[:-1] + (n, n), dtype=main.dtype)
+    idx = np.arange(n)
+    S[..., idx, idx] = main
+    S[..., idx[:-1], idx[1:]] = off
+    S[..., idx[1:], idx[:-1]] = off
+    lam, V = la.eigh(S)
+    return lam, V, s
+
+
+def calcC_batch(cc, tt, main, upper, lower):
+    '''
+    Concentration profiles at times tt for many rate matrices at once.
+
+    Equivalent to calcC with reflective BCs, exp(W*t) = T^t, but all sets
+    share one batched eigendecomposition and all times are evaluated together.
+    cc  -   initial profile, shape (bins)
+    tt  -   times, shape (n_times)
+    returns profiles of shape (n_sets, bins, n_times)
+    '''
+    lam, V, s = eigW_batch(main, upper, lower)
+    coeff = np.einsum('...ji,...j->...i', V, cc/s)  # V^T diag(s)^-1 c0
+    decay = np.exp(lam[..., :, np.newaxis]*np.asarray(tt, dtype=main.dtype))
+    return s[..., :, np.newaxis] * np.matmul(V, coeff[..., :, np.newaxis]*decay)
+
+
+def calcC_adjoint(cc, tt, lam, V, s, adj):
+    '''
+    Gradient of a loss with respect to W by the adjoint of the propagator.
+
+    With W = X diag(lam) X^-1, X = diag(s) V (see eigW_batch) the derivative
+    of exp(W t) is X ((X^-1 dW X) o Phi(t)) X^-1, Phi_ij the divided
+    differences of exp(lam t). Adjoint profiles are mapped back once with X^T
+    and the loss gradient is accumulated in the eigenbasis.
+    cc      -   initial profile c(t=0)
+    tt      -   times of profiles
+    adj     -   dL/dc(t) for each time, shape (n_times, bins)
+    returns dL/dW, shape (bins, bins)
+    '''
+    a = V.T @ (cc/s)  # X^-1 c0
+    b = (adj*s) @ V  # X^T dL/dc for all times
+    diff = lam[:, np.newaxis] - lam[np.newaxis, :]
+    close = np.abs(diff) < 1e-10*np.maximum(1, np.abs(lam[:, np.newaxis]))
+    G = np.zeros_like(diff)
+    for t, b_t in zip(tt, b):
+        e = np.exp(lam*t)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Phi = np.where(close, t*0.5*(e[:, np.newaxis] + e[np.newaxis, :]),
+                           (e[:, np.newaxis] - e[np.newaxis, :])/diff)
+        G += b_t[:, np.newaxis]*Phi
+    G *= a[np.newaxis, :]
+    return (V @ G @ V.T) / s[:, np.newaxis] * s[np.newaxis, :]
+
+
+def WMatrixVar_grad(d, f, start, deltaXX, grad_W, h=1e-20):
+    '''
+    Chain rule from dL/dW to dL/dd and dL/df for WMatrixVar_batch, O(n).
+
+    Derivatives of the diagonals are exact to machine precision by complex
+    step. Row i of W depends only on bins i-1, i and i+1, so all bins of the
+    same index modulo 3 are perturbed together, 6 batched assemblies in total.
+    grad_W  -   dL/dW, shape (bins, bins)
+    '''
+    n = d.size
+    idx = np.arange(n)
+    g_main = grad_W[idx, idx]
+    g_up = np.append(grad_W[idx[:-1], idx[1:]], 0)
+    g_low = np.append(0, grad_W[idx[1:], idx[:-1]])
+    # one perturbed set per colour, first the 3 colours of d then of f
+    pert = 1j*h*(idx[np.newaxis, :] % 3 == np.arange(3)[:, np.newaxis])
+    d_batch = np.concatenate((d + pert, np.tile(d, (3, 1)).astype(complex)))
+    f_batch = np.concatenate((np.tile(f, (3, 1)).astype(complex), f + pert))
+    main, up, low = WMatrixVar_batch(d_batch, f_batch, start, deltaXX)
+    rows = (np.imag(main)*g_main + np.imag(up)*g_up + np.imag(low)*g_low)/h
+    # bin j collects rows j-1, j and j+1 of the set of its colour
+    rows = np.pad(rows, ((0, 0), (1, 1)))
+    window = rows[:, :-2] + rows[:, 1:-1] + rows[:, 2:]
+    return window[idx % 3, idx], window[3 + idx % 3, idx]
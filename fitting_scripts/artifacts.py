@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Content-hash keyed cache for artifacts of the analysis stage.
+
+Every artifact has a key computed from its inputs (run store version, data,
+crit_err, alpha, ...). Intermediate arrays are kept as .npz files, for
+written reports only the key is remembered in a manifest. An artifact is
+recomputed only if its key changed or its files are missing.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+
+MANIFEST = 'artifacts.json'
+
+
+def content_hash(*items):
+    """Hash of arrays, numbers and strings, used as artifact key."""
+    sha = hashlib.sha1()
+    for item in items:
+        if isinstance(item, np.ndarray) or isinstance(item, (list, tuple)):
+            array = np.ascontiguousarray(item)
+            sha.update(str((array.dtype, array.shape)).encode())
+            sha.update(array.tobytes())
+        else:
+            sha.update(repr(item).encode())
+        sha.update(b'|')
+    return sha.hexdigest()[:16]
+
+
+def store_version(result):
+    """Version of an .h5 run store: file, size, modification time and runs."""
+    path = os.path.abspath(result.filename)
+    stat = os.stat(path)
+    return content_hash(path, stat.st_size, stat.st_mtime_ns, result.root._v_nchildren)
+
+
+class ArtifactCache:
+    """
+    Artifacts of one analysis folder.
+
+    savePath    -   analysis folder, cache lives in savePath/.cache
+    fresh       -   ignore all cached artifacts, everything is recomputed
+    """
+
+    def __init__(self, savePath, fresh=False):
+        self.path = os.path.join(savePath, '.cache')
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.fresh = fresh
+        self.manifest_path = os.path.join(self.path, MANIFEST)
+        self.manifest = {}
+        if os.path.exists(self.manifest_path) and not fresh:
+            with open(self.manifest_path, 'r') as file:
+                self.manifest = json.load(file)
+        self.computed, self.reused = [], []
+
+    def get(self, name, key, compute):
+        """Arrays of artifact name for key, compute() returns a dict of arrays."""
+        path = os.path.join(self.path, '%s-%s.npz' % (name, key))
+        if os.path.exists(path) and not self.fresh:
+            self.reused.append(name)
+            with np.load(path) as data:
+                return {k: data[k] for k in data.files}
+        arrays = compute()
+        np.savez(path, **arrays)
+        self.remove_old(name, keep=path)
+        self.computed.append(name)
+        return arrays
+
+    def remove_old(self, name, keep):
+        """Only the latest version of an intermediate artifact is kept."""
+        for file in os.listdir(self.path):
+            full = os.path.join(self.path, file)
+            if file.startswith(name + '-') and full != keep:
+                os.remove(full)
+
+    def stale(self, name, key, files=()):
+        """True if report name has to be written again."""
+        if self.fresh or self.manifest.get(name) != key:
+            return True
+        return not all(os.path.exists(file) for file in files)
+
+    def mark(self, name, key):
+        """Remember that report name is up to date for key."""
+        self.manifest[name] = key
+        with open(self.manifest_path, 'w') as file:
+            json.dump(self.manifest, file, indent=2)
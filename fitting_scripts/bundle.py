@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Binary export of analysis results, one bundle per data set.
+
+results.npz holds all numerical outputs of the analysis, manifest.json their
+shapes, units and the analysis parameters. Bundles of many data sets are
+appended into one campaign table, so aggregation over thousands of fits reads
+a single file instead of parsing text. txt and xlsx reports are renderings of
+the bundle.
+
+    DF_fitting_campaign campaign.h5 fit1/results fit2/results ...
+"""
+import os
+import sys
+import json
+import time
+import argparse as ap
+import numpy as np
+import fitting_scripts.inputOutput as io
+
+pd = io.lazy_import('pandas')
+
+BUNDLE = 'results.npz'
+MANIFEST = 'manifest.json'
+VERSION = 1
+PARAMETERS = ['D_sol', 'D_gel', 'F_sol', 'F_gel', 't_sig', 'd_sig']
+# string column widths of the campaign tables
+ITEMSIZE = {'summary': {'dataset': 256, 'data_hash': 32, 'created': 32, 'bc': 16},
+            'profiles': {'dataset': 256}}
+# unit and description of every array in the bundle
+FIELDS = {
+    'xx': ('micro_m', 'positions of the measured bins'),
+    'dxx_width': ('micro_m', 'bin widths of the full grid, six bulk bins first'),
+    'tt': ('s', 'times of the measured profiles'),
+    'tt_ext': ('s', 'times of the numerical profiles, extended to the long time limit'),
+    'c0': ('a.u.', 'initial profile on the full grid'),
+    'cc_scaled_best': ('a.u.', 'measured profiles scaled with best scalings, bins x times'),
+    'cc_scaled_avg': ('a.u.', 'measured profiles scaled with averaged scalings, bins x times'),
+    'cc_theo_best': ('a.u.', 'numerical profiles for best parameters, full grid x tt_ext'),
+    'cc_theo_avg': ('a.u.', 'numerical profiles for averaged parameters, full grid x tt_ext'),
+    'D_best': ('micro_m^2/s', 'diffusivity profile of the best run'),
+    'F_best': ('k_BT', 'free energy profile of the best run, relative to bulk'),
+    'D_avg': ('micro_m^2/s', 'averaged diffusivity profile'),
+    'D_std': ('micro_m^2/s', 'standart deviation of the diffusivity profile'),
+    'F_avg': ('k_BT', 'averaged free energy profile, relative to bulk'),
+    'F_std': ('k_BT', 'standart deviation of the free energy profile'),
+    'x_best': ('mixed', 'parameters %s and scalings of the best run' % ', '.join(PARAMETERS)),
+    'x_avg': ('mixed', 'averaged parameters and scalings'),
+    'x_std': ('mixed', 'standart deviation of parameters and scalings'),
+    'errors': ('a.u.', 'errors of the averaged runs, ascending'),
+    'error_avg': ('a.u.', 'error of the profiles for averaged parameters'),
+    'error_sol': ('a.u.', '||A*x - y|| of the best run'),
+    'error_reg': ('mixed', '||x - x_ref|| of the best run'),
+    'scalings_best': ('1', 'scaling coefficients of the best run'),
+    'scalings_avg': ('1', 'averaged scaling coefficients'),
+    'scalings_std': ('1', 'standart deviation of the scaling coefficients'),
+    'c_bulk_best': ('a.u.', 'bulk concentration of the best run'),
+    'c_bulk_avg': ('a.u.', 'averaged bulk concentration'),
+    'c_bulk_std': ('a.u.', 'standart deviation of the bulk concentration'),
+}
+
+
+def write_bundle(arrays, info, savePath):
+    """
+    Save arrays of one analysis as compressed .npz with JSON manifest.
+
+    arrays  -   dict of the arrays in FIELDS
+    info    -   analysis parameters (runs, crit_err, alpha, bc, ...), JSON types
+    returns manifest
+    """
+    np.savez_compressed(os.path.join(savePath, BUNDLE), **arrays)
+    manifest = {'version': VERSION, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'parameters': info,
+                'arrays': {name: {'shape': list(np.shape(value)),
+                                  'dtype': str(np.asarray(value).dtype),
+                                  'unit': FIELDS.get(name, ('', ''))[0],
+                                  'description': FIELDS.get(name, ('', ''))[1]}
+                           for name, value in arrays.items()}}
+    with open(os.path.join(savePath, MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def read_bundle(savePath):
+    """Arrays and manifest of the bundle in savePath."""
+    with np.load(os.path.join(savePath, BUNDLE)) as data:
+        arrays = {name: data[name] for name in data.files}
+    with open(os.path.join(savePath, MANIFEST), 'r') as file:
+        manifest = json.load(file)
+    return arrays, manifest
+
+
+def campaign_rows(arrays, manifest, dataset):
+    """One summary row and the profile rows of a bundle, as DataFrames."""
+    info = manifest['parameters']
+    summary = {'dataset': dataset, 'data_hash': info.get('data_hash', ''),
+               'created': manifest['created'], 'runs': info.get('runs', 0),
+               'averaged_runs': arrays['errors'].size, 'crit_err': info.get('crit_err', np.nan),
+               'alpha': info.get('alpha', np.nan), 'bc': info.get('bc', ''),
+               'error_best': np.min(arrays['errors']), 'error_avg': float(arrays['error_avg'])}
+    for i, name in enumerate(PARAMETERS):
+        for stat in ('best', 'avg', 'std'):
+            summary['%s_%s' % (name, stat)] = arrays['x_%s' % stat][i]
+    bins = arrays['D_avg'].size
+    profiles = {'dataset': np.repeat(dataset, bins), 'bin': np.arange(bins)}
+    for name in ('D_best', 'F_best', 'D_avg', 'D_std', 'F_avg', 'F_std'):
+        profiles[name] = arrays[name]
+    return pd.DataFrame([summary]), pd.DataFrame(profiles)
+
+
+def append_campaign(path, savePath, dataset=None):
+    """
+    Append the bundle in savePath to the campaign table in path.
+
+    The table holds one row per data set in 'summary' and the D, F profiles
+    of all data sets in long form in 'profiles'. Rows of a data set that was
+    appended before are replaced.
+    dataset -   name of the data set, standart: as in the manifest
+    """
+    arrays, manifest = read_bundle(savePath)
+    if dataset is None:
+        dataset = manifest['parameters'].get('dataset', os.path.abspath(savePath))
+    summary, profiles = campaign_rows(arrays, manifest, dataset)
+    dataset_value = dataset  # passed as query variable, paths may contain quotes
+    with pd.HDFStore(path, complevel=9) as campaign:
+        for key, table in (('summary', summary), ('profiles', profiles)):
+            if key in campaign:
+                campaign.remove(key, where='dataset == dataset_value')
+            campaign.append(key, table, format='table', data_columns=['dataset'],
+                            min_itemsize=ITEMSIZE[key], index=False)
+    return dataset
+
+
+def main():
+    """Append existing bundles to a campaign table, or render their reports."""
+    parser = ap.ArgumentParser(description=(
+        """
+        Append the result bundles of analyzed fits to a campaign-wide table,
+        optionally render txt and xlsx reports from the bundles.
+        """), formatter_class=ap.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('campaign', type=str, help='Campaign table (.h5).')
+    parser.add_argument('folders', type=str, nargs='+',
+                        help='Results folders containing %s and %s.' % (BUNDLE, MANIFEST))
+    parser.add_argument('-render', dest='render', type=str, nargs='+', default=[],
+                        choices=['txt', 'xlsx'], help='Reports rendered from the bundles.')
+    args = parser.parse_args()
+    import fitting_scripts.DF_fitting as df
+    for folder in args.folders:
+        savePath = os.path.join(folder, '')
+        if not os.path.exists(os.path.join(savePath, BUNDLE)):
+            print('Error: No result bundle in %s, analyze with -reports bundle first.' % folder)
+            sys.exit()
+        dataset = append_campaign(args.campaign, savePath)
+        df.render_reports(savePath, args.render)
+        print('Appended %s to %s.' % (dataset, args.campaign))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""Split cores between worker processes and BLAS threads per process."""
+import os
+import sys
+import json
+import time
+import contextlib
+import argparse as ap
+import concurrent.futures as cf
+import numpy as np
+import scipy.linalg as al
+import numpy.linalg as la
+try:  # optional, limits BLAS threads of already loaded libraries
+    import threadpoolctl
+except ImportError:
+    threadpoolctl = None
+
+# environment variables read by BLAS libraries when they are loaded
+BLAS_ENV = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+            'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS']
+POLICY_FILE = os.path.join(os.path.expanduser('~'), '.DF_fitting_policy.json')
+_limits = None  # keeps threadpoolctl limits alive in worker processes
+
+
+def available_cores():
+    """Number of cores usable by this process."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def blas_threads_for(bins, cores=None):
+    """
+    Heuristic number of BLAS threads worth spending on one fit.
+
+    Dense n x n operations on grids below ~150 bins do not profit from
+    threading, above that threads are doubled for every doubling of bins.
+    """
+    cores = available_cores() if cores is None else cores
+    threads = 2**int(np.floor(np.log2(max(bins/150, 1))))
+    return int(min(max(threads, 1), cores))
+
+
+def load_policy(path=POLICY_FILE):
+    """Load calibrated splits, returns dict {bins: (workers, threads)}."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as file:
+        policy = json.load(file)
+    if policy.get('cores') != available_cores():
+        return {}  # calibrated on different machine or affinity
+    return {int(bins): tuple(split) for bins, split in policy['splits'].items()}
+
+
+def split_cores(bins, n_tasks=None, workers=None, cores=None, policy=None):
+    """
+    Decide number of worker processes and BLAS threads per worker.
+
+    bins        -   size of rate matrix, determines cost of dense algebra
+    n_tasks     -   number of independent tasks, no more workers are started
+    workers     -   fixed number of workers, only threads are chosen then
+    policy      -   calibrated splits, standart: read from POLICY_FILE
+    returns (workers, threads) with workers*threads <= cores
+    """
+    cores = available_cores() if cores is None else cores
+    if workers is not None:
+        return workers, max(1, cores // workers)
+    policy = load_policy() if policy is None else policy
+    if policy:  # use calibration for closest grid size
+        closest = min(policy, key=lambda b: abs(np.log(b) - np.log(bins)))
+        threads = policy[closest][1]
+    else:
+        threads = blas_threads_for(bins, cores)
+    workers = max(1, cores // threads)
+    if n_tasks is not None and n_tasks < workers:
+        # spend idle cores on BLAS threads of remaining workers
+        workers = max(1, n_tasks)
+        threads = max(1, cores // workers)
+    return workers, threads
+
+
+def limit_blas_threads(threads):
+    """Limit BLAS threads of this process and of processes started from it."""
+    global _limits
+    for key in BLAS_ENV:
+        os.environ[key] = str(threads)
+    if threadpoolctl is not None:
+        _limits = threadpoolctl.threadpool_limits(limits=threads, user_api='blas')
+    return _limits
+
+
+def blas_limits(threads):
+    """Context manager limiting BLAS threads, e.g. around thread pools."""
+    if threadpoolctl is None or threads is None:
+        return contextlib.nullcontext()
+    return threadpoolctl.threadpool_limits(limits=threads, user_api='blas')
+
+
+def worker_initializer(threads):
+    """Enforce BLAS thread limit in every worker process."""
+    limit_blas_threads(threads)
+
+
+def process_pool(bins, n_tasks=None, workers=None):
+    """Process pool whose workers obey the core split for this grid size."""
+    workers, threads = split_cores(bins, n_tasks=n_tasks, workers=workers)
+    return cf.ProcessPoolExecutor(max_workers=workers, initializer=worker_initializer,
+                                  initargs=(threads,))
+
+
+def thread_pool(bins, n_tasks=None, workers=None):
+    """
+    Thread pool plus matching BLAS limit for the calling process.
+
+    returns executor and context manager, use both in a with statement
+    """
+    workers, threads = split_cores(bins, n_tasks=n_tasks, workers=workers)
+    return cf.ThreadPoolExecutor(max_workers=workers), blas_limits(threads)
+
+
+def _benchmark_task(bins, steps=20, seed=0):
+    """Typical propagation workload, expm and matrix powers of a rate matrix."""
+    rng = np.random.default_rng(seed)
+    off = rng.random(bins-1)
+    W = np.diag(off, 1) + np.diag(off, -1)
+    W -= np.diag(np.sum(W, 0))
+    T = al.expm(W)
+    c = np.ones(bins)
+    for t in range(1, steps):
+        c = np.dot(la.matrix_power(T, t), c)
+    return c[0]
+
+
+def measure_split(bins, workers, threads, tasks_per_worker=2):
+    """Throughput in tasks per second for one split."""
+    n_tasks = workers*tasks_per_worker
+    with cf.ProcessPoolExecutor(max_workers=workers, initializer=worker_initializer,
+                                initargs=(threads,)) as pool:
+        list(pool.map(_benchmark_task, [bins]*workers))  # warm up workers
+        start = time.time()
+        list(pool.map(_benchmark_task, [bins]*n_tasks))
+        return n_tasks/(time.time() - start)
+
+
+def calibrate(bins_list=(50, 200, 800), path=POLICY_FILE, verbose=True):
+    """Measure best split of cores for several grid sizes and store it."""
+    cores = available_cores()
+    threads_list = [2**i for i in range(int(np.log2(cores))+1)]
+    splits = {}
+    for bins in bins_list:
+        rates = {}
+        for threads in threads_list:
+            workers = max(1, cores // threads)
+            rates[(workers, threads)] = measure_split(bins, workers, threads)
+            if verbose:
+                print('bins = %i: %i workers x %i threads -> %.2f tasks/s'
+                      % (bins, workers, threads, rates[(workers, threads)]))
+        splits[str(bins)] = max(rates, key=rates.get)
+        if verbose:
+            print('Best split for %i bins: %i workers x %i threads\n'
+                  % ((bins,) + splits[str(bins)]))
+    with open(path, 'w') as file:
+        json.dump({'cores': cores, 'splits': splits}, file, indent=2)
+    return splits
+
+
+def main():
+    """Calibrate execution policy on this machine."""
+    parser = ap.ArgumentParser(description=(
+        """
+        Measure the best split between worker processes and BLAS threads
+        on this machine and store it for later fits.
+        """), formatter_class=ap.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-bins', dest='bins', type=int, nargs='+', default=[50, 200, 800],
+                        help='Grid sizes to calibrate.')
+    parser.add_argument('-o', dest='path', type=str, default=POLICY_FILE,
+                        help='File in which calibration is stored.')
+    args = parser.parse_args()
+    if threadpoolctl is None:
+        print('Warning: threadpoolctl is not installed, thread limits only act on '
+              'newly started processes.')
+    print('Calibrating on %i cores...\n' % available_cores())
+    calibrate(args.bins, path=args.path)
+    print('Stored execution policy in %s' % args.path)
+    sys.exit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+In-process fitting of D, F profiles from arrays.
+
+    fitter = Fitter(xx, cc, tt, varpro=True)
+    fitter.fit(n_starts=10)
+    summary = fitter.analyze()
+    profiles = fitter.predict([100, 1000])
+
+Discretization, zero profile and bounds are prepared once, numerical profiles
+and propagators are cached per parameter set. Nothing is read from stdin or
+written to disk, so one object can be used repeatedly, for several data sets
+(set_data) and from several threads.
+"""
+import threading
+import collections
+import numpy as np
+import scipy.linalg as al
+import fitting_scripts.FPModel as fp
+import fitting_scripts.DF_fitting as df
+import fitting_scripts.execution as ex
+
+
+class Fitter:
+    """
+    Multistart fit of sigmoidal D, F profiles to concentration profiles.
+
+    xx          -   distance vector of the profiles
+    cc          -   profiles of shape (bins, n_times), first column at t=0
+    tt          -   times of the columns of cc in seconds (integers)
+    alpha       -   Tykhonov regularization strength
+    varpro      -   eliminate scalings by variable projection
+    bc          -   'reflective' or 'open1side'
+    cache_size  -   number of profile sets kept for fit and of propagators for predict
+    """
+
+    def __init__(self, xx, cc, tt, alpha=0, varpro=True, bc='reflective', cache_size=32):
+        self.alpha = alpha
+        self.varpro = varpro
+        self.bc = bc
+        self.cache_size = cache_size
+        self.xx = None
+        self._lock = threading.Lock()
+        self._running = 0  # fit calls in progress
+        self.set_data(cc, tt, xx=xx)
+
+    def set_data(self, cc, tt, xx=None):
+        """
+        Switch to another data set, the discretization is kept for the same xx.
+
+        Not possible while fit is running in another thread.
+        """
+        xx = self.xx if xx is None else np.asarray(xx, dtype=float)
+        cc = np.asarray(cc, dtype=float)
+        with self._lock:
+            if self._running:
+                raise RuntimeError('Data cannot be changed while a fit is running.')
+            if self.xx is None or xx.size != self.xx.size or np.any(xx != self.xx):
+                self.dxx_dist, self.dxx_width = fp.discretization_Block(xx)
+            self.xx = xx
+            self.cc = fp.build_zero_profile(cc)
+            self.tt = np.asarray(tt)
+            self.n_profiles = cc.shape[1]-1
+            self.bnds, inits = df.initialize_optimization(1, 2, self.n_profiles, self.xx)
+            self._template = inits[0]
+            self.results = []
+            self._cache = df.ProfileCache(self.cache_size)
+            self._propagators = collections.OrderedDict()
+        return self
+
+    def _starts(self, n_starts, rng):
+        """Random start values in D as in initialize_optimization."""
+        inits = [self._template.copy() for _ in range(n_starts)]
+        for init in inits:
+            init[:2] = rng.random(2)*self.bnds[1][:2]
+        return inits
+
+    def _fit_one(self, init):
+        res = df.optimization(init, self.bnds, self.xx, self.cc, self.tt, self.dxx_dist,
+                              self.dxx_width, self.alpha, varpro=self.varpro, bc=self.bc,
+                              cache=self._cache)
+        with self._lock:
+            self.results.append(res)
+        return res
+
+    def fit(self, n_starts=10, seed=None, workers=None):
+        """
+        Run n_starts fits from random start values, results are accumulated.
+
+        workers -   fits run in a thread pool of this size, numpy and scipy
+                    release the GIL in the dense linear algebra
+        returns OptimizeResult with lowest cost of all runs so far
+        """
+        with self._lock:
+            self._running += 1
+        try:
+            inits = self._starts(n_starts, np.random.default_rng(seed))
+            if workers is not None and workers > 1:
+                executor, limits = ex.thread_pool(self.cc[0].size, n_tasks=n_starts,
+                                                  workers=workers)
+                with executor, limits:
+                    list(executor.map(self._fit_one, inits))
+            else:
+                for init in inits:
+                    self._fit_one(init)
+        finally:
+            with self._lock:
+                self._running -= 1
+        return self.best
+
+    @property
+    def best(self):
+        """Run with lowest cost."""
+        with self._lock:
+            if not self.results:
+                raise RuntimeError('No fits have been run yet, call fit first.')
+            return min(self.results, key=lambda res: res.cost)
+
+    def table(self):
+        """Costs and parameters of all runs, as df.run_table for .h5 storage."""
+        with self._lock:
+            return {'keys': np.array(['r%i' % (i+1) for i in range(len(self.results))]),
+                    'cost': np.array([res.cost for res in self.results]),
+                    'x': np.array([res.x for res in self.results])}
+
+    def analyze(self, crit_err=0.3):
+        """
+        Average runs within crit_err of the minimal error, as in the -ana analysis.
+
+        returns dict with best and averaged parameters, D, F profiles on the
+        full grid (F relative to bulk), their stdevs and the sorted errors
+        """
+        if not self.results:
+            raise RuntimeError('No fits have been run yet, call fit first.')
+        (best, means, stdevs, F_best, D_best, t_best, d_best, F_mean, D_mean, t_mean, d_mean,
+         F_std, D_std, errors) = df.average_data(None, self.xx, self.cc, crit_err,
+                                                 table=self.table())
+        return {'x_best': best, 'x_mean': means, 'x_std': stdevs,
+                'D_best': D_best, 'F_best': F_best-F_best[0],
+                'D_mean': D_mean, 'F_mean': F_mean-F_mean[0], 'D_std': D_std, 'F_std': F_std,
+                'scalings_best': best[6:], 'scalings_mean': means[6:],
+                'scalings_std': stdevs[6:], 'errors': errors}
+
+    def _propagator(self, parameters):
+        """Rate matrix and exp(W) for parameters, cached."""
+        key = np.asarray(parameters[:6], dtype=float).tobytes()
+        with self._lock:
+            if key in self._propagators:
+                self._propagators.move_to_end(key)
+                return self._propagators[key]
+        W, F = df.rate_matrix(parameters, self.xx, self.dxx_dist)
+        propagator = (W, al.expm(W) if self.bc == 'reflective' else None)
+        with self._lock:
+            self._propagators[key] = propagator
+            if len(self._propagators) > self.cache_size:
+                self._propagators.popitem(last=False)
+        return propagator
+
+    def predict(self, t, parameters=None):
+        """
+        Numerical profiles at integer times t (seconds after the t=0 profile).
+
+        parameters  -   physical parameters, standart: best fit
+        returns array of shape (bins incl. 6 bulk bins, len(t))
+        """
+        if parameters is None:
+            parameters = self.best.x
+        t = np.atleast_1d(t)
+        W, T = self._propagator(parameters)
+        if self.bc == 'reflective':
+            profiles = fp.calcC_series(self.cc[0], t, T=T)
+        else:
+            profiles = df.propagate(W, self.cc[0], t, bc=self.bc)
+        return np.array(profiles).T
@@ -1,12 +1,54 @@
 # -*- coding: utf-8 -*-
 import numpy as np
 import csv
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
-import scipy.interpolate as ip
-import scipy.signal as sg
 import argparse as ap
+import importlib
 import sys
+import os
+
+
+class LazyModule:
+    '''Module proxy, the module is imported on first attribute access.'''
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+def lazy_import(name):
+    '''Defer import of heavy optional modules (plotting, excel, hdf) until used.'''
+    return LazyModule(name)
+
+
+# smoothing of profiles and tape strips only, slow to import
+ip = lazy_import('scipy.interpolate')
+sg = lazy_import('scipy.signal')
+
+
+def headless():
+    '''True if no display is available, e.g. on cluster nodes.'''
+    if sys.platform.startswith('linux'):
+        return not (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+    return False
+
+
+def select_backend():
+    '''Use non-interactive Agg backend on headless nodes, unless MPLBACKEND is set.'''
+    import matplotlib
+    if headless() and 'MPLBACKEND' not in os.environ:
+        matplotlib.use('Agg')
+
+
+def pyplot():
+    '''Import pyplot on first use with a backend suitable for this node.'''
+    select_backend()
+    import matplotlib.pyplot as plt
+    return plt
 
 
 def startUp_slim():
@@ -18,8 +60,9 @@ def startUp_slim():
         on supplied normalized experimental concentration profiles.
         First column is always assumed to be z-distance vector!
         """), formatter_class=ap.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('-p', dest='path', type=str,
-                        help='Define the path to data for analysis')
+    parser.add_argument('-p', dest='path', type=str, nargs='+',
+                        help='Define the path to data for analysis, several paths '
+                        'are fitted jointly as replicates sharing D and F')
     parser.add_argument('-v', dest='verbosity', type=int, default=0, help='set '
                         'verbosity level ranging from 0 - no output to 2 - '
                         'full output')
@@ -27,20 +70,118 @@ def startUp_slim():
                         help='Do only plotting and analysis of previous run')
     parser.add_argument('-alpha', dest='alpha', type=float, default=0,
                         help='Factor for Tychonov regularization of diffusivities.')
+    parser.add_argument('-mmap', dest='mmap', action='store_true',
+                        help='Convert data once to a memory-mapped binary and read '
+                        'selected profiles lazily, for very long recordings.')
+    parser.add_argument('-bc', dest='bc', type=str, default='reflective',
+                        choices=['reflective', 'open1side'], help='Boundary conditions, '
+                        'open1side keeps the outermost bulk bin as reservoir at constant '
+                        'concentration.')
+    parser.add_argument('-budget', dest='budget', type=int, default=None,
+                        help='Keep only this number of time profiles, ranked by their '
+                        'information on the physical parameters from a pilot fit.')
+    parser.add_argument('-varpro', dest='varpro', action='store_true',
+                        help='Eliminate profile scalings by variable projection, '
+                        'only the physical parameters are fitted non-linearly.')
+    parser.add_argument('-alpha_sweep', dest='alpha_sweep', type=float, nargs=3,
+                        default=None, metavar=('MIN', 'MAX', 'N'),
+                        help='Compute warm-started regularization path for N log-spaced '
+                        'alphas between MIN and MAX, one chain per run.')
+    parser.add_argument('-perbin', dest='perbin', action='store_true',
+                        help='Fit free D and F in every bin with adjoint gradients and '
+                        'L-BFGS-B, -alpha sets the smoothness prior.')
+    parser.add_argument('-screen', dest='screen', type=int, default=None,
+                        help='Sample the cost this many times, fit a polynomial chaos '
+                        'surrogate and start the runs only from its minima.')
+    parser.add_argument('-continue', dest='cont', type=str, default=None, metavar='PATH',
+                        help='Start the runs around the best fit of a related data set, '
+                        'from its results.h5 or folder, instead of random starts.')
+    parser.add_argument('-global', dest='global_search', action='store_true',
+                        help='Every run is a vectorized differential evolution search, '
+                        'polished by the local fit, instead of a random local start.')
+    parser.add_argument('-jac_workers', dest='jac_workers', type=int, default=None,
+                        help='Evaluate finite difference Jacobians concurrently on this '
+                        'number of workers.')
+    parser.add_argument('-jac_pool', dest='jac_pool', type=str, default='thread',
+                        choices=['thread', 'process'], help='Pool type for parallel '
+                        'Jacobians.')
+    parser.add_argument('-jac_scheme', dest='jac_scheme', type=str, default='2-point',
+                        choices=['2-point', '3-point'], help='Finite difference scheme '
+                        'for parallel Jacobians.')
+    parser.add_argument('-precision', dest='precision', type=str, default='double',
+                        choices=['double', 'mixed'], help='Finite difference Jacobians in '
+                        'single precision in early iterations, double near convergence.')
+    parser.add_argument('-switch_tol', dest='switch_tol', type=float, default=1e-2,
+                        help='Relative cost change below which mixed precision switches '
+                        'to double.')
+    parser.add_argument('-engine', dest='engine', type=str, default='expm',
+                        choices=['expm', 'trbdf2'], help='Propagation by dense exp(W), or '
+                        'by implicit TR-BDF2 steps on the tridiagonal W for very fine grids.')
+    parser.add_argument('-engine_tol', dest='engine_tol', type=float, default=1e-4,
+                        help='Maximal deviation of TR-BDF2 profiles from the exact '
+                        'propagator, sets the time step.')
+    parser.add_argument('-cov', dest='cov', action='store_true',
+                        help='Estimate uncertainties from the Jacobian of the best run.')
+    parser.add_argument('-boot', dest='boot', type=int, default=0,
+                        help='Number of bootstrap replicates for uncertainty estimation, '
+                        'zero means no bootstrapping.')
+    parser.add_argument('-boot_mode', dest='boot_mode', type=str, default='blocks',
+                        choices=['blocks', 'profiles'], help='Resample residual blocks '
+                        'along z or whole time profiles.')
+    parser.add_argument('-workers', dest='workers', type=int, default=None,
+                        help='Number of worker processes, default follows execution policy.')
+    parser.add_argument('-threads', dest='threads', type=int, default=None,
+                        help='BLAS threads of the main process, default follows execution '
+                        'policy (see DF_fitting_calibrate).')
+    parser.add_argument('-stream', dest='stream', action='store_true',
+                        help='Fit while data is recorded, -p is a growing file or a '
+                        'directory of frame files, each new batch warm-starts the fit.')
+    parser.add_argument('-poll', dest='poll', type=float, default=5,
+                        help='Seconds between checks for new profiles in -stream mode.')
+    parser.add_argument('-stream_min', dest='stream_min', type=int, default=3,
+                        help='Profiles needed before the first fit in -stream mode.')
+    parser.add_argument('-stream_starts', dest='stream_starts', type=int, default=1,
+                        help='Random starts per batch in addition to the warm start.')
+    parser.add_argument('-stream_tol', dest='stream_tol', type=float, default=1e-3,
+                        help='Relative change of D, F, t, d between batches below which '
+                        'the parameters count as converged.')
+    parser.add_argument('-stream_idle', dest='stream_idle', type=float, default=600,
+                        help='Stop -stream mode after this many seconds without new profiles.')
+    parser.add_argument('-crit_err', dest='crit_err', type=float, default=0.3,
+                        help='Runs within this relative deviation from the minimal error '
+                        'are averaged in the analysis.')
+    parser.add_argument('-fresh', dest='fresh', action='store_true',
+                        help='Ignore cached analysis artifacts in results/.cache and '
+                        'recompute everything.')
+    parser.add_argument('-reports', dest='reports', type=str, nargs='+', default=['all'],
+                        choices=['all', 'numbers', 'bundle', 'txt', 'xlsx', 'figures', 'none'],
+                        help='Artifacts written by the analysis, e.g. numbers only for batch '
+                        'runs and figures later on demand with -ana -reports figures. '
+                        'bundle is the binary results.npz with manifest.json.')
+    parser.add_argument('-campaign', dest='campaign', type=str, default=None,
+                        help='Append the result bundle to this campaign-wide table (.h5).')
     args = parser.parse_args()
     ana = args.analysis
     verbosity = args.verbosity
     alpha = args.alpha
 
+    if args.stream:  # data is read while it is recorded
+        print('Set temporal resolution, supply dt in seconds:')
+        args.dt = int(sys.stdin.readline())
+        print('Set number of analysis runs for the first batch of profiles:')
+        Runs = int(sys.stdin.readline())
+        return (verbosity, Runs, ana, None, None, None, alpha, args)
+
     print('\nReading profiles...')
-    try:  # change seperator accordingly
-        data = readData(args.path, sep=';')
-    except ValueError:
-        try:
-            data = readData(args.path, sep=',')
-        except ValueError:
-            data = readData(args.path, sep=' ')
+    if args.mmap:  # only selected time profiles are loaded into memory
+        datas = [readMemmap(path) for path in args.path]
+    else:
+        datas = [readSeparated(path) for path in args.path]
+    data = datas[0]
     xx = data[:, 0]  # first column assumed to be distance vector
+    if any(d[:, 0].size != xx.size or np.any(d[:, 0] != xx) for d in datas[1:]):
+        print('Error: Replicates must share the same distance vector!')
+        sys.exit()
 
     # reading run parameters from stdin
     print('Set temporal resolution, supply dt in seconds:')
@@ -58,14 +199,154 @@ def startUp_slim():
     Runs = int(sys.stdin.readline())  # how many start D-values should be tried
 
     # now reading profiles based on input for different timepoints
-    if "all" in tt:
-        cc = np.array(data[:, 1:])
-        tt = np.arange(0, cc[0, :].size*dt, dt)
+    if len(datas) > 1:  # replicates are returned as lists
+        selected = [selectProfiles(d, dt, tt) for d in datas]
+        cc, tt = [c for c, t in selected], [t for c, t in selected]
     else:
-        cc = np.array([data[:, int(t/dt + 1)] for t in tt]).T
+        cc, tt = selectProfiles(data, dt, tt)
 
     print('\nStarting optimization...\n')
-    return (verbosity, Runs, ana, xx, cc, tt, alpha)
+    # remaining options are handed over as parsed
+    return (verbosity, Runs, ana, xx, cc, tt, alpha, args)
+
+
+def readSeparated(path):
+    """Read data file, trying the different column separators."""
+    try:  # change seperator accordingly
+        data = readData(path, sep=';')
+    except ValueError:
+        try:
+            data = readData(path, sep=',')
+        except ValueError:
+            data = readData(path, sep=' ')
+    return data
+
+
+def selectProfiles(data, dt, tt, chunk=256):
+    """
+    Select profiles at time points tt in seconds or 'all' from data.
+
+    data can also be a memory-mapped array, then only selected columns are read.
+    """
+    if "all" in tt:
+        columns = np.arange(1, data.shape[1])
+        tt = np.arange(0, columns.size*dt, dt)
+    else:
+        columns = np.array([int(t/dt + 1) for t in tt])
+    cc = readColumns(data, columns, chunk=chunk)
+    return cc, tt
+
+
+def iterColumns(data, columns, chunk=256):
+    """Lazily yield selected columns of data in chunks of shape (rows, chunk)."""
+    for i in range(0, len(columns), chunk):
+        yield np.asarray(data[:, columns[i:i+chunk]])
+
+
+def readColumns(data, columns, chunk=256):
+    """Gather selected columns of data, peak memory follows the selection."""
+    columns = np.asarray(columns, dtype=int)
+    cc = np.empty((data.shape[0], columns.size))
+    for i, block in enumerate(iterColumns(data, columns, chunk=chunk)):
+        cc[:, i*chunk:i*chunk+block.shape[1]] = block
+    return cc
+
+
+def detectSeparator(line, separators=(';', ',', ' ')):
+    """Return first separator splitting line into several numeric fields."""
+    for sep in separators:
+        fields = [f for f in line.strip().split(sep) if f != '']
+        if len(fields) > 1:
+            try:
+                [float(f) for f in fields]
+                return sep
+            except ValueError:
+                continue
+    return separators[-1]
+
+
+def readMemmap(path, comChar='#', cache=None):
+    """
+    Read data file as memory-mapped column-major binary.
+
+    The text file is converted once, row by row, into a .npy file in
+    Fortran order, so that every time profile (column) is contiguous on disk.
+    Later calls reuse the binary as long as it is newer than the text file.
+    cache   -   path of binary file, standart: path + '.npy'
+    """
+    if cache is None:
+        cache = path + '.npy'
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(path):
+        return np.load(cache, mmap_mode='r')
+
+    # first pass: index file, count rows and columns
+    rows, cols, sep = 0, 0, None
+    with open(path, 'r') as file:
+        for line in file:
+            if line.startswith(comChar) or not line.strip():
+                continue
+            if sep is None:
+                sep = detectSeparator(line)
+                cols = np.fromstring(line, sep=sep).size
+            rows += 1
+
+    # second pass: write rows into column-major memory map
+    data = np.lib.format.open_memmap(cache, mode='w+', dtype=float, shape=(rows, cols),
+                                     fortran_order=True)
+    row = 0
+    with open(path, 'r') as file:
+        for line in file:
+            if line.startswith(comChar) or not line.strip():
+                continue
+            data[row] = np.fromstring(line, sep=sep)
+            row += 1
+    data.flush()
+    del data
+    return np.load(cache, mmap_mode='r')
+
+
+def readFrames(path, frames):
+    """
+    Read frame files of a directory, one time profile per file.
+
+    Frames are sorted by file name (use zero-padded numbering) and hold
+    distance and concentration in two columns. Already read frames are
+    cached in the dict frames, reading stops at the first incomplete file.
+    returns data array as readSeparated or None if no frame is complete yet
+    """
+    xx = None
+    for name in sorted(os.listdir(path)):
+        if name.startswith('.') or name.endswith('.npy'):
+            continue
+        if name not in frames:
+            try:
+                frame = readSeparated(os.path.join(path, name))
+            except (ValueError, IndexError, OSError):
+                break  # frame is still being written
+            if frame.ndim != 2 or (xx is not None and frame[:, 0].size != xx.size):
+                break
+            frames[name] = frame
+        xx = frames[name][:, 0]
+    if not frames:
+        return None
+    names = sorted(frames)
+    return np.column_stack([frames[names[0]][:, 0]] + [frames[n][:, -1] for n in names])
+
+
+def readStream(path, frames=None):
+    """
+    Read the current state of a growing data file or frame directory.
+
+    returns data array as readSeparated or None if the data is not readable,
+    e.g. while the acquisition software rewrites the file
+    """
+    if os.path.isdir(path):
+        return readFrames(path, {} if frames is None else frames)
+    try:
+        data = readSeparated(path)
+    except (ValueError, IndexError, OSError):
+        return None
+    return data if data.ndim == 2 else None
 
 
 def startUp():
@@ -187,7 +468,8 @@ def startUp():
               ' data for %2.f minutes' % ((dt, (data[0, :].size-2)*dt/60)))
 
         # plotting profiles
-        colors = [cm.jet(x) for x in np.linspace(0, 1, tt.size)]  # creating colormap
+        plt = pyplot()
+        colors = [plt.cm.jet(x) for x in np.linspace(0, 1, tt.size)]  # creating colormap
         for c_exp, c_smooth, c in zip(cc_exp.T, cc.T, colors):
             plt.plot(xx_exp, c_exp, '--', c=c)
             plt.plot(xx, c_smooth, '-', c=c)
@@ -333,6 +615,7 @@ def plotCon(cc, xx=None, live=False):
     Plotting concentration profiles, live if wanted for i profiles cc[:,i]
     '''
 
+    plt = pyplot()
     # if no x vector is given just plot cc
     if xx is None:
         xx = np.array(range(cc[:, 0].size))
@@ -359,6 +642,21 @@ def plotCon(cc, xx=None, live=False):
             plt.show()
 
 
+# parameters A, l relating tapestrips to depth and thickness of SC in µm,
+# taken from Lademann papers
+SPECIES = {'human': (107, 21, 12.5),  # SC averaged over different body parts
+           'porcine': (104, 27, 21)}  # SC of porcine ear
+
+
+def stripDepth(nbrTapeStrips, A, l, SC):
+    '''
+    Skin depth after each tape strip from the heuristic formula by Lademann,
+    broadcasts over samples. Negative depths are set to zero, NOTE: this is
+    because of heuristic Lademann formula...
+    '''
+    return np.maximum(((A - 111*np.exp(-np.asarray(nbrTapeStrips, dtype=float)/l))/100)*SC, 0)
+
+
 def tapeStripping(concentration, nbrTapeStrips, xx=None, species='human',
                   smoothing=0.025, plot=False):
     '''
@@ -376,24 +674,16 @@ def tapeStripping(concentration, nbrTapeStrips, xx=None, species='human',
     plot          -     plot fitted profile
     '''
 
-    # settting correct parameters for different species, taken from Lademan papers
-    if species is 'human':
-        A, l = 107, 21  # parameters for function relating tapestrips to depth
-        SC = 12.5  # in µm, average thickness of SC of different body parts
-    elif species is 'porcine':
-        A, l = 104, 27  # function parameters
-        SC = 21  # thickness of SC in µm, for porcine ear
-    else:
+    # settting correct parameters for different species
+    if species not in SPECIES:
         print('\nUnknown species, choose either "human" or "porcine"\n\n')
         sys.exit()
+    A, l, SC = SPECIES[species]
 
     # differential concentration is what was in the tapestripped skin
-    diff = np.array([concentration[i] - concentration[i+1]
-                     for i in range(len(concentration)-1)])
+    diff = -np.diff(np.asarray(concentration, dtype=float))
     # skin depth for each tape strip
-    depth = ((A - 111*np.exp(-nbrTapeStrips[1:]/l))/100)*SC
-    # setting negative values to zero, NOTE: this is because of heuristic Lademann formula...
-    depth = np.array([0 if x < 0 else x for x in depth])
+    depth = stripDepth(np.asarray(nbrTapeStrips)[1:], A, l, SC)
 
     # if no x-vector is given, evaluate spline along entire tapestripping depth
     if xx is None:
@@ -401,6 +691,7 @@ def tapeStripping(concentration, nbrTapeStrips, xx=None, species='human',
     spline = ip.UnivariateSpline(depth, diff, s=smoothing)
 
     if plot:
+        plt = pyplot()
         x_plot = np.linspace(xx[0], xx[-1], 100)
         plt.figure()
         plt.plot(depth, diff, 'ko', label='ESR measurements')
@@ -413,3 +704,64 @@ def tapeStripping(concentration, nbrTapeStrips, xx=None, species='human',
         plt.close('all')
 
     return xx, spline(xx)
+
+
+def tapeStripping_batch(concentration, nbrTapeStrips, xx=None, species='human',
+                        smoothing=0.025, points=15):
+    '''
+    Concentration profiles of many tape strip series at once, as tapeStripping.
+
+    Depths and differential concentrations of all samples are computed as
+    arrays, one smoothing spline is fitted per sample and all are evaluated
+    on a common depth grid. A failing sample does not stop the batch, its
+    profile is NaN and the reason is reported.
+    concentration -     array (n_samples, n_strips), measured concentration
+                        after each tapestrip
+    nbrTapeStrips -     array (n_strips) shared by all samples or
+                        (n_samples, n_strips)
+    xx            -     common depth grid, standart: 'points' positions over
+                        the tapestripping depth of all samples
+    species       -     'human' or 'porcine', or a sequence with one per sample
+    smoothing     -     smoothing parameter of the splines, scalar or one per sample
+    returns xx, profiles of shape (n_samples, xx.size), NaN outside the depth
+    range of a sample, and errors, list with a message per sample, None if
+    the sample was converted
+    '''
+    concentration = np.atleast_2d(np.asarray(concentration, dtype=float))
+    n_samples = concentration.shape[0]
+    if np.shape(nbrTapeStrips)[-1] != concentration.shape[1]:
+        raise ValueError('nbrTapeStrips has %i entries per sample, concentration %i'
+                         % (np.shape(nbrTapeStrips)[-1], concentration.shape[1]))
+    strips = np.broadcast_to(np.asarray(nbrTapeStrips, dtype=float), concentration.shape)
+    species = np.broadcast_to(np.asarray(species, dtype=object), (n_samples,))
+    smoothing = np.broadcast_to(np.asarray(smoothing, dtype=float), (n_samples,))
+
+    errors = [None if s in SPECIES else 'Unknown species "%s", choose either "human" or '
+              '"porcine"' % s for s in species]
+    A, l, SC = np.array([SPECIES.get(s, (np.nan,)*3) for s in species]).T[:, :, np.newaxis]
+    # differential concentrations and depths of all samples
+    diff = -np.diff(concentration, axis=1)
+    depth = stripDepth(strips[:, 1:], A, l, SC)
+    finite = np.all(np.isfinite(diff), axis=1) & np.all(np.isfinite(strips), axis=1)
+    for i in np.flatnonzero(~finite):
+        errors[i] = errors[i] or 'Concentrations or tapestrip numbers are not finite'
+    if diff.shape[1] <= 3:  # cubic spline needs more than three points
+        errors = [error or 'Too few tapestrips, at least five are needed' for error in errors]
+
+    converted = np.array([error is None for error in errors], dtype=bool)
+    if xx is None:
+        if not np.any(converted):
+            return np.zeros(0), np.zeros((n_samples, 0)), errors
+        xx = np.linspace(np.min(depth[converted, 0]), np.max(depth[converted, -1]), points)
+    xx = np.asarray(xx, dtype=float)
+
+    profiles = np.full((n_samples, xx.size), np.nan)
+    for i in np.flatnonzero(converted):
+        try:
+            spline = ip.UnivariateSpline(depth[i], diff[i], s=smoothing[i])
+        except ValueError as err:  # e.g. depths not increasing
+            errors[i] = str(err)
+            continue
+        inside = (xx >= depth[i, 0]) & (xx <= depth[i, -1])
+        profiles[i, inside] = spline(xx[inside])
+    return xx, profiles, errors
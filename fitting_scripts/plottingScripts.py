@@ -1,3 +1,5 @@
+from fitting_scripts.inputOutput import select_backend
+select_backend()  # before pyplot is loaded
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 from matplotlib.ticker import FormatStrFormatter
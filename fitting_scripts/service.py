@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+"""
+Local fit-job service with a pool of warm worker processes.
+
+Jobs are posted as JSON to http://127.0.0.1:PORT/jobs, e.g.
+    {"path": "data.txt", "dt": 10, "timepoints": "all", "runs": 10,
+     "alpha": 0, "varpro": true, "bc": "reflective", "workdir": "fit1"}
+and progress is streamed as one JSON event per line from /jobs/ID/events.
+Workers keep the parsed data, discretizations and computed propagations
+of earlier jobs, so repeated fits of the same data set start warm.
+"""
+import os
+import sys
+import json
+import time
+import threading
+import collections
+import functools as ft
+import argparse as ap
+import concurrent.futures as cf
+import urllib.request
+import http.server
+import numpy as np
+import fitting_scripts.inputOutput as io
+import fitting_scripts.FPModel as fp
+import fitting_scripts.DF_fitting as df
+import fitting_scripts.execution as ex
+
+DEFAULTS = {'dt': None, 'timepoints': 'all', 'runs': 10, 'alpha': 0, 'varpro': True,
+            'bc': 'reflective', 'seed': 0, 'workdir': None, 'reports': ['numbers'],
+            'kind': 'fit', 'parameters': None, 'crit_err': 0.3}
+_profile_caches = collections.OrderedDict()  # propagations in worker processes, per data set
+PROFILES_CACHE_SIZE = 4096  # profile sets per data set
+DATA_CACHE_SIZE = 16  # data sets, as load_data
+
+
+# ---------------------------------------------------------------------------
+# worker side
+
+
+def worker_initializer(threads):
+    """Limit BLAS threads and load the numerical modules once per worker."""
+    ex.worker_initializer(threads)
+    import scipy.optimize  # noqa: F401, warm import for first job
+
+
+def warm_up():
+    """No-op task, forces workers to start before the first job arrives."""
+    return os.getpid()
+
+
+@ft.lru_cache(maxsize=16)
+def load_data(path, mtime, dt, timepoints):
+    """
+    Read and discretize a data set, cached per worker.
+
+    mtime is part of the key, so files that changed on disk are read again.
+    returns xx, cc (with t=0 profile), tt, dxx_dist, dxx_width
+    """
+    data = io.readSeparated(path)
+    xx = data[:, 0]
+    tt = 'all' if timepoints == 'all' else np.array(timepoints)
+    cc, tt = io.selectProfiles(data, dt, tt)
+    dxx_dist, dxx_width = fp.discretization_Block(xx)
+    return xx, fp.build_zero_profile(cc), tt, dxx_dist, dxx_width
+
+
+def job_data(spec):
+    """Cached data of a job specification."""
+    timepoints = spec['timepoints']
+    if timepoints != 'all':
+        timepoints = tuple(timepoints)
+    return load_data(spec['path'], spec['mtime'], spec['dt'], timepoints)
+
+
+def profile_cache(spec):
+    """Profile cache of the job's data set, shared by all jobs in this worker."""
+    key = (spec['path'], spec['mtime'], spec['dt'], str(spec['timepoints']))
+    if key not in _profile_caches:
+        _profile_caches[key] = df.ProfileCache(PROFILES_CACHE_SIZE)
+        if len(_profile_caches) > DATA_CACHE_SIZE:
+            _profile_caches.popitem(last=False)
+    _profile_caches.move_to_end(key)
+    return _profile_caches[key]
+
+
+def cached_profiles(spec, parameters):
+    """Numerical profiles for parameters, reused between jobs on the same data."""
+    xx, cc, tt, dxx_dist, dxx_width = job_data(spec)
+    return np.array(df.theoretical_profiles(parameters, xx, cc, tt, dxx_dist, dxx_width,
+                                            bc=spec['bc'], cache=profile_cache(spec)))
+
+
+def fit_run(spec, run):
+    """
+    One start of the multistart fit, start values drawn from seed+run.
+
+    Propagations are looked up in the profile cache of the worker, so repeated
+    or similar jobs on the same data reuse them.
+    """
+    xx, cc, tt, dxx_dist, dxx_width = job_data(spec)
+    np.random.seed(spec['seed'] + run)
+    bnds, inits = df.initialize_optimization(1, 2, len(cc)-1, xx)
+    cache = profile_cache(spec)
+    start, hits = time.time(), cache.hits
+    res = df.optimization(inits[0], bnds, xx, cc, tt, dxx_dist, dxx_width, spec['alpha'],
+                          varpro=spec['varpro'], bc=spec['bc'], cache=cache)
+    res.time = time.time() - start
+    res.cache_hits = cache.hits - hits
+    return res
+
+
+def summary(spec, parameters):
+    """D, F profiles and scaled residual error for final parameters."""
+    xx, cc, tt, dxx_dist, dxx_width = job_data(spec)
+    parameters = np.asarray(parameters, dtype=float)
+    if parameters.size == 6:  # scalings follow from closed form
+        parameters = df.project_scalings(parameters, xx, cc, tt, dxx_dist, dxx_width,
+                                         spec['alpha'], bc=spec['bc'],
+                                         cache=profile_cache(spec))
+    cc_theo = cached_profiles(spec, parameters)
+    D, F = df.sigmoidal_profiles(parameters[:6], xx)
+    residuals = df.residuals(parameters, cc, cc_theo, 0)
+    return {'x': parameters.tolist(), 'D': D.tolist(), 'F': (F - F[0]).tolist(),
+            'error': float(np.sqrt(np.mean(residuals**2))),
+            'cc_theo': cc_theo.tolist(), 'tt': np.asarray(tt, dtype=float).tolist()}
+
+
+def analyze(spec):
+    """Analysis of all runs stored in the job's working directory."""
+    xx, cc, tt, dxx_dist, dxx_width = job_data(spec)
+    savePath = os.path.join(spec['workdir'], 'results/')
+    with df.pd.HDFStore(os.path.join(spec['workdir'], 'results.h5'), mode='r') as results:
+        df.analysis(results, xx, cc, tt, dxx_dist, dxx_width, spec['alpha'],
+                    crit_err=spec['crit_err'], savePath=savePath, bc=spec['bc'],
+                    reports=spec['reports'], workers=1)
+    return savePath
+
+
+# ---------------------------------------------------------------------------
+# service side
+
+
+def job_spec(payload):
+    """Validate a posted job and fill in defaults, raises ValueError."""
+    spec = dict(DEFAULTS)
+    unknown = set(payload) - set(DEFAULTS) - {'path'}
+    if unknown:
+        raise ValueError('unknown job fields: %s' % ', '.join(sorted(unknown)))
+    spec.update(payload)
+    if 'path' not in payload or not os.path.isfile(payload['path']):
+        raise ValueError('data file not found: %s' % payload.get('path'))
+    if spec['dt'] is None:
+        raise ValueError('temporal resolution dt is required')
+    if spec['kind'] not in ('fit', 'profiles'):
+        raise ValueError("kind must be 'fit' or 'profiles'")
+    if spec['kind'] == 'profiles' and spec['parameters'] is None:
+        raise ValueError('profiles jobs need parameters')
+    if spec['bc'] not in ('reflective', 'open1side'):
+        raise ValueError("bc must be 'reflective' or 'open1side'")
+    spec['path'] = os.path.abspath(spec['path'])
+    spec['mtime'] = os.path.getmtime(spec['path'])
+    spec['dt'], spec['runs'] = int(spec['dt']), int(spec['runs'])
+    if spec['workdir'] is not None:
+        spec['workdir'] = os.path.abspath(spec['workdir'])
+        os.makedirs(spec['workdir'], exist_ok=True)
+    return spec
+
+
+class Job:
+    """State and event log of one job, events are appended by the dispatcher."""
+
+    def __init__(self, idx, spec):
+        self.idx = idx
+        self.spec = spec
+        self.state = 'queued'
+        self.events = []
+        self.result = None
+        self.changed = threading.Condition()
+
+    def emit(self, event, **data):
+        with self.changed:
+            self.events.append(dict(event=event, job=self.idx, time=time.time(), **data))
+            if event in ('done', 'error'):
+                self.state = event
+            self.changed.notify_all()
+
+    def status(self):
+        return {'job': self.idx, 'state': self.state, 'events': len(self.events),
+                'result': self.result}
+
+
+class FitService:
+    """Dispatches jobs to the warm process pool."""
+
+    def __init__(self, workers=None, bins=50):
+        workers, threads = ex.split_cores(bins, workers=workers)
+        self.pool = cf.ProcessPoolExecutor(max_workers=workers, initializer=worker_initializer,
+                                           initargs=(threads,))
+        cf.wait([self.pool.submit(warm_up) for _ in range(workers)])
+        self.workers = workers
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, payload):
+        spec = job_spec(payload)
+        with self.lock:
+            job = Job(len(self.jobs) + 1, spec)
+            self.jobs[job.idx] = job
+        threading.Thread(target=self.run, args=(job,), daemon=True).start()
+        return job
+
+    def run(self, job):
+        try:
+            job.state = 'running'
+            if job.spec['kind'] == 'profiles':
+                job.result = self.pool.submit(summary, job.spec, job.spec['parameters']).result()
+            else:
+                job.result = self.fit(job)
+            job.emit('done', result=job.result)
+        except Exception as err:  # reported to the client, the service keeps running
+            job.emit('error', message='%s: %s' % (type(err).__name__, err))
+
+    def fit(self, job):
+        spec = job.spec
+        futures = {self.pool.submit(fit_run, spec, run): run for run in range(spec['runs'])}
+        job.emit('started', runs=spec['runs'], workers=self.workers)
+        results = None
+        if spec['workdir'] is not None:
+            results = df.pd.HDFStore(os.path.join(spec['workdir'], 'results.h5'), complevel=9)
+        best, completed = None, 0
+        try:
+            for future in cf.as_completed(futures):
+                res = future.result()
+                completed += 1
+                if results is not None:
+                    df.append_result(res, results, completed)
+                if best is None or res.cost < best.cost:
+                    best = res
+                job.emit('run', run=futures[future], completed=completed, cost=float(res.cost),
+                         best_cost=float(best.cost), seconds=res.time,
+                         cache_hits=res.cache_hits, x=res.x.tolist())
+        finally:
+            if results is not None:
+                results.close()
+        result = self.pool.submit(summary, spec, best.x).result()
+        result['cost'] = float(best.cost)
+        if spec['workdir'] is not None:
+            result['savePath'] = self.pool.submit(analyze, spec).result()
+        return result
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """JSON API: POST /jobs, GET /jobs/ID, GET /jobs/ID/events, GET /health."""
+    service = None
+
+    def send_json(self, obj, code=200):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def job(self, part):
+        try:
+            return self.service.jobs[int(part)]
+        except (ValueError, KeyError):
+            self.send_json({'error': 'unknown job %s' % part}, code=404)
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            return self.send_json({'error': 'not found'}, code=404)
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            job = self.service.submit(payload)
+        except (ValueError, TypeError) as err:
+            return self.send_json({'error': str(err)}, code=400)
+        self.send_json({'job': job.idx, 'events': '/jobs/%i/events' % job.idx}, code=202)
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts == ['health']:
+            return self.send_json({'workers': self.service.workers,
+                                   'jobs': len(self.service.jobs)})
+        if len(parts) == 2 and parts[0] == 'jobs':
+            job = self.job(parts[1])
+            return job and self.send_json(job.status())
+        if len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'events':
+            job = self.job(parts[1])
+            return job and self.stream(job)
+        self.send_json({'error': 'not found'}, code=404)
+
+    def stream(self, job):
+        """Send events as JSON lines until the job has finished."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        sent = 0
+        while True:
+            with job.changed:
+                job.changed.wait_for(lambda: len(job.events) > sent or
+                                     job.state in ('done', 'error'), timeout=30)
+                events, finished = job.events[sent:], job.state in ('done', 'error')
+            for event in events:
+                self.wfile.write((json.dumps(event) + '\n').encode())
+            self.wfile.flush()
+            sent += len(events)
+            if finished and sent == len(job.events):
+                break
+
+    def log_message(self, format, *args):
+        pass  # keep console for job progress
+
+
+def serve(port=8765, workers=None, bins=50, host='127.0.0.1'):
+    """Start warm workers and serve jobs until interrupted."""
+    Handler.service = FitService(workers=workers, bins=bins)
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    print('Serving fit jobs on http://%s:%i with %i warm workers'
+          % (host, server.server_address[1], Handler.service.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('\nShutting down service.')
+    finally:
+        server.server_close()
+        Handler.service.shutdown()
+
+
+def submit(job, url='http://127.0.0.1:8765', stream=sys.stdout):
+    """Post a job and print its events, returns the final event."""
+    request = urllib.request.Request(url + '/jobs', data=json.dumps(job).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        events = json.loads(response.read())['events']
+    event = None
+    with urllib.request.urlopen(url + events) as response:
+        for line in response:
+            event = json.loads(line)
+            if stream is not None and event['event'] != 'done':
+                print(json.dumps(event), file=stream)
+    return event
+
+
+def main():
+    """Run the fit-job service, or submit a job to a running one."""
+    parser = ap.ArgumentParser(description=(
+        """
+        Local service keeping warm worker processes for fits. Without -submit
+        the service is started, with -submit a JSON job file is sent to it
+        and progress is printed.
+        """), formatter_class=ap.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-port', dest='port', type=int, default=8765,
+                        help='Port on localhost.')
+    parser.add_argument('-workers', dest='workers', type=int, default=None,
+                        help='Number of warm worker processes, default follows execution policy.')
+    parser.add_argument('-bins', dest='bins', type=int, default=50,
+                        help='Typical grid size, used for the split of cores.')
+    parser.add_argument('-submit', dest='submit', type=str, default=None,
+                        help='JSON file with job to submit to a running service.')
+    args = parser.parse_args()
+    if args.submit is not None:
+        with open(args.submit, 'r') as file:
+            event = submit(json.load(file), url='http://127.0.0.1:%i' % args.port)
+        if event['event'] == 'error':
+            print('Error: %s' % event['message'])
+            sys.exit(1)
+        result = event['result']
+        print('Finished job %i, best cost %.5g, parameters:\n%s'
+              % (event['job'], result.get('cost', np.nan), np.array(result['x'])))
+        sys.exit()
+    serve(port=args.port, workers=args.workers, bins=args.bins)
+
+
+if __name__ == "__main__":
+    main()
@@ -16,4 +16,8 @@ if __name__ == "__main__":
             zip_safe=False,
             requires=['numpy (>=1.10.4)', 'xlsxwriter (>=1.0.0)', 'matplotlib (>=2.2.2)', 'scipy (>=1.0.1)'],
             install_requires=['numpy>=1.10.4', 'xlsxwriter>=1.0.0', 'matplotlib>=2.2.2', 'scipy>=1.0.1'],
-            entry_points={'console_scripts': ['DF_fitting=fitting_scripts.DF_fitting:main', ],},)
+            extras_require={'threads': ['threadpoolctl>=2.0.0']},
+            entry_points={'console_scripts': ['DF_fitting=fitting_scripts.DF_fitting:main',
+                                              'DF_fitting_calibrate=fitting_scripts.execution:main',
+                                              'DF_fitting_service=fitting_scripts.service:main',
+                                              'DF_fitting_campaign=fitting_scripts.bundle:main'],},)